@@ -0,0 +1,325 @@
+"""Vectorized backtester for the BuyStop/SellStop martingale grid.
+
+Runs the grid rules of trading_service (initialize_strategy, check_and_manage_grid,
+check_drawdown_and_close_all) over tick arrays without replaying run_bot:
+
+*   The grid is placed on the first tick: BuyStop at ask + distance, SellStop at bid - distance,
+    both with the initial lot.
+*   A trigger opens a position at the crossing tick's price. The opposite side is (re)armed at its
+    original level with its next lot, the triggered side waits until the opposite side fills, and
+    the triggered side's next lot becomes last lot * LOT_MULTIPLIER.
+*   When equity falls MAX_DRAWDOWN_PERCENT below the initial deposit, everything is closed at that
+    tick and the run stops (run_bot halts after a stop-out as well).
+*   Only the level orders are modelled (GRID_DEPTH = 1): continuation legs are not, and
+    default_params() refuses a deeper configuration rather than report results for another grid.
+
+Because both levels are fixed, trigger crossings are found with one vectorized comparison per
+level and a searchsorted per trigger, and the equity curve is built per batch from the
+piecewise-constant exposure between triggers. Input can be fed in batches (e.g. per-day arrays).
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import utils.constants as const
+import utils.grid_math as grid_math
+import backtesting.market_data as market_data
+
+GridParams = namedtuple('GridParams', [
+    'lot_multiplier', 'order_distance_pips', 'max_drawdown_percent', 'initial_lot', 'balance_percent_for_lot',
+    'initial_balance', 'digits', 'stops_level', 'contract_size', 'leverage', 'volume_min', 'volume_max',
+    'volume_step'])
+
+BacktestResult = namedtuple('BacktestResult', [
+    'time_msc', 'equity', 'trades', 'max_drawdown', 'max_drawdown_percent', 'final_equity', 'final_balance',
+    'stopped_out', 'stop_out_time_msc', 'ticks'])
+
+TRADE_COLUMNS = ['time_msc', 'tick_index', 'side', 'entry', 'volume', 'price', 'profit']
+
+DEFAULT_BATCH_SIZE = 5_000_000
+
+def default_params(**overrides):
+    """GridParams from utils/constants.py (symbol spec defaults match a 5-digit FX major)."""
+    if const.GRID_DEPTH != 1:
+        raise ValueError(f"GRID_DEPTH = {const.GRID_DEPTH}: the backtester only models the level orders, "
+                         "not continuation legs. Set GRID_DEPTH = 1 to backtest.")
+    params = GridParams(
+        lot_multiplier=const.LOT_MULTIPLIER,
+        order_distance_pips=const.ORDER_DISTANCE_PIPS,
+        max_drawdown_percent=const.MAX_DRAWDOWN_PERCENT,
+        initial_lot=const.INITIAL_LOT,
+        balance_percent_for_lot=const.BALANCE_PERCENT_FOR_LOT,
+        initial_balance=const.SIM_INITIAL_BALANCE,
+        digits=5,
+        stops_level=0,
+        contract_size=100000.0,
+        leverage=const.SIM_LEVERAGE,
+        volume_min=0.01,
+        volume_max=100.0,
+        volume_step=0.01,
+    )
+    return params._replace(**overrides)
+
+class GridBacktest:
+    """Streaming grid backtest. Call feed() with consecutive tick batches, then result()."""
+
+    def __init__(self, params, keep_equity=True):
+        self.p = params
+        self.keep_equity = keep_equity
+        self.initialized = False
+        self.stopped_out = False
+        self.stop_out_time_msc = None
+        self.balance = float(params.initial_balance)
+        self.initial_deposit = self.balance
+        self.stop_equity = self.initial_deposit * (1 - params.max_drawdown_percent / 100.0)
+        # Exposure: buy/sell volume and volume-weighted entry sums (per contract unit)
+        self.buy_volume = self.buy_cost = self.sell_volume = self.sell_cost = 0.0
+        self.open_positions = [] # (side, volume, price) for the close-out trade list
+        self.trades = []
+        self.peak = self.balance
+        self.max_drawdown = 0.0
+        self.max_drawdown_percent = 0.0
+        self.last_equity = self.balance
+        self.ticks = 0
+        self.time_chunks = []
+        self.equity_chunks = []
+
+    # --- Grid rules ---
+
+    def _initialize(self, bid, ask):
+        p = self.p
+        point = 10 ** -p.digits
+        distance, _ = grid_math.distance_points(p.order_distance_pips, p.digits, p.stops_level)
+        if p.initial_lot > 0:
+            lot = p.initial_lot
+        else:
+            margin_per_lot = p.contract_size * ask / p.leverage
+            lot = grid_math.balance_percent_lot(self.balance, p.balance_percent_for_lot, margin_per_lot)
+        lot = self._normalize(lot)
+        if lot <= 0:
+            lot = p.volume_min
+        self.buy_level = round(ask + distance * point, p.digits)
+        self.sell_level = round(bid - distance * point, p.digits)
+        self.buy_armed = self.sell_armed = True
+        self.last_buy_lot = self.last_sell_lot = lot
+        self.next_buy_lot = self.next_sell_lot = grid_math.next_lot(lot, p.lot_multiplier)
+        self.initialized = True
+
+    def _normalize(self, lot):
+        return grid_math.normalize_lot(lot, self.p.volume_min, self.p.volume_max, self.p.volume_step)
+
+    def _trigger(self, side):
+        # Mirrors check_and_manage_grid: returns the volume of the position that just opened
+        if side == 'buy':
+            volume = self.last_buy_lot
+            self.last_sell_lot = self._normalize(self.next_sell_lot)
+            self.next_buy_lot = grid_math.next_lot(volume, self.p.lot_multiplier)
+            self.buy_armed, self.sell_armed = False, True
+        else:
+            volume = self.last_sell_lot
+            self.last_buy_lot = self._normalize(self.next_buy_lot)
+            self.next_sell_lot = grid_math.next_lot(volume, self.p.lot_multiplier)
+            self.buy_armed, self.sell_armed = True, False
+        return volume
+
+    # --- Batch processing ---
+
+    def feed(self, time_msc, bid, ask):
+        n = len(bid)
+        if self.stopped_out or n == 0:
+            return
+        if not self.initialized:
+            self._initialize(float(bid[0]), float(ask[0]))
+
+        # All candidate trigger ticks for each (fixed) level, found in one pass each
+        up_hits = np.flatnonzero(ask >= self.buy_level)
+        down_hits = np.flatnonzero(bid <= self.sell_level)
+
+        # Walk the alternating trigger sequence: one searchsorted per trigger, no per-tick branching
+        event_index, event_side, event_volume, event_price = [], [], [], []
+        cursor = 0
+        while True:
+            next_up = n
+            if self.buy_armed:
+                i = np.searchsorted(up_hits, cursor)
+                if i < len(up_hits):
+                    next_up = int(up_hits[i])
+            next_down = n
+            if self.sell_armed:
+                i = np.searchsorted(down_hits, cursor)
+                if i < len(down_hits):
+                    next_down = int(down_hits[i])
+            k = min(next_up, next_down)
+            if k >= n:
+                break
+            side = 'buy' if next_up <= next_down else 'sell'
+            event_index.append(k)
+            event_side.append(side)
+            event_volume.append(self._trigger(side))
+            event_price.append(float(ask[k]) if side == 'buy' else float(bid[k]))
+            cursor = k + 1
+
+        # Piecewise-constant exposure per segment between triggers
+        buy_volume, buy_cost, sell_volume, sell_cost = [self.buy_volume], [self.buy_cost], [self.sell_volume], [self.sell_cost]
+        for side, volume, price in zip(event_side, event_volume, event_price):
+            if side == 'buy':
+                buy_volume.append(buy_volume[-1] + volume)
+                buy_cost.append(buy_cost[-1] + volume * price)
+                sell_volume.append(sell_volume[-1])
+                sell_cost.append(sell_cost[-1])
+            else:
+                sell_volume.append(sell_volume[-1] + volume)
+                sell_cost.append(sell_cost[-1] + volume * price)
+                buy_volume.append(buy_volume[-1])
+                buy_cost.append(buy_cost[-1])
+        lengths = np.diff(np.array([0] + event_index + [n]))
+        cs = self.p.contract_size
+        base = self.balance + cs * (np.array(sell_cost) - np.array(buy_cost))
+        equity = (np.repeat(base, lengths)
+                  + cs * (np.repeat(np.array(buy_volume) * 1.0, lengths) * bid
+                          - np.repeat(np.array(sell_volume) * 1.0, lengths) * ask))
+
+        # Drawdown stop-out: first tick at or below the equity floor (later triggers never happened)
+        breaches = np.flatnonzero(equity <= self.stop_equity)
+        end = n
+        if len(breaches):
+            end = int(breaches[0]) + 1
+            kept = np.searchsorted(np.array(event_index, dtype=np.int64), end)
+            event_index, event_side = event_index[:kept], event_side[:kept]
+            event_volume, event_price = event_volume[:kept], event_price[:kept]
+            equity = equity[:end]
+
+        for k, side, volume, price in zip(event_index, event_side, event_volume, event_price):
+            self.trades.append((int(time_msc[k]), self.ticks + k, side, 'in', volume, price, 0.0))
+            self.open_positions.append((side, volume, price))
+        self.buy_volume, self.buy_cost = buy_volume[len(event_index)], buy_cost[len(event_index)]
+        self.sell_volume, self.sell_cost = sell_volume[len(event_index)], sell_cost[len(event_index)]
+
+        # Running peak-to-trough drawdown carried across batches
+        peaks = np.maximum(np.maximum.accumulate(equity), self.peak)
+        drawdowns = peaks - equity
+        worst = int(np.argmax(drawdowns))
+        if drawdowns[worst] > self.max_drawdown:
+            self.max_drawdown = float(drawdowns[worst])
+            self.max_drawdown_percent = float(drawdowns[worst] / peaks[worst] * 100)
+        self.peak = float(peaks[-1])
+        self.last_equity = float(equity[-1])
+
+        if self.keep_equity:
+            self.time_chunks.append(np.asarray(time_msc[:end]))
+            self.equity_chunks.append(equity)
+
+        if end < n:
+            self._close_all(int(time_msc[end - 1]), self.ticks + end - 1, float(bid[end - 1]), float(ask[end - 1]))
+        self.ticks += end
+
+    def _close_all(self, time_msc, tick_index, bid, ask):
+        cs = self.p.contract_size
+        for side, volume, price in self.open_positions:
+            close_price = bid if side == 'buy' else ask
+            profit = (close_price - price) * volume * cs if side == 'buy' else (price - close_price) * volume * cs
+            self.balance += profit
+            self.trades.append((time_msc, tick_index, side, 'out', volume, close_price, profit))
+        self.open_positions = []
+        self.buy_volume = self.buy_cost = self.sell_volume = self.sell_cost = 0.0
+        self.last_equity = self.balance
+        self.stopped_out = True
+        self.stop_out_time_msc = time_msc
+
+    def result(self):
+        import pandas as pd # Imported on first use: loading the module stays light
+        if self.keep_equity and self.equity_chunks:
+            times, equity = np.concatenate(self.time_chunks), np.concatenate(self.equity_chunks)
+        else:
+            times, equity = np.empty(0, dtype=np.int64), np.empty(0)
+        return BacktestResult(
+            time_msc=times,
+            equity=equity,
+            trades=pd.DataFrame(self.trades, columns=TRADE_COLUMNS),
+            max_drawdown=self.max_drawdown,
+            max_drawdown_percent=self.max_drawdown_percent,
+            final_equity=self.last_equity,
+            final_balance=self.balance,
+            stopped_out=self.stopped_out,
+            stop_out_time_msc=self.stop_out_time_msc,
+            ticks=self.ticks,
+        )
+
+def run_backtest(time_msc, bid, ask, params=None, batch_size=DEFAULT_BATCH_SIZE, keep_equity=True):
+    """Backtests the grid over tick arrays, processing them in zero-copy batches."""
+    batches = ((time_msc[start:start + batch_size], bid[start:start + batch_size], ask[start:start + batch_size])
+               for start in range(0, len(bid), batch_size))
+    return run_backtest_batches(batches, params, keep_equity)
+
+def run_backtest_batches(batches, params=None, keep_equity=True):
+    """Backtests the grid over consecutive (time_msc, bid, ask) batches, e.g. the per-day views of
+    MarketDataStore.tick_batches()."""
+    backtest = GridBacktest(params or default_params(), keep_equity=keep_equity)
+    for time_msc, bid, ask in batches:
+        backtest.feed(time_msc, bid, ask)
+        if backtest.stopped_out:
+            break
+    return backtest.result()
+
+def bars_to_ticks(time_msc, open_, high, low, close, spread_points, digits=5):
+    """Expands OHLC bars into 4 pseudo-ticks each (O-L-H-C for bullish bars, O-H-L-C for bearish)."""
+    point = 10 ** -digits
+    bullish = close >= open_
+    path = np.empty((len(open_), 4))
+    path[:, 0] = open_
+    path[:, 1] = np.where(bullish, low, high)
+    path[:, 2] = np.where(bullish, high, low)
+    path[:, 3] = close
+    bid = path.ravel()
+    spread = np.broadcast_to(np.asarray(spread_points, dtype=float), (len(open_),))
+    ask = bid + np.repeat(spread, 4) * point
+    return np.repeat(np.asarray(time_msc, dtype=np.int64), 4), bid, ask
+
+def load_ticks(path):
+    """Loads ticks from .npz (time_msc/bid/ask arrays), CSV (time_msc,bid,ask columns), a tick
+    capture .ring file or a market data store directory (<root>/<SYMBOL>, see backtesting/market_data.py)."""
+    if os.path.isdir(path):
+        store, symbol = market_data.open_tick_path(path)
+        return store.load_ticks(symbol)
+    if path.endswith('.ring'):
+        from mt5_functions.tick_recorder import load_ticks as load_capture # Brings in the bot's logger/metrics
+        return load_capture(path)
+    if path.endswith('.npz'):
+        data = np.load(path)
+        return data['time_msc'], data['bid'], data['ask']
+    import pandas as pd
+    frame = pd.read_csv(path, usecols=['time_msc', 'bid', 'ask'])
+    return frame['time_msc'].to_numpy(np.int64), frame['bid'].to_numpy(float), frame['ask'].to_numpy(float)
+
+def summarize(result):
+    return (f"ticks={result.ticks} trades={len(result.trades)} final_equity={result.final_equity:.2f} "
+            f"max_dd={result.max_drawdown:.2f} ({result.max_drawdown_percent:.2f}%) stopped_out={result.stopped_out}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest the BuyStop/SellStop martingale grid over recorded ticks.")
+    parser.add_argument('ticks', help="Tick file (.npz with time_msc/bid/ask, CSV with those columns, or a tick capture .ring) or market data store directory (<root>/<SYMBOL>)")
+    parser.add_argument('--lot-multiplier', type=float, default=const.LOT_MULTIPLIER)
+    parser.add_argument('--distance-pips', type=float, default=const.ORDER_DISTANCE_PIPS)
+    parser.add_argument('--max-drawdown', type=float, default=const.MAX_DRAWDOWN_PERCENT)
+    args = parser.parse_args()
+
+    try:
+        params = default_params(lot_multiplier=args.lot_multiplier, order_distance_pips=args.distance_pips,
+                                max_drawdown_percent=args.max_drawdown)
+    except ValueError as e:
+        parser.error(str(e))
+    started = time.perf_counter()
+    if os.path.isdir(args.ticks):
+        # Market data store: fed day by day straight from the mapped files
+        store, symbol = market_data.open_tick_path(args.ticks)
+        result = run_backtest_batches(store.tick_batches(symbol), params)
+    else:
+        times, bids, asks = load_ticks(args.ticks)
+        result = run_backtest(times, bids, asks, params)
+    print(summarize(result))
+    print(f"Backtest of {result.ticks} ticks took {time.perf_counter() - started:.2f}s")
+    if len(result.trades):
+        print(result.trades.to_string(max_rows=40))
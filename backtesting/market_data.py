@@ -0,0 +1,234 @@
+"""Local store of terminal history (ticks and M1 bars) for research.
+
+History is pulled with copy_ticks_range / copy_rates_range once and kept on disk, one directory
+per symbol and UTC day, one .npy file per column:
+
+    <root>/EURUSD/ticks/2024-03-01/time_msc.npy, bid.npy, ask.npy, flags.npy
+    <root>/EURUSD/M1/2024-03-01/time.npy, open.npy, high.npy, low.npy, close.npy, tick_volume.npy, spread.npy
+
+A sync only fetches what is missing after the newest stored tick/bar (the last, partial day is
+completed, earlier days are never fetched again). Reads map the column files with
+np.load(mmap_mode='r'), so a day is a zero-copy view served from the page cache, and processes
+reading the same days (optimizer workers) share one copy in memory.
+
+Example:
+    python -m backtesting.market_data sync EURUSD --days 90
+    python -m backtesting.market_data info EURUSD
+    python -m backtesting.grid_backtest market_data/EURUSD
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+DEFAULT_ROOT = 'market_data'
+DAY_MS = 86_400_000
+
+TICK_COLUMNS = {'time_msc': '<i8', 'bid': '<f8', 'ask': '<f8', 'flags': '<u4'}
+BAR_COLUMNS = {'time': '<i8', 'open': '<f8', 'high': '<f8', 'low': '<f8', 'close': '<f8',
+               'tick_volume': '<u8', 'spread': '<i4'}
+TICKS, BARS = 'ticks', 'M1'
+
+def _day_name(day):
+    return datetime.fromtimestamp(day * 86400, tz=timezone.utc).strftime('%Y-%m-%d')
+
+def _day_number(name):
+    return int(datetime.strptime(name, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()) // 86400
+
+class MarketDataStore:
+    """Day-partitioned, columnar .npy store under `root` (see the module docstring)."""
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    def _dir(self, symbol, kind, day=None):
+        path = os.path.join(self.root, symbol, kind)
+        return path if day is None else os.path.join(path, _day_name(day))
+
+    def days(self, symbol, kind=TICKS):
+        """Stored days (days since the epoch, UTC), oldest first."""
+        path = self._dir(symbol, kind)
+        if not os.path.isdir(path):
+            return []
+        # '.' in the name: .tmp/.old directory left by an interrupted write
+        return sorted(_day_number(name) for name in os.listdir(path) if '.' not in name)
+
+    # --- Reads ---
+
+    def read_day(self, symbol, day, kind=TICKS, mmap=True):
+        """{column: read-only memory-mapped array} of one stored day (`mmap=False`: loaded into memory)."""
+        columns = TICK_COLUMNS if kind == TICKS else BAR_COLUMNS
+        path = self._dir(symbol, kind, day)
+        return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None) for name in columns}
+
+    def iter_days(self, symbol, start=None, end=None, kind=TICKS):
+        """Yields (day, columns) for the stored days in [start, end] (datetime, date string or None)."""
+        first, last = _to_day(start), _to_day(end)
+        for day in self.days(symbol, kind):
+            if (first is None or day >= first) and (last is None or day <= last):
+                yield day, self.read_day(symbol, day, kind)
+
+    def tick_batches(self, symbol, start=None, end=None):
+        """(time_msc, bid, ask) views per day, for GridBacktest.feed()."""
+        for _, columns in self.iter_days(symbol, start, end):
+            yield columns['time_msc'], columns['bid'], columns['ask']
+
+    def load_ticks(self, symbol, start=None, end=None):
+        """(time_msc, bid, ask) for the whole range. A single day is returned as views; several days
+        are concatenated (one copy) into contiguous arrays."""
+        batches = list(self.tick_batches(symbol, start, end))
+        if len(batches) == 1:
+            return batches[0]
+        if not batches:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        return tuple(np.concatenate(column) for column in zip(*batches))
+
+    # --- Writes ---
+
+    def _write_day(self, symbol, kind, day, columns):
+        # Written to a temporary directory and swapped in, so readers never see a half-written day
+        path = self._dir(symbol, kind, day)
+        tmp = path + '.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        for name, values in columns.items():
+            np.save(os.path.join(tmp, name + '.npy'), values)
+        if os.path.isdir(path):
+            old = path + '.old'
+            os.replace(path, old)
+            os.replace(tmp, path)
+            for name in os.listdir(old):
+                os.remove(os.path.join(old, name))
+            os.rmdir(old)
+        else:
+            os.replace(tmp, path)
+
+    def append(self, symbol, kind, records, time_column):
+        """Appends records (structured array or {column: array}, sorted by time) to their days.
+        Returns the number of records written."""
+        columns = TICK_COLUMNS if kind == TICKS else BAR_COLUMNS
+        if not len(records[time_column]):
+            return 0
+        times_ms = np.asarray(records[time_column], dtype=np.int64) * (1 if kind == TICKS else 1000)
+        day_of = times_ms // DAY_MS
+        stored = set(self.days(symbol, kind))
+        for day in np.unique(day_of):
+            rows = day_of == day
+            new = {name: np.asarray(records[name][rows], dtype=dtype) for name, dtype in columns.items()}
+            if int(day) in stored:
+                # The partial last day: merged with what is stored (the only day ever rewritten)
+                old = self.read_day(symbol, int(day), kind, mmap=False) # Not mapped: its files are replaced below
+                new = {name: np.concatenate([old[name], new[name]]) for name in columns}
+            self._write_day(symbol, kind, int(day), new)
+        return len(times_ms)
+
+    def last_time(self, symbol, kind=TICKS):
+        """(last time, records stored at that time) of the newest stored record, or (None, 0)."""
+        days = self.days(symbol, kind)
+        if not days:
+            return None, 0
+        times = self.read_day(symbol, days[-1], kind)['time_msc' if kind == TICKS else 'time']
+        if not len(times):
+            return None, 0
+        last = int(times[-1])
+        return last, int(len(times) - np.searchsorted(times, last))
+
+    # --- Sync from the terminal ---
+
+    def sync_ticks(self, symbol, start=None, end=None, chunk_days=1):
+        """Fetches the ticks after the newest stored one (or from `start`) up to `end` (default now),
+        one copy_ticks_range call per `chunk_days`. Returns the number of new ticks."""
+        from mt5_functions.backend import bulk_call, mt5 # The terminal is only needed for syncing
+        last_msc, stored_at_last = self.last_time(symbol, TICKS)
+        if last_msc is None and start is None:
+            raise ValueError(f"No {symbol} ticks stored yet: a start date is needed")
+        from_s = last_msc // 1000 if last_msc is not None else int(_to_day(start) * 86400)
+        end_s = int(_to_timestamp(end) if end is not None else time.time())
+        written = 0
+        while from_s <= end_s:
+            to_s = min(from_s + chunk_days * 86400 - 1, end_s)
+            ticks = bulk_call('copy_ticks_range', symbol, from_s, to_s, mt5.COPY_TICKS_ALL)
+            if ticks is None:
+                raise RuntimeError(f"copy_ticks_range({symbol}) failed: {mt5.last_error()}")
+            if last_msc is not None and len(ticks):
+                # The first request restarts at the stored second: skip what is already on disk
+                # (several ticks can share a millisecond, so the count at the last one is matched)
+                keep = np.searchsorted(ticks['time_msc'], last_msc, side='left') + stored_at_last
+                ticks = ticks[min(keep, len(ticks)):]
+                last_msc = None
+            written += self.append(symbol, TICKS, ticks, 'time_msc')
+            from_s = to_s + 1
+        return written
+
+    def sync_bars(self, symbol, start=None, end=None, chunk_days=30):
+        """Fetches M1 bars after the newest stored one (the last stored bar is refetched, it may have
+        been incomplete). Returns the number of bars written."""
+        from mt5_functions.backend import bulk_call, mt5
+        last, _ = self.last_time(symbol, BARS)
+        if last is None and start is None:
+            raise ValueError(f"No {symbol} bars stored yet: a start date is needed")
+        from_s = last if last is not None else int(_to_day(start) * 86400)
+        end_s = int(_to_timestamp(end) if end is not None else time.time())
+        if last is not None:
+            self._drop_last_bar(symbol)
+        written = 0
+        while from_s <= end_s:
+            to_s = min(from_s + chunk_days * 86400 - 1, end_s)
+            rates = bulk_call('copy_rates_range', symbol, mt5.TIMEFRAME_M1, from_s, to_s)
+            if rates is None:
+                raise RuntimeError(f"copy_rates_range({symbol}) failed: {mt5.last_error()}")
+            written += self.append(symbol, BARS, rates, 'time')
+            from_s = to_s + 1
+        return written
+
+    def _drop_last_bar(self, symbol):
+        day = self.days(symbol, BARS)[-1]
+        columns = self.read_day(symbol, day, BARS, mmap=False)
+        self._write_day(symbol, BARS, day, {name: values[:-1] for name, values in columns.items()})
+
+def _to_timestamp(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+def _to_day(value):
+    if value is None:
+        return None
+    return int(_to_timestamp(value)) // 86400
+
+def open_tick_path(path):
+    """(store, symbol) for a '<root>/<SYMBOL>' store directory, as accepted by the backtest tools."""
+    path = os.path.normpath(path)
+    return MarketDataStore(os.path.dirname(path) or '.'), os.path.basename(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sync terminal history into the local market data store, or show what is stored.")
+    parser.add_argument('command', choices=['sync', 'info'])
+    parser.add_argument('symbol')
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    parser.add_argument('--days', type=int, default=30, help="History to fetch when the symbol is not stored yet")
+    parser.add_argument('--no-bars', action='store_true', help="Sync ticks only")
+    args = parser.parse_args()
+    store = MarketDataStore(args.root)
+
+    if args.command == 'sync':
+        import mt5_functions.mt5_api as mt5_api
+        if not mt5_api.connect_mt5():
+            raise SystemExit("Failed to connect to the terminal.")
+        start = time.time() - args.days * 86400
+        started = time.perf_counter()
+        try:
+            ticks = store.sync_ticks(args.symbol, start=start)
+            bars = 0 if args.no_bars else store.sync_bars(args.symbol, start=start)
+        finally:
+            mt5_api.disconnect_mt5()
+        print(f"{args.symbol}: {ticks} new ticks, {bars} bars in {time.perf_counter() - started:.1f}s")
+
+    for kind in (TICKS, BARS):
+        days = store.days(args.symbol, kind)
+        if days:
+            count = sum(len(store.read_day(args.symbol, day, kind)['time_msc' if kind == TICKS else 'time']) for day in days)
+            print(f"{args.symbol} {kind}: {count} records in {len(days)} day(s), {_day_name(days[0])} .. {_day_name(days[-1])}")
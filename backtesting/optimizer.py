@@ -0,0 +1,242 @@
+"""Parallel parameter sweep for the grid strategy.
+
+Spreads a parameter grid (or random samples of it) over a process pool. The tick arrays are
+copied once into shared memory and every worker maps them as NumPy views, so a task only
+carries its parameter values. Each finished backtest is appended to a CSV straight away. A
+ranked table is printed as results stream in, and a re-run with the same results file skips
+combinations that are already done, so an interrupted sweep picks up where it stopped. A sidecar
+file (<results>.meta.json) holds a fingerprint of the ticks and base parameters the results were
+computed from; a re-run with other ticks, base parameters or swept columns is refused (--fresh
+starts the file over).
+
+Example:
+    python -m backtesting.optimizer ticks.npz --param lot_multiplier=1.2:2.0:0.1 \\
+        --param order_distance_pips=10,15,20,30 --param max_drawdown_percent=10:30:5
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtesting.grid_backtest import GridParams, default_params, load_ticks, run_backtest
+
+DEFAULT_SWEEP = {
+    'lot_multiplier': '1.1:2.0:0.1',
+    'order_distance_pips': '10,15,20,25,30,40',
+    'max_drawdown_percent': '10:40:5',
+}
+
+# Metric names differ from GridParams fields so a swept max_drawdown_percent never collides with a result column
+METRIC_COLUMNS = ['final_equity', 'net_profit', 'max_dd', 'max_dd_percent', 'stopped_out', 'trades', 'score']
+
+# --- Parameter space ---
+
+def parse_spec(spec, kind=float):
+    """'a:b:step' -> inclusive range, 'a,b,c' -> list of values, as `kind` (int or float)."""
+    if ':' in spec:
+        start, stop, step = (float(x) for x in spec.split(':'))
+        count = int(round((stop - start) / step)) + 1
+        values = [round(start + i * step, 10) for i in range(count)]
+    else:
+        values = [float(x) for x in spec.split(',')]
+    if kind is int:
+        if any(v != int(v) for v in values):
+            raise ValueError(f"'{spec}' has non-integer values for an integer parameter")
+        return [int(v) for v in values]
+    return values
+
+def build_space(param_specs):
+    defaults = default_params()
+    space = {}
+    for item in param_specs:
+        name, _, spec = item.partition('=')
+        if name not in GridParams._fields:
+            raise ValueError(f"Unknown parameter '{name}'. Valid: {', '.join(GridParams._fields)}")
+        # Typed like the field's default (digits, stops_level and leverage are ints)
+        space[name] = parse_spec(spec, type(getattr(defaults, name)))
+    return space
+
+def grid_candidates(space):
+    names = list(space)
+    for values in itertools.product(*(space[n] for n in names)):
+        yield dict(zip(names, values))
+
+def random_candidates(space, count, seed):
+    # Uniform over each parameter's [min, max] range (continuous sampling, not just grid points;
+    # integer parameters are drawn as integers)
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {n: rng.randint(min(v), max(v)) if isinstance(v[0], int) else round(rng.uniform(min(v), max(v)), 4)
+               for n, v in space.items()}
+
+def candidate_key(candidate):
+    return tuple(sorted((n, round(float(v), 6)) for n, v in candidate.items()))
+
+# --- Shared tick arrays ---
+
+def share_arrays(arrays):
+    """Copies arrays into shared memory once. Returns (segments, descriptors for workers)."""
+    segments, descriptors = [], {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+        segments.append(segment)
+        descriptors[name] = (segment.name, array.shape, array.dtype.str)
+    return segments, descriptors
+
+_worker_arrays = {}
+_worker_segments = []
+
+def _attach(descriptors):
+    # Pool initializer: map the shared tick arrays once per worker process
+    for name, (segment_name, shape, dtype) in descriptors.items():
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _worker_segments.append(segment) # Keep the mapping alive for the worker's lifetime
+        _worker_arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+def _evaluate(base_params, candidates):
+    rows = []
+    for candidate in candidates:
+        params = base_params._replace(**candidate)
+        result = run_backtest(_worker_arrays['time_msc'], _worker_arrays['bid'], _worker_arrays['ask'],
+                              params, keep_equity=False)
+        net_profit = result.final_equity - params.initial_balance
+        rows.append(dict(candidate,
+                         final_equity=round(result.final_equity, 2),
+                         net_profit=round(net_profit, 2),
+                         max_dd=round(result.max_drawdown, 2),
+                         max_dd_percent=round(result.max_drawdown_percent, 4),
+                         stopped_out=int(result.stopped_out),
+                         trades=len(result.trades),
+                         # Return over drawdown; stop-outs rank below every survivor
+                         score=round(net_profit / max(result.max_drawdown, 1.0) - (1e6 if result.stopped_out else 0), 4)))
+    return rows
+
+# --- Results table ---
+
+def sweep_fingerprint(time_msc, bid, ask, base_params):
+    """Digest of the tick data and the base parameters a results file is computed from."""
+    digest = hashlib.sha256()
+    for array in (time_msc, bid, ask):
+        array = np.ascontiguousarray(array)
+        digest.update(array.dtype.str.encode())
+        digest.update(array)
+    digest.update(repr(tuple(base_params)).encode())
+    return digest.hexdigest()
+
+def check_results(results_path, fingerprint, columns, fresh=False):
+    """Raises ValueError if `results_path` holds results of other ticks, base parameters or swept
+    columns (with `fresh`, deletes them instead), then records this sweep in the sidecar file."""
+    meta_path = results_path + '.meta.json'
+    if os.path.exists(results_path) and os.path.getsize(results_path) > 0:
+        if fresh:
+            os.remove(results_path)
+        else:
+            meta = {}
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            with open(results_path, newline='') as f:
+                header = next(csv.reader(f), [])
+            if meta.get('fingerprint') != fingerprint:
+                raise ValueError(f"{results_path} was computed from other ticks or base parameters (or has no {meta_path}). "
+                                 "Use another results file or --fresh.")
+            if header != columns:
+                raise ValueError(f"{results_path} has the columns {header}, this sweep writes {columns}. "
+                                 "Use another results file or --fresh.")
+    with open(meta_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'columns': columns}, f)
+
+def load_done(results_path):
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path, newline='') as f:
+        return {candidate_key({n: v for n, v in row.items() if n not in METRIC_COLUMNS}) for row in csv.DictReader(f)}
+
+def print_ranking(results_path, rank_by, top):
+    import pandas as pd
+    table = pd.read_csv(results_path)
+    print(table.sort_values(rank_by, ascending=False).head(top).to_string(index=False))
+
+def run_sweep(time_msc, bid, ask, space, results_path, mode='grid', samples=100, seed=0, workers=None,
+              batch=4, rank_by='score', top=10, report_every=10.0, base_params=None, fresh=False):
+    base_params = base_params or default_params()
+    columns = list(space) + METRIC_COLUMNS
+    check_results(results_path, sweep_fingerprint(time_msc, bid, ask, base_params), columns, fresh)
+    candidates = grid_candidates(space) if mode == 'grid' else random_candidates(space, samples, seed)
+    done = load_done(results_path)
+    pending = [c for c in candidates if candidate_key(c) not in done]
+    print(f"{len(done)} results already in {results_path}, {len(pending)} candidates to evaluate.")
+    if not pending:
+        print_ranking(results_path, rank_by, top)
+        return
+
+    workers = workers or os.cpu_count()
+    segments, descriptors = share_arrays({'time_msc': time_msc, 'bid': bid, 'ask': ask})
+    write_header = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+    started = last_report = time.perf_counter()
+    completed = 0
+    try:
+        with open(results_path, 'a', newline='') as out, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(descriptors,)) as pool:
+            writer = csv.DictWriter(out, fieldnames=columns)
+            if write_header:
+                writer.writeheader()
+            batches = iter([pending[i:i + batch] for i in range(0, len(pending), batch)])
+            # Keep a bounded number of tasks in flight so results stream and memory stays flat
+            in_flight = {pool.submit(_evaluate, base_params, b) for b in itertools.islice(batches, workers * 2)}
+            while in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    for row in future.result():
+                        writer.writerow(row)
+                        completed += 1
+                    out.flush() # Every finished batch is durable, so an interrupted sweep resumes from here
+                    next_batch = next(batches, None)
+                    if next_batch:
+                        in_flight.add(pool.submit(_evaluate, base_params, next_batch))
+                if time.perf_counter() - last_report >= report_every:
+                    last_report = time.perf_counter()
+                    rate = completed / (last_report - started)
+                    print(f"\n{completed}/{len(pending)} done ({rate:.1f} backtests/s)")
+                    print_ranking(results_path, rank_by, top)
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    elapsed = time.perf_counter() - started
+    print(f"\nSweep finished: {completed} backtests in {elapsed:.1f}s on {workers} workers.")
+    print_ranking(results_path, rank_by, top)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep for the grid strategy.")
+    parser.add_argument('ticks', help="Tick file (.npz with time_msc/bid/ask, CSV with those columns, or a tick capture .ring) or market data store directory (<root>/<SYMBOL>)")
+    parser.add_argument('--param', action='append', default=[],
+                        help="name=start:stop:step or name=v1,v2,... (any GridParams field, repeatable)")
+    parser.add_argument('--mode', choices=['grid', 'random'], default='grid')
+    parser.add_argument('--samples', type=int, default=200, help="Number of random samples (mode=random)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--results', default='optimizer_results.csv', help="Results CSV (appended to, used for resume)")
+    parser.add_argument('--fresh', action='store_true', help="Start the results file over instead of resuming it")
+    parser.add_argument('--rank-by', default='score', choices=METRIC_COLUMNS)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        space = build_space(args.param or [f"{n}={s}" for n, s in DEFAULT_SWEEP.items()])
+    except ValueError as e:
+        parser.error(str(e))
+    times, bids, asks = load_ticks(args.ticks)
+    run_sweep(times, bids, asks, space, args.results, mode=args.mode, samples=args.samples, seed=args.seed,
+              workers=args.workers, rank_by=args.rank_by, top=args.top, fresh=args.fresh)
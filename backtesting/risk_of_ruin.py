@@ -0,0 +1,226 @@
+"""Monte Carlo risk of ruin for the martingale grid.
+
+Simulates many price paths at once and applies the grid rules of grid_backtest to all of them:
+the grid is placed around the start price, fills alternate between the two fixed levels with the
+lot ladder of GridBacktest, and a path is ruined when its equity falls MAX_DRAWDOWN_PERCENT below
+the initial deposit (everything is closed at that step, the bot halts). Like grid_backtest it
+models the level orders only (GRID_DEPTH = 1).
+
+Paths advance one step at a time, vectorized across a chunk of paths. Because both levels are
+fixed, a step is a few array comparisons: price against each path's two trigger thresholds, and
+net_volume * price against a per-path ruin bound (equity is linear in price between fills). Only
+the paths that trigger on a step are updated. Chunks are spread over a process pool.
+
+Price steps are either Gaussian (sigma in points per step) or bootstrapped in blocks from
+recorded returns (any tick source grid_backtest.load_ticks accepts, resampled every step_seconds).
+
+Example:
+    python -m backtesting.risk_of_ruin --paths 1000000 --steps 1440 --sigma-points 15
+    python -m backtesting.risk_of_ruin --returns market_data/EURUSD --step-seconds 60 --lot-multiplier 1.5
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import utils.constants as const
+from backtesting.grid_backtest import GridBacktest, default_params, load_ticks
+
+RuinResult = namedtuple('RuinResult', [
+    'ruined', 'ruin_step', 'final_equity', 'fills', 'steps', 'step_seconds', 'initial_deposit', 'stop_equity'])
+
+DEFAULT_CHUNK = 50_000 # Paths per task: the per-path arrays of a chunk stay in the CPU cache
+MAX_FILLS = 200 # Ladder length; a path that fills this often keeps the last lot
+
+_returns = None # Bootstrap returns of a worker process (set by the pool initializer)
+
+def _set_returns(returns):
+    global _returns
+    _returns = returns
+
+# --- Grid layout ---
+
+def grid_layout(params, bid, ask, max_fills=MAX_FILLS):
+    """(buy_level, sell_level, volumes) of a grid placed at (bid, ask); volumes[k] is the lot of the
+    k-th fill. Taken from GridBacktest's own rules; fills alternate sides, and the ladder is the same
+    whichever side fills first."""
+    backtest = GridBacktest(params, keep_equity=False)
+    backtest._initialize(bid, ask)
+    volumes = [backtest._trigger('buy' if k % 2 == 0 else 'sell') for k in range(max_fills)]
+    return backtest.buy_level, backtest.sell_level, np.array(volumes)
+
+# --- Returns ---
+
+def returns_from_ticks(time_msc, bid, ask, step_seconds):
+    """(mid price change per step_seconds, median spread): the mid price sampled on a fixed clock,
+    so weekend and session gaps show up as single large steps, as they would for the bot."""
+    mid = (np.asarray(bid) + np.asarray(ask)) / 2
+    clock = np.arange(time_msc[0], time_msc[-1] + 1, int(step_seconds * 1000))
+    sampled = mid[np.searchsorted(time_msc, clock, side='right') - 1]
+    return np.diff(sampled), float(np.median(np.asarray(ask) - np.asarray(bid)))
+
+# --- Simulation ---
+
+def simulate_chunk(params, paths, steps, start_price, spread, sigma, block, seed):
+    """Runs `paths` paths for `steps` steps. Returns (ruined, ruin_step, final_equity, fills).
+
+    `sigma` is the Gaussian step in price units; with bootstrap returns loaded (_returns), steps are
+    drawn from them in blocks of `block` consecutive returns instead."""
+    rng = np.random.default_rng(seed)
+    half_spread = spread / 2
+    buy_level, sell_level, volumes = grid_layout(params, start_price - half_spread, start_price + half_spread)
+    cs = params.contract_size
+    balance = float(params.initial_balance)
+    stop_equity = balance * (1 - params.max_drawdown_percent / 100.0)
+
+    # Per path: mid price, trigger thresholds on the mid (inf = side disarmed), fills so far, net
+    # volume and the ruin bound. Equity = balance + cs * (k + net * price), with k the volume-weighted
+    # entry terms including the spread; ruin when net * price <= (stop_equity - balance) / cs - k.
+    price = np.full(paths, float(start_price))
+    upper = np.full(paths, buy_level - half_spread) # BuyStop fills when ask >= buy_level
+    lower = np.full(paths, sell_level + half_spread) # SellStop fills when bid <= sell_level
+    fills = np.zeros(paths, dtype=np.int32)
+    net = np.zeros(paths)
+    bound = np.full(paths, (stop_equity - balance) / cs)
+    ruin_step = np.full(paths, -1, dtype=np.int32)
+    final_equity = np.full(paths, np.nan)
+
+    returns = _returns
+    if returns is not None:
+        position = rng.integers(0, len(returns) - block, paths)
+    for step in range(steps):
+        if returns is None:
+            price += rng.standard_normal(paths, dtype=np.float32) * sigma
+        else:
+            if step % block == 0 and step:
+                position = rng.integers(0, len(returns) - block, paths)
+            price += returns[position]
+            position += 1
+
+        hit = np.flatnonzero((price >= upper) | (price <= lower))
+        if len(hit):
+            p = price[hit]
+            is_buy = p >= upper[hit]
+            volume = volumes[np.minimum(fills[hit], len(volumes) - 1)]
+            # Buy at ask (p + s), sell at bid (p - s); the later close costs the other half spread
+            entry = np.where(is_buy, p + 2 * half_spread, p - 2 * half_spread)
+            signed = np.where(is_buy, volume, -volume)
+            net[hit] += signed
+            bound[hit] += signed * entry
+            fills[hit] += 1
+            upper[hit] = np.where(is_buy, np.inf, buy_level - half_spread)
+            lower[hit] = np.where(is_buy, sell_level + half_spread, -np.inf)
+
+        ruined = np.flatnonzero(net * price <= bound)
+        if len(ruined):
+            ruin_step[ruined] = step
+            final_equity[ruined] = stop_equity + cs * (net[ruined] * price[ruined] - bound[ruined])
+            # Halted: no more fills, never ruined again
+            upper[ruined], lower[ruined] = np.inf, -np.inf
+            net[ruined], bound[ruined] = 0.0, -np.inf
+
+    alive = ruin_step < 0
+    final_equity[alive] = stop_equity + cs * (net[alive] * price[alive] - bound[alive])
+    return ~alive, ruin_step, final_equity, fills
+
+def _run_chunk(args):
+    return simulate_chunk(*args)
+
+def run_monte_carlo(params=None, paths=1_000_000, steps=1440, step_seconds=60, start_price=None, spread=None,
+                    sigma_points=15.0, returns=None, block=60, seed=0, workers=None, chunk=DEFAULT_CHUNK):
+    """Simulates `paths` paths of `steps` steps over a process pool. `returns` (price changes per step,
+    e.g. from returns_from_ticks) switches from Gaussian steps to a block bootstrap."""
+    params = params or default_params()
+    point = 10 ** -params.digits
+    start_price = start_price if start_price is not None else const.SIM_START_PRICE
+    spread = spread if spread is not None else const.SIM_SPREAD_POINTS * point
+    if returns is not None:
+        returns = np.ascontiguousarray(returns, dtype=np.float64)
+        block = max(1, min(block, len(returns) - 1))
+    # Independent, reproducible streams per chunk
+    seeds = np.random.SeedSequence(seed).spawn((paths + chunk - 1) // chunk)
+    tasks = [(params, min(chunk, paths - i * chunk), steps, start_price, spread, sigma_points * point, block, s)
+             for i, s in enumerate(seeds)]
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _set_returns(returns)
+        parts = [simulate_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_returns, initargs=(returns,)) as pool:
+            parts = list(pool.map(_run_chunk, tasks))
+    ruined, ruin_step, final_equity, fills = (np.concatenate(column) for column in zip(*parts))
+    balance = float(params.initial_balance)
+    return RuinResult(ruined, ruin_step, final_equity, fills, steps, step_seconds,
+                      balance, balance * (1 - params.max_drawdown_percent / 100.0))
+
+# --- Reporting ---
+
+def summarize(result, percentiles=(1, 5, 25, 50, 75, 95, 99)):
+    """Stop-out probability (with its standard error), time-to-ruin and equity percentiles."""
+    paths = len(result.ruined)
+    p_ruin = float(result.ruined.mean())
+    summary = {
+        'paths': paths,
+        'horizon_hours': round(result.steps * result.step_seconds / 3600, 2),
+        'p_stop_out': round(p_ruin, 6),
+        'p_stop_out_stderr': round(float(np.sqrt(p_ruin * (1 - p_ruin) / paths)), 6),
+        'mean_fills': round(float(result.fills.mean()), 2),
+        'max_fills': int(result.fills.max()),
+        'mean_equity': round(float(result.final_equity.mean()), 2),
+    }
+    summary.update({f'equity_p{p}': round(float(v), 2)
+                    for p, v in zip(percentiles, np.percentile(result.final_equity, percentiles))})
+    if result.ruined.any():
+        hours = (result.ruin_step[result.ruined] + 1) * result.step_seconds / 3600
+        summary.update({f'ruin_hours_p{p}': round(float(v), 2)
+                        for p, v in zip((5, 25, 50, 75, 95), np.percentile(hours, (5, 25, 50, 75, 95)))})
+        # Stop-outs land below the floor when a step gaps through it
+        summary['mean_stop_out_equity'] = round(float(result.final_equity[result.ruined].mean()), 2)
+    return summary
+
+def ruin_curve(result, points=10):
+    """[(hours, cumulative stop-out probability)] at `points` evenly spaced times over the horizon."""
+    ends = np.linspace(result.steps / points, result.steps, points)
+    steps = np.sort(result.ruin_step[result.ruined])
+    return [(round(float(end * result.step_seconds / 3600), 2), float(np.searchsorted(steps, end) / len(result.ruined)))
+            for end in ends]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Monte Carlo risk of ruin for the grid strategy.")
+    parser.add_argument('--paths', type=int, default=1_000_000)
+    parser.add_argument('--steps', type=int, default=1440, help="Steps per path (horizon = steps * step-seconds)")
+    parser.add_argument('--step-seconds', type=float, default=60)
+    parser.add_argument('--sigma-points', type=float, default=15.0, help="Standard deviation of a Gaussian step (in points)")
+    parser.add_argument('--returns', help="Tick source to bootstrap steps from (.npz, CSV, .ring or market data store directory)")
+    parser.add_argument('--block', type=int, default=60, help="Consecutive recorded returns per bootstrap draw (keeps volatility clustering)")
+    parser.add_argument('--start-price', type=float, default=None)
+    parser.add_argument('--lot-multiplier', type=float, default=const.LOT_MULTIPLIER)
+    parser.add_argument('--distance-pips', type=float, default=const.ORDER_DISTANCE_PIPS)
+    parser.add_argument('--max-drawdown', type=float, default=const.MAX_DRAWDOWN_PERCENT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    try:
+        params = default_params(lot_multiplier=args.lot_multiplier, order_distance_pips=args.distance_pips,
+                                max_drawdown_percent=args.max_drawdown)
+    except ValueError as e:
+        parser.error(str(e))
+    returns, spread, start_price = None, None, args.start_price
+    if args.returns:
+        times, bids, asks = load_ticks(args.returns)
+        returns, spread = returns_from_ticks(times, bids, asks, args.step_seconds)
+        start_price = start_price or float((bids[-1] + asks[-1]) / 2)
+        print(f"Bootstrapping from {len(returns)} returns of {args.step_seconds:g}s ({args.returns}), median spread {spread:.6f}")
+
+    started = time.perf_counter()
+    result = run_monte_carlo(params, args.paths, args.steps, args.step_seconds, start_price, spread,
+                             args.sigma_points, returns, args.block, args.seed, args.workers)
+    elapsed = time.perf_counter() - started
+    for name, value in summarize(result).items():
+        print(f"{name:>22}: {value}")
+    print("Cumulative stop-out probability: " + ", ".join(f"{h}h={p:.4f}" for h, p in ruin_curve(result)))
+    print(f"{args.paths} paths x {args.steps} steps in {elapsed:.1f}s")
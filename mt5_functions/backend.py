@@ -0,0 +1,43 @@
+import atexit
+import multiprocessing
+import utils.constants as const
+
+# Terminal backend selection.
+# Every module that talks to the terminal imports `mt5` from here instead of importing
+# MetaTrader5 directly, so the whole bot can be pointed at the offline simulator at startup
+# (MT5_BACKEND=sim) without touching the trading code.
+
+if const.TERMINAL_BACKEND == "sim":
+    import mt5_functions.sim_terminal as mt5
+elif const.TERMINAL_BACKEND == "live":
+    import MetaTrader5 as mt5
+else:
+    raise ValueError(f"Unknown TERMINAL_BACKEND '{const.TERMINAL_BACKEND}' (expected 'live' or 'sim')")
+
+terminal_worker = None
+
+# With TERMINAL_WORKER_ENABLED the bot's calls run in a supervised worker process
+# (terminal_worker.py), started by start_terminal_worker(); scripts and research tools that only
+# import these modules keep calling the backend in-process. Child processes (the worker itself
+# re-imports the main module) always get the plain backend.
+if const.TERMINAL_WORKER_ENABLED and multiprocessing.parent_process() is None:
+    from mt5_functions.terminal_worker import TerminalProxy, TerminalWorker
+    terminal_worker = TerminalWorker(mt5.__name__)
+    atexit.register(terminal_worker.stop)
+    mt5 = TerminalProxy(mt5, terminal_worker)
+
+def start_terminal_worker():
+    """Routes the terminal calls through the worker process from now on (no-op without it)."""
+    if terminal_worker is not None:
+        terminal_worker.start()
+
+def worker_running():
+    return terminal_worker is not None and terminal_worker.started
+
+def bulk_call(name, *args, **kwargs):
+    """Calls backend function `name` for a bulk history request (days of deals or ticks), which may
+    legitimately take longer than TERMINAL_CALL_TIMEOUT_SECONDS: through the terminal worker it gets
+    TERMINAL_BULK_CALL_TIMEOUT_SECONDS."""
+    if worker_running():
+        return mt5.call(name, *args, timeout=const.TERMINAL_BULK_CALL_TIMEOUT_SECONDS, **kwargs)
+    return getattr(mt5, name)(*args, **kwargs)
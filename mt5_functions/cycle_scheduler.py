@@ -0,0 +1,144 @@
+from utils.logger import logger
+import time
+import utils.constants as const
+import utils.grid_math as grid_math
+import utils.metrics as metrics
+import mt5_functions.mt5_api as mt5_api
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+
+# Decides when the main loop runs its next full cycle. Between cycles only the tick is read, at a
+# rate that depends on how far price is from the grid levels: close to a level the tick is polled
+# every TICK_POLL_MIN_SECONDS and the cycle starts as soon as price enters the wake band or
+# crosses the level; far from both levels polling slows down towards TICK_POLL_MAX_SECONDS and
+# a full cycle only runs every MAX_IDLE_CYCLE_SECONDS. When the tick has changed, the ticks since
+# the last poll are read too (copy_ticks_from) and their highest ask / lowest bid are tested, so a
+# spike through a level between two polls still starts the cycle.
+# With several grids the nearest level of any grid sets the pace, and each symbol's tick is read
+# once per poll however many grids trade it. Only the main loop thread uses it.
+
+# Price zone relative to one grid level
+FAR, BAND, CROSSED = 0, 1, 2
+
+class CycleScheduler:
+
+    def __init__(self):
+        self.zones = {} # (grid key, side, level) -> last observed zone, kept across waits
+        self.last_tick_msc = {} # symbol -> time_msc of the last tick seen
+        self.polls = 0 # Tick reads between cycles (for the terminal call rate)
+        self.wakes = 0 # Cycles started early by price
+
+    def _zones(self, key, high_ask, low_bid, state, band):
+        zones = {}
+        buy_level = state.get('initial_buy_stop_level')
+        sell_level = state.get('initial_sell_stop_level')
+        # A BuyStop fills on the ask, a SellStop on the bid
+        if buy_level:
+            zones[(key, 'buy', buy_level)] = CROSSED if high_ask >= buy_level else BAND if high_ask >= buy_level - band else FAR
+        if sell_level:
+            zones[(key, 'sell', sell_level)] = CROSSED if low_bid <= sell_level else BAND if low_bid <= sell_level + band else FAR
+        return zones
+
+    def _extremes(self, symbol, tick, since_msc):
+        """(highest ask, lowest bid) of the ticks after `since_msc` up to `tick` (the latest one).
+        Just the latest tick if there is no previous poll or the history cannot be read."""
+        high_ask, low_bid = tick.ask, tick.bid
+        if since_msc is None:
+            return high_ask, low_bid
+        with metrics.timer('mt5_call_duration_seconds', call='copy_ticks_from'):
+            ticks = mt5.copy_ticks_from(symbol, since_msc // 1000, const.TICK_WAKE_SCAN_TICKS, mt5.COPY_TICKS_ALL)
+        if ticks is None or not len(ticks):
+            return high_ask, low_bid
+        ticks = ticks[ticks['time_msc'] > since_msc]
+        asks, bids = ticks['ask'], ticks['bid']
+        asks, bids = asks[asks > 0], bids[bids > 0] # Ticks that only changed the last price
+        if len(asks):
+            high_ask = max(high_ask, float(asks.max()))
+        if len(bids):
+            low_bid = min(low_bid, float(bids.min()))
+        return high_ask, low_bid
+
+    def _poll_interval(self, tick, state, band, span):
+        """Linear in the distance to the nearest wake band: MIN at the band edge, MAX at `span` or beyond."""
+        distances = []
+        if state.get('initial_buy_stop_level'):
+            distances.append(state['initial_buy_stop_level'] - band - tick.ask)
+        if state.get('initial_sell_stop_level'):
+            distances.append(tick.bid - state['initial_sell_stop_level'] - band)
+        if not distances or span <= 0:
+            return const.TICK_POLL_MAX_SECONDS
+        ratio = min(max(min(distances) / span, 0.0), 1.0)
+        return const.TICK_POLL_MIN_SECONDS + ratio * (const.TICK_POLL_MAX_SECONDS - const.TICK_POLL_MIN_SECONDS)
+
+    def _watches(self, snapshots):
+        """(grid, symbol, band, span) for every initialized grid whose symbol spec is known."""
+        watches = []
+        for grid, snapshot in snapshots:
+            symbol_info = snapshot.symbol_info
+            if not grid.state.get('initialized') or symbol_info is None:
+                continue
+            pip = grid_math.pip_multiplier(symbol_info.digits) * symbol_info.point
+            # Beyond one grid step away, poll at the slowest rate
+            watches.append((grid, grid.symbol, const.TICK_WAKE_BAND_PIPS * pip, const.ORDER_DISTANCE_PIPS * pip))
+        return watches
+
+    def wait(self, snapshots, halted, on_retries_settled=None):
+        """Blocks until the next cycle is due. Returns the reason: 'halted', 'price' or 'idle'.
+
+        `snapshots` is the cycle's [(grid, MarketSnapshot)]. Queued order retries are serviced
+        while waiting (on_retries_settled is called when some completed), and a set `halted`
+        event ends the wait immediately.
+        """
+        watches = self._watches(snapshots)
+        watching = bool(watches)
+        # Without armed levels (initialization pending) there is nothing to watch: plain LOOP_DELAY_SECONDS
+        end = time.monotonic() + (const.MAX_IDLE_CYCLE_SECONDS if watching else const.LOOP_DELAY_SECONDS)
+        interval = const.TICK_POLL_MAX_SECONDS if watching else const.LOOP_DELAY_SECONDS
+        symbols = list(dict.fromkeys(symbol for _, symbol, _, _ in watches))
+
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return 'idle'
+            timeout = min(remaining, interval)
+            due_in = mt5_api.order_scheduler.next_due_in()
+            if due_in is not None:
+                timeout = min(timeout, due_in)
+            if halted.wait(timeout):
+                return 'halted'
+            if mt5_api.order_scheduler.poll() and on_retries_settled:
+                on_retries_settled()
+            if not watching:
+                continue
+
+            ticks, extremes = {}, {}
+            for symbol in symbols:
+                with metrics.timer('mt5_call_duration_seconds', call='symbol_info_tick'):
+                    tick = mt5.symbol_info_tick(symbol)
+                self.polls += 1
+                last_msc = self.last_tick_msc.get(symbol)
+                if tick is None or tick.time_msc == last_msc:
+                    continue # No new tick, nothing can have triggered
+                self.last_tick_msc[symbol] = tick.time_msc
+                ticks[symbol] = tick
+                extremes[symbol] = self._extremes(symbol, tick, last_msc)
+            if not ticks:
+                continue
+
+            woke = False
+            intervals = []
+            for grid, symbol, band, span in watches:
+                tick = ticks.get(symbol)
+                if tick is None:
+                    continue
+                zones = self._zones(grid.key, *extremes[symbol], grid.state, band)
+                # Wake when price moves into a closer zone of a level than last seen (entering the band or crossing)
+                woke = woke or any(zone > self.zones.get(key, zone) for key, zone in zones.items())
+                # Replace this grid's entries (levels move as the grid advances)
+                self.zones = {key: zone for key, zone in self.zones.items() if key[0] != grid.key}
+                self.zones.update(zones)
+                intervals.append(self._poll_interval(tick, grid.state, band, span))
+            if woke:
+                self.wakes += 1
+                logger.debug("Price moved towards a grid level (%s). Starting cycle early.", ", ".join(f"{symbol} {tick.bid}/{tick.ask}" for symbol, tick in ticks.items()))
+                return 'price'
+            interval = min(intervals)
@@ -0,0 +1,79 @@
+from utils.logger import logger
+from collections import namedtuple
+import utils.metrics as metrics
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+import mt5_functions.backend as backend
+
+# Turns the terminal's deal history into fill events for the grid logic. A cursor (time_msc and
+# ticket of the last deal handled) is kept in the bot state, so it is persisted with everything
+# else; each poll asks history_deals_get only for deals from the cursor's second onwards. The
+# cost of a cycle therefore follows the number of new deals, not the number of open positions,
+# and fills that open and close between two polls are still seen. After a restart the first
+# poll is one bulk query from the persisted cursor, which catches up on everything missed.
+# One query serves every grid: deals are partitioned by (symbol, magic) in memory.
+
+CURSOR_KEY = 'deal_cursor' # state[CURSOR_KEY] = [time_msc, ticket] of the last deal handled
+HISTORY_DATE_TO = 2 ** 31 - 1 # Open-ended query: server time zones differ from local and sim time runs ahead of it
+
+FillEvent = namedtuple('FillEvent', [
+    'order', 'position_id', 'type', 'entry', 'volume', 'price', 'time_msc', 'profit', 'deals'])
+
+class DealReconciler:
+
+    def __init__(self, state, grid_keys):
+        self.state = state # Root state (the cursor is shared by all grids)
+        self.grid_keys = set(grid_keys) # (symbol, magic) pairs whose deals are reported
+        self.caught_up = False
+
+    def start(self, time_msc, ticket=0):
+        """Starts the cursor at `time_msc` if none is stored yet (called before the first grid orders go
+        out, or after the last deal read by a warm start)."""
+        if not self.state.get(CURSOR_KEY):
+            self.state[CURSOR_KEY] = [time_msc, ticket]
+
+    def poll(self):
+        """Returns new fills as {(symbol, magic): {order ticket: FillEvent}} (partial fills of one order
+        merged) and advances the cursor.
+
+        Returns None if the history could not be read; the grid logic then falls back to the open positions.
+        """
+        cursor = self.state.get(CURSOR_KEY)
+        if not cursor:
+            return None
+        cursor_msc, cursor_ticket = cursor
+        with metrics.timer('mt5_call_duration_seconds', call='history_deals_get'):
+            if self.caught_up:
+                deals = mt5.history_deals_get(cursor_msc // 1000, HISTORY_DATE_TO)
+            else:
+                # The first poll catches up on everything since the persisted cursor (possibly days)
+                deals = backend.bulk_call('history_deals_get', cursor_msc // 1000, HISTORY_DATE_TO)
+        if deals is None:
+            logger.warning("history_deals_get failed, error code = %s. Using open positions for trigger detection.", mt5.last_error())
+            return None
+
+        new_deals = sorted((d for d in deals if (d.symbol, d.magic) in self.grid_keys and (d.time_msc, d.ticket) > (cursor_msc, cursor_ticket)),
+                           key=lambda d: (d.time_msc, d.ticket))
+        if not self.caught_up:
+            self.caught_up = True
+            if new_deals:
+                logger.info("Deal history caught up: %s deals since the last run.", len(new_deals))
+        if not new_deals:
+            return {}
+
+        fills = {}
+        for deal in new_deals:
+            grid_fills = fills.setdefault((deal.symbol, deal.magic), {})
+            previous = grid_fills.get(deal.order)
+            if previous:
+                # Several deals for one order = partial fills: volume-weighted price, summed profit
+                volume = round(previous.volume + deal.volume, 8)
+                price = (previous.price * previous.volume + deal.price * deal.volume) / volume
+                grid_fills[deal.order] = previous._replace(volume=volume, price=price, time_msc=deal.time_msc,
+                                                           profit=previous.profit + deal.profit, deals=previous.deals + 1)
+            else:
+                grid_fills[deal.order] = FillEvent(deal.order, deal.position_id, deal.type, deal.entry, deal.volume,
+                                                   deal.price, deal.time_msc, deal.profit, 1)
+            logger.debug("Deal %s: %s, order %s, position %s, type %s, entry %s, %s @ %s", deal.ticket, deal.symbol, deal.order, deal.position_id, deal.type, deal.entry, deal.volume, deal.price)
+        last = new_deals[-1]
+        self.state[CURSOR_KEY] = [last.time_msc, last.ticket]
+        return fills
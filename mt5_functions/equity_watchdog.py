@@ -0,0 +1,60 @@
+from utils.logger import logger
+import threading
+import time
+import utils.constants as const
+import utils.metrics as metrics
+import mt5_functions.mt5_api as mt5_api
+import mt5_functions.liquidation as liquidation
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+
+class EquityWatchdog(threading.Thread):
+    """Polls account equity at a sub-second rate, independently of the main loop.
+
+    On a MAX_DRAWDOWN_PERCENT breach it sets the shared `halted` event (the main loop and the
+    order scheduler stop placing orders) and runs the stop-out liquidation itself, so the
+    reaction time is bounded by the poll interval rather than by LOOP_DELAY_SECONDS plus
+    whatever the grid step is doing. Drawdown is account-wide, so one equity read covers every
+    grid and a breach liquidates all of them. State reset stays with the main loop, which owns the state.
+    """
+
+    def __init__(self, grids, interval=None, halted=None):
+        super().__init__(name="equity-watchdog", daemon=True)
+        self.grids = grids # Only read here (initial_deposit); the main thread owns all writes
+        self.interval = interval if interval is not None else const.WATCHDOG_INTERVAL_SECONDS
+        self.halted = halted or threading.Event()
+        self.last_reports = []
+        self.last_check_time = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        logger.info("Equity watchdog started (interval %.0f ms, max drawdown %s%%).", self.interval * 1000, const.MAX_DRAWDOWN_PERCENT)
+        while not self._stop_event.wait(self.interval):
+            try:
+                if self.check():
+                    break # Fired: the main loop takes it from here
+            except Exception as e:
+                logger.error("Error in equity watchdog: %s", e, exc_info=True)
+        logger.info("Equity watchdog stopped.")
+
+    def check(self):
+        """One poll: returns True if the stop-out fired."""
+        # The highest recorded deposit is the strictest reference
+        initial_deposit = max((grid.state.get('initial_deposit') or 0 for grid in self.grids), default=0)
+        if not initial_deposit or self.halted.is_set():
+            return False
+        with metrics.timer('mt5_call_duration_seconds', call='account_info'):
+            account_info = mt5.account_info() # The only terminal call per poll
+        self.last_check_time = time.monotonic()
+        if account_info is None:
+            return False
+        drawdown_percent = (initial_deposit - account_info.equity) / initial_deposit * 100
+        if drawdown_percent < const.MAX_DRAWDOWN_PERCENT:
+            return False
+
+        logger.warning("WATCHDOG: drawdown %.2f%% >= %s%% (equity %s). Halting and liquidating %s grid(s)!", drawdown_percent, const.MAX_DRAWDOWN_PERCENT, account_info.equity, len(self.grids))
+        self.halted.set() # Preempt the main loop before sending anything
+        self.last_reports = [liquidation.liquidate(mt5_api.MarketSnapshot(grid.symbol, grid.magic)) for grid in self.grids]
+        return True
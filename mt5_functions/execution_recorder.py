@@ -0,0 +1,109 @@
+"""Binary record of every order_send attempt, for execution quality analysis.
+
+Each attempt (grid orders, retries, liquidation requests) is written as one fixed-width record
+to a memory-mapped ring file (EXECUTION_LOG_FILE): request/response wall-clock time, action,
+order type, requested vs executed price, volume, retcode and attempt number.
+
+Analysis:
+    python -m mt5_functions.execution_recorder executions.ring --point 0.00001
+prints round-trip latency and slippage percentiles per retcode; load_executions() returns the
+records as a NumPy structured array mapped straight from the file.
+"""
+import argparse
+import threading
+import time
+from utils.logger import logger
+import utils.constants as const
+from utils.mmap_ring import MmapRing, read_ring
+
+FIELDS = [
+    ('seq', 'Q'),
+    ('request_ns', 'q'), # time.time_ns() before order_send
+    ('response_ns', 'q'), # time.time_ns() after order_send returned
+    ('action', 'h'),
+    ('type', 'h'), # -1 if the request has no order type (e.g. TRADE_ACTION_REMOVE)
+    ('retcode', 'i'), # RETCODE_NO_RESULT / RETCODE_EXCEPTION if there was no result
+    ('attempt', 'h'),
+    ('requested_price', 'd'),
+    ('executed_price', 'd'),
+    ('volume', 'd'),
+]
+
+RETCODE_NO_RESULT = -1 # order_send returned None
+RETCODE_EXCEPTION = -2 # order_send raised
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_recorder():
+    """The process-wide ring, opened on first use (None if disabled or the file cannot be mapped)."""
+    global _recorder
+    if _recorder is None and const.EXECUTION_LOG_ENABLED:
+        with _recorder_lock:
+            if _recorder is None:
+                try:
+                    _recorder = MmapRing(const.EXECUTION_LOG_FILE, FIELDS, const.EXECUTION_LOG_CAPACITY)
+                except (OSError, ValueError) as e:
+                    logger.error("Failed to open execution log %s: %s. Executions will not be recorded.", const.EXECUTION_LOG_FILE, e)
+                    const.EXECUTION_LOG_ENABLED = False
+    return _recorder
+
+def record(request, result, request_ns, response_ns, attempt, retcode=None):
+    """Records one order_send attempt. `retcode` overrides the result's (for None results / exceptions)."""
+    recorder = get_recorder()
+    if recorder is None:
+        return
+    if retcode is None:
+        retcode = result.retcode if result is not None else RETCODE_NO_RESULT
+    if result is not None:
+        executed_price, volume = result.price, result.volume or request.get('volume', 0.0)
+    else:
+        executed_price, volume = 0.0, request.get('volume', 0.0)
+    recorder.append(request_ns, response_ns, request.get('action', 0), request.get('type', -1), retcode, attempt,
+                    request.get('price', 0.0), executed_price, volume)
+
+def timed_order_send(send, request, attempt):
+    """Calls send(request) (mt5.order_send) and records the attempt. Exceptions are recorded and re-raised."""
+    request_ns = time.time_ns()
+    try:
+        result = send(request)
+    except Exception:
+        record(request, None, request_ns, time.time_ns(), attempt, retcode=RETCODE_EXCEPTION)
+        raise
+    record(request, result, request_ns, time.time_ns(), attempt)
+    return result
+
+# --- Analysis ---
+
+def load_executions(path=None):
+    """Records as a NumPy structured array mapped from the ring file (zero copy, read-only)."""
+    records, _ = read_ring(path or const.EXECUTION_LOG_FILE, FIELDS)
+    return records
+
+def summarize(records, point, percentiles=(50, 90, 99)):
+    """Latency (ms) and slippage (points, positive = worse than requested) percentiles per retcode."""
+    import numpy as np
+    rows = []
+    for retcode in np.unique(records['retcode']):
+        selected = records[records['retcode'] == retcode]
+        latency_ms = (selected['response_ns'] - selected['request_ns']) / 1e6
+        row = {'retcode': int(retcode), 'count': len(selected)}
+        row.update({f'latency_p{p}_ms': round(float(v), 3) for p, v in zip(percentiles, np.percentile(latency_ms, percentiles))})
+        # Slippage only where both prices are known; buys (even order types) lose when they pay more
+        priced = selected[(selected['requested_price'] > 0) & (selected['executed_price'] > 0)]
+        if len(priced):
+            direction = np.where(priced['type'] % 2 == 0, 1.0, -1.0)
+            slippage = (priced['executed_price'] - priced['requested_price']) * direction / point
+            row.update({f'slippage_p{p}_points': round(float(v), 2) for p, v in zip(percentiles, np.percentile(slippage, percentiles))})
+        rows.append(row)
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency / slippage percentiles per retcode from the execution log.")
+    parser.add_argument('path', nargs='?', default=const.EXECUTION_LOG_FILE)
+    parser.add_argument('--point', type=float, default=0.00001, help="Symbol point size (for slippage in points)")
+    args = parser.parse_args()
+    records = load_executions(args.path)
+    print(f"{len(records)} order_send attempts in {args.path}")
+    for row in summarize(records, args.point):
+        print("  ".join(f"{k}={v}" for k, v in row.items()))
@@ -0,0 +1,158 @@
+from collections import namedtuple
+import utils.constants as const
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+
+# Pre-trade exposure projection. Built once per cycle from data the cycle snapshot already holds
+# (the grid's positions, account equity and margin, the tick, and the cached symbol spec), so
+# projecting a fill costs a few float operations and no terminal round-trip (no order_calc_profit
+# / order_calc_margin).
+#
+# Prices are tracked as the bid; the spread is taken as constant. With a net volume `net` (buys
+# minus sells, in lots), equity moves linearly with the bid:
+#     equity(bid) = equity_now + net * (bid - bid_now) * value_per_price
+# where value_per_price = trade_tick_value / trade_tick_size. A buy stop at level L fills when the
+# ask reaches L (bid = L - spread), a sell stop when the bid reaches L. A new position starts out
+# one spread down (it is valued at the other side of the quote).
+#
+# The grid alternates: after a leg of one side fills, the next fill that changes direction is at
+# the other side's level. A leg is judged on two paths from its fill price: price reverses to the
+# other side's level, or it continues past the leg by as much. Without the leg only the existing
+# exposure moves on those paths. gate() resizes or drops a leg only if its fill leaves the equity
+# below the drawdown floor on the worse of the two paths and below where not placing it would
+# leave it (a leg that hedges a losing continuation is never held back for it).
+
+Projection = namedtuple('Projection', ['side', 'price', 'volume', 'equity', 'drawdown_percent', 'margin']) # Just before the fill; margin after it
+
+class ExposureModel:
+    """One grid's exposure and account figures from a cycle snapshot (see the module comment)."""
+
+    def __init__(self, positions, account, tick, spec, initial_deposit):
+        info = spec.info
+        buys = [p for p in positions if p.type == mt5.POSITION_TYPE_BUY]
+        sells = [p for p in positions if p.type != mt5.POSITION_TYPE_BUY]
+        self.buy_volume = sum(p.volume for p in buys)
+        self.sell_volume = sum(p.volume for p in sells)
+        # Volume-weighted entry prices (None without positions on that side)
+        self.buy_price = sum(p.volume * p.price_open for p in buys) / self.buy_volume if buys else None
+        self.sell_price = sum(p.volume * p.price_open for p in sells) / self.sell_volume if sells else None
+        self.net = self.buy_volume - self.sell_volume
+        self.value_per_price = info.trade_tick_value / info.trade_tick_size if info.trade_tick_size else info.trade_contract_size
+        self.margin_per_lot = spec.margin_per_lot or 0.0
+        self.equity = account.equity
+        self.margin = account.margin
+        self.bid = tick.bid
+        self.spread = tick.ask - tick.bid
+        self.initial_deposit = initial_deposit
+        self.floor = initial_deposit * (1 - const.MAX_DRAWDOWN_PERCENT / 100.0) # Equity at which the grid is stopped out
+        self.limit = self.floor + initial_deposit * const.EXPOSURE_BUFFER_PERCENT / 100.0 # Lowest equity a fill may lead to
+        self.volume_min = info.volume_min
+        self.volume_step = info.volume_step
+
+    @classmethod
+    def from_snapshot(cls, snapshot, initial_deposit):
+        """None if a piece of the snapshot is missing (nothing is gated then)."""
+        account, tick, spec, positions = snapshot.account, snapshot.tick, snapshot.spec, snapshot.positions
+        if not (account and tick and spec and initial_deposit) or positions is None:
+            return None
+        return cls(positions, account, tick, spec, initial_deposit)
+
+    def fill_bid(self, side, price):
+        """Bid at which a stop order of `side` at `price` fills."""
+        return price - self.spread if side == 'buy' else price
+
+    def equity_at(self, bid, net, equity, from_bid):
+        """Equity at `bid` with net volume `net`, given `equity` at `from_bid`."""
+        return equity + net * (bid - from_bid) * self.value_per_price
+
+    def after_fill(self, side, price, volume, net, equity, from_bid):
+        """(net, equity, bid) right after a `side` fill of `volume` at `price`."""
+        bid = self.fill_bid(side, price)
+        equity = self.equity_at(bid, net, equity, from_bid) - volume * self.spread * self.value_per_price
+        return net + (volume if side == 'buy' else -volume), equity, bid
+
+    def drawdown_percent(self, equity):
+        return (self.initial_deposit - equity) / self.initial_deposit * 100
+
+    def max_volume(self, side, price, opposite_bid, net, equity, from_bid):
+        """Largest volume a `side` fill at `price` may have, given the exposure `net` and `equity` at
+        `from_bid`: the worse of the equity at `opposite_bid` (reversal) and at the same distance
+        beyond the fill (continuation) must stay at or above the limit, or else at or above the
+        worse of the two without the leg. None if any volume is safe, 0 if none is."""
+        _, at_fill, bid = self.after_fill(side, price, 0.0, net, equity, from_bid)
+        sign = 1 if side == 'buy' else -1
+        # Equity at the end of each path = base (without the leg) + volume * per_lot
+        paths = []
+        for path_bid in (opposite_bid, 2 * bid - opposite_bid):
+            base = self.equity_at(path_bid, net, at_fill, bid)
+            paths.append((base, (sign * (path_bid - bid) - self.spread) * self.value_per_price))
+        target = min(self.limit, *(base for base, _ in paths))
+        limits = [max(0.0, (base - target) / -per_lot) for base, per_lot in paths if per_lot < 0]
+        return min(limits) if limits else None
+
+    def floor_volume(self, volume):
+        """`volume` rounded down to the volume step (0 below volume_min)."""
+        if self.volume_step > 0:
+            volume = int(volume / self.volume_step + 1e-9) * self.volume_step
+        volume = round(volume, 2)
+        return volume if volume >= self.volume_min else 0.0
+
+    def project_ladder(self, state, steps, next_lot):
+        """Equity just before each of the next `steps` fills if price swings between the two levels,
+        starting with the level nearest to the price. Each side fills its armed lot, then the next
+        lots of the ladder. The margin is an upper bound (hedged margin is not reduced). Returns [Projection]."""
+        levels = {side: state.get(f'initial_{side}_stop_level') for side in ('buy', 'sell')}
+        lots = {side: state.get(f'{side}_armed_lot') for side in ('buy', 'sell')}
+        if not all(levels.values()) or not all(lots.values()):
+            return []
+        bids = {side: self.fill_bid(side, levels[side]) for side in levels}
+        side = 'buy' if bids['buy'] - self.bid <= self.bid - bids['sell'] else 'sell'
+        net, equity, bid, margin = self.net, self.equity, self.bid, self.margin
+        projections = []
+        for _ in range(steps):
+            volume = lots[side]
+            before = self.equity_at(bids[side], net, equity, bid)
+            margin += volume * self.margin_per_lot
+            projections.append(Projection(side, levels[side], volume, before, self.drawdown_percent(before), margin))
+            net, equity, bid = self.after_fill(side, levels[side], volume, net, equity, bid)
+            lots[side] = next_lot(volume)
+            side = 'sell' if side == 'buy' else 'buy'
+        return projections
+
+def gate(model, state, desired, mode=None, previous=None):
+    """Resizes (mode 'resize') or drops (mode 'reject') the desired legs whose fill would leave the
+    equity below the drawdown floor, and below the no-leg case, on the worse of the reversal and
+    continuation paths (ExposureModel.max_volume). Each side's legs are projected in fill order,
+    on top of the legs before them. Returns (desired, [(original DesiredOrder, new volume)]);
+    a new volume of 0 means the leg was dropped.
+
+    `previous` ({(side, leg, price, lot): volume}, last cycle's changes) adds hysteresis: the safe
+    volume moves with every tick, and any volume change is a cancel plus a place, so a resized leg
+    keeps its previous volume while the new one is within EXPOSURE_RESIZE_HYSTERESIS_PERCENT of it
+    (at least one volume step)."""
+    mode = mode or const.EXPOSURE_GATE
+    if model is None or mode == 'off':
+        return desired, []
+    gated, changes = [], []
+    exposure = {side: (model.net, model.equity, model.bid) for side in ('buy', 'sell')}
+    blocked = set()
+    for d in sorted(desired, key=lambda d: (d.side, d.leg)):
+        if d.side in blocked:
+            changes.append((d, 0.0)) # Legs further out are larger still
+            continue
+        other = 'sell' if d.side == 'buy' else 'buy'
+        opposite_level = state.get(f'initial_{other}_stop_level')
+        if opposite_level:
+            limit = model.max_volume(d.side, d.price, model.fill_bid(other, opposite_level), *exposure[d.side])
+            if limit is not None and d.volume > limit + 1e-9:
+                volume = model.floor_volume(limit) if mode == 'resize' else 0.0
+                kept = (previous or {}).get((d.side, d.leg, d.price, d.volume))
+                if volume and kept and abs(volume - kept) <= max(model.volume_step, kept * const.EXPOSURE_RESIZE_HYSTERESIS_PERCENT / 100.0) + 1e-9:
+                    volume = kept
+                changes.append((d, volume))
+                if not volume:
+                    blocked.add(d.side)
+                    continue
+                d = d._replace(volume=volume)
+        gated.append(d)
+        exposure[d.side] = model.after_fill(d.side, d.price, d.volume, *exposure[d.side])
+    return gated, changes
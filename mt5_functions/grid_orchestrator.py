@@ -0,0 +1,115 @@
+from utils.logger import logger
+import utils.constants as const
+import mt5_functions.mt5_api as mt5_api
+import mt5_functions.liquidation as liquidation
+import mt5_functions.trading_service as trading_service
+from mt5_functions.deal_reconciler import DealReconciler, CURSOR_KEY
+
+# Runs several independent grids (GRIDS: one per symbol/magic pair) over one terminal connection.
+# Each cycle builds a single TerminalSnapshot that every grid reads through its own MarketSnapshot
+# view, and the deal history is polled once for all grids, so the terminal calls per cycle stay
+# flat as grids are added (ticks and symbol specs are the exception: one read per symbol).
+# Drawdown is account-wide: a breach on any grid liquidates and resets all of them.
+
+def grid_keys(configs=None):
+    return [(grid['symbol'], grid['magic']) for grid in (configs or const.GRIDS)]
+
+def migrate_legacy_state(state, keys):
+    """Moves the flat keys of a single-grid state file into the namespace of the configured grid
+    (the one for SYMBOL/MAGIC_NUMBER if it is still configured, otherwise the first grid)."""
+    legacy = [key for key in state if '|' not in key and key != CURSOR_KEY]
+    if not legacy:
+        return False
+    symbol, magic = (const.SYMBOL, const.MAGIC_NUMBER) if (const.SYMBOL, const.MAGIC_NUMBER) in keys else keys[0]
+    prefix = f"{symbol}|{magic}|"
+    for key in legacy:
+        state[prefix + key] = state.pop(key)
+    logger.info("Moved %s single-grid state keys under grid %s|%s.", len(legacy), symbol, magic)
+    return True
+
+class GridOrchestrator:
+
+    def __init__(self, state, configs=None):
+        keys = grid_keys(configs)
+        self.state = state # Root state shared by all grids (and the deal cursor)
+        self.reconciler = DealReconciler(state, keys)
+        self.migrated = migrate_legacy_state(state, keys)
+        self.grids = [trading_service.GridInstance(symbol, magic, state, self.reconciler) for symbol, magic in keys]
+        logger.info("Running %s grid(s): %s", len(self.grids), ", ".join(grid.key for grid in self.grids))
+
+    def snapshots(self):
+        """Per-grid views of one fresh terminal snapshot: [(grid, MarketSnapshot)]."""
+        terminal = mt5_api.TerminalSnapshot()
+        return [(grid, mt5_api.MarketSnapshot(grid.symbol, grid.magic, terminal)) for grid in self.grids]
+
+    def check_drawdown_and_close_all(self, snapshots):
+        """Returns True if some grid hit the drawdown limit; every grid is then liquidated and reset."""
+        for grid, snapshot in snapshots:
+            if trading_service.check_drawdown_and_close_all(grid, snapshot):
+                self.close_all(snapshots, skip=grid)
+                return True
+        return False
+
+    def close_all(self, snapshots, skip=None):
+        """Liquidates and resets every grid except `skip` (already handled by the caller)."""
+        for grid, snapshot in snapshots:
+            if grid is skip:
+                continue
+            report = liquidation.liquidate(snapshot)
+            snapshot.invalidate()
+            logger.warning("Grid %s liquidated: closed %s positions, cancelled %s orders (%s positions / %s orders remain).", grid.key, report.closed, report.cancelled, report.remaining_positions, report.remaining_orders)
+            trading_service.reset_grid_state(grid.state)
+
+    def reset_all(self):
+        for grid in self.grids:
+            trading_service.reset_grid_state(grid.state)
+
+    def initialize(self, snapshots):
+        """Initializes the grids that need it. Returns True if any was initialized."""
+        initialized = False
+        for grid, snapshot in snapshots:
+            if grid.state.get('initialized', False):
+                continue
+            logger.info("Grid %s requires initialization.", grid.key)
+            try:
+                if trading_service.initialize_strategy(grid, snapshot):
+                    logger.info("Grid %s initialized successfully in this cycle.", grid.key)
+                    initialized = True
+                else:
+                    # Might fail due to market conditions or temporary errors
+                    logger.warning("Initialization of grid %s failed or was skipped (e.g., existing orders). Will retry next cycle.", grid.key)
+            except Exception as e:
+                logger.error("Error during initialization of grid %s: %s", grid.key, e, exc_info=True)
+        return initialized
+
+    def manage(self, snapshots):
+        """One grid step for every initialized grid. Returns True if any grid's state changed."""
+        active = [(grid, snapshot) for grid, snapshot in snapshots if grid.state.get('initialized', False)]
+        if not active:
+            logger.debug("Skipping grid management as no grid is initialized.")
+            return False
+        # A grid whose orders or positions could not be read is skipped this cycle: an unknown book
+        # would look like every tracked order is gone. The history cursor is then left where it is,
+        # so that grid's fills are still reported on the next cycle.
+        readable = []
+        for grid, snapshot in active:
+            if snapshot.orders is None or snapshot.positions is None:
+                logger.warning("Skipping grid management of %s this cycle: its orders or positions could not be read.", grid.key)
+            else:
+                readable.append((grid, snapshot))
+        fills = self.reconciler.poll() if len(readable) == len(active) else None # One history query for all grids
+        changed = False
+        for grid, snapshot in readable:
+            try:
+                grid_fills = fills.get((grid.symbol, grid.magic), {}) if fills is not None else None
+                if trading_service.check_and_manage_grid(grid, snapshot, grid_fills):
+                    changed = True
+            except Exception as e:
+                logger.error("Error during grid management of %s: %s", grid.key, e, exc_info=True)
+        return changed
+
+    def log_monitoring(self, snapshots):
+        for grid, snapshot in snapshots:
+            orders, positions = snapshot.orders, snapshot.positions
+            logger.info("Monitoring %s: %s orders, %s positions (Magic: %s)", grid.symbol,
+                        len(orders) if orders is not None else '?', len(positions) if positions is not None else '?', grid.magic)
@@ -0,0 +1,112 @@
+from collections import deque, namedtuple
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+
+# Declarative grid order management. desired_orders() turns the grid state into the pending
+# orders that should rest on the server; plan() diffs them against the live orders and returns
+# the fewest actions that converge on that set. Nothing here talks to the terminal. The plan is
+# recomputed from scratch every cycle, so a failed or half-applied plan is corrected by the next
+# one instead of needing bookkeeping of its own.
+
+DesiredOrder = namedtuple('DesiredOrder', ['side', 'leg', 'type', 'price', 'volume']) # leg 0: the side's level, 1..: continuation legs
+Action = namedtuple('Action', ['kind', 'side', 'order', 'desired']) # order: the live TradeOrder (None for PLACE)
+
+KEEP, CANCEL, MODIFY, PLACE = 'keep', 'cancel', 'modify', 'place' # Also the order in which actions are listed
+
+SIDES = (('buy', mt5.ORDER_TYPE_BUY_STOP), ('sell', mt5.ORDER_TYPE_SELL_STOP))
+
+def ticket_key(side, leg):
+    """State key of the ticket tracking one leg (leg 0 keeps the single-order key)."""
+    return f'{side}_stop_ticket' if leg == 0 else f'{side}_stop_ticket_{leg}'
+
+def desired_orders(state, depth=1, step=0.0, next_lot=None, digits=5):
+    """Stop orders per armed side: legs 0..depth-1 that have not filled yet in the side's run.
+
+    Leg 0 rests at the side's level with the lot it is armed with; leg k rests k * `step` further
+    out (above for buys, below for sells) with the lot k ladder steps up (`next_lot(lot)`). The
+    continuation legs let a run through a level fill at server speed instead of waiting for a
+    poll cycle per leg.
+    """
+    desired = []
+    for side, order_type in SIDES:
+        lot = state.get(f'{side}_armed_lot')
+        level = state.get(f'initial_{side}_stop_level')
+        if not (lot and level):
+            continue
+        direction = 1 if side == 'buy' else -1
+        filled = state.get(f'{side}_filled_legs', 0)
+        for leg in range(depth):
+            if leg >= filled:
+                desired.append(DesiredOrder(side, leg, order_type, round(level + direction * leg * step, digits), lot))
+            if next_lot is None:
+                break
+            lot = next_lot(lot)
+    return desired
+
+def _same_volume(order, desired):
+    return abs(order.volume_current - desired.volume) < 1e-9
+
+def plan(desired, live_orders, tolerance, tracked=None):
+    """Actions that turn `live_orders` into `desired`. `tracked` ({(side, leg): ticket}) is preferred
+    when several live orders match. TRADE_ACTION_MODIFY can move an order but not resize it, so
+    a volume mismatch is a cancel plus a place."""
+    tracked = tracked or {}
+    live = {order.ticket: order for order in live_orders}
+    keep, modify, place = [], [], []
+
+    # 1. Live orders that already match (type, price and volume)
+    missing = []
+    for d in desired:
+        matches = [o for o in live.values() if o.type == d.type and _same_volume(o, d) and abs(o.price_open - d.price) <= tolerance]
+        if not matches:
+            missing.append(d)
+            continue
+        order = next((o for o in matches if o.ticket == tracked.get((d.side, d.leg))), matches[0])
+        keep.append(Action(KEEP, d.side, order, d))
+        del live[order.ticket]
+
+    # 2. Same type and volume at another price: one modify instead of cancel + place
+    for d in missing:
+        order = next((o for o in live.values() if o.type == d.type and _same_volume(o, d)), None)
+        if order is None:
+            place.append(Action(PLACE, d.side, None, d))
+            continue
+        modify.append(Action(MODIFY, d.side, order, d))
+        del live[order.ticket]
+
+    # 3. Everything else that rests on the server is not part of the grid any more
+    cancel = [Action(CANCEL, None, order, None) for order in live.values()]
+    # Cancels go out before places, so the grid never holds more pending volume than planned.
+    # Places nearest to price first, so a throttled cycle still arms the levels.
+    place.sort(key=lambda a: a.desired.leg)
+    return keep + cancel + modify + place
+
+def throttle(actions, max_places):
+    """Drops continuation-leg places beyond `max_places` (None = no cap). Level orders, cancels and
+    modifies always go out; the dropped legs are planned again next cycle."""
+    if max_places is None:
+        return actions
+    kept, places = [], 0
+    for action in actions:
+        if action.kind == PLACE and action.desired.leg > 0:
+            if places >= max_places:
+                continue
+            places += 1
+        kept.append(action)
+    return kept
+
+class PriceRange:
+    """High-low range of the prices seen in the last `window` seconds (the volatility measure
+    used to slow down leg placement)."""
+
+    def __init__(self, window):
+        self.window_msc = int(window * 1000)
+        self.prices = deque() # (time_msc, price)
+
+    def update(self, time_msc, price):
+        """Adds a price and returns the current range."""
+        if not self.prices or time_msc > self.prices[-1][0]:
+            self.prices.append((time_msc, price))
+        while self.prices and self.prices[0][0] < time_msc - self.window_msc:
+            self.prices.popleft()
+        values = [p for _, p in self.prices]
+        return max(values) - min(values) if values else 0.0
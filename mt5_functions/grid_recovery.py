@@ -0,0 +1,92 @@
+from utils.logger import logger
+from collections import namedtuple
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+
+# Warm start: rebuilds a grid's state from what is on the trade server when the state file is
+# lost or was reset while orders/positions of the grid still exist. Everything comes from one
+# bulk read (the cycle snapshot's orders and positions, plus the recent deal history).
+#
+# The open positions are the fills of the current grid run (positions are only closed by a
+# stop-out). Their opening deals give the fill order and volumes; the resting stop orders give
+# the exact levels and armed lots. The side that filled last is mid-run; the other side is armed
+# and waiting, exactly as the state machine in check_and_manage_grid would have left it.
+
+Fill = namedtuple('Fill', ['side', 'volume', 'price', 'time_msc', 'ticket'])
+
+def _fills(positions, deals):
+    """The current run's fills in time order: opening deals of open positions (or the positions themselves)."""
+    open_ids = {p.identifier: p for p in positions}
+    fills = [Fill('buy' if d.type == mt5.DEAL_TYPE_BUY else 'sell', d.volume, d.price, d.time_msc, d.ticket)
+             for d in (deals or []) if d.entry == mt5.DEAL_ENTRY_IN and d.position_id in open_ids]
+    seen = {d.position_id for d in (deals or []) if d.entry == mt5.DEAL_ENTRY_IN}
+    # Positions opened before the deal history window
+    fills += [Fill('buy' if p.type == mt5.POSITION_TYPE_BUY else 'sell', p.volume, p.price_open, p.time_msc, 0)
+              for p in positions if p.identifier not in seen]
+    return sorted(fills, key=lambda f: (f.time_msc, f.ticket))
+
+def rebuild_state(orders, positions, deals, spec, distance):
+    """Grid state keys reconstructed from the grid's orders, positions and recent deals.
+
+    `distance` is the price distance from the market to a level at initialization; it places a
+    level that has neither a resting order nor a fill (2 * distance from the other level).
+    Returns {} if there is nothing to rebuild from.
+    """
+    symbol_info = spec.info
+    stops = {'buy': sorted((o for o in orders if o.type == mt5.ORDER_TYPE_BUY_STOP), key=lambda o: o.price_open),
+             'sell': sorted((o for o in orders if o.type == mt5.ORDER_TYPE_SELL_STOP), key=lambda o: -o.price_open)}
+    fills = _fills(positions, deals)
+    if not fills and not stops['buy'] and not stops['sell']:
+        return {}
+
+    # Levels: the nearest resting stop or fill of each side (continuation legs lie further out)
+    levels = {}
+    for side, nearest in (('buy', min), ('sell', max)):
+        prices = [o.price_open for o in stops[side]] + [f.price for f in fills if f.side == side]
+        if prices:
+            levels[side] = round(nearest(prices), symbol_info.digits)
+    if 'buy' not in levels:
+        levels['buy'] = round(levels['sell'] + 2 * distance, symbol_info.digits)
+    if 'sell' not in levels:
+        levels['sell'] = round(levels['buy'] - 2 * distance, symbol_info.digits)
+
+    volumes = [o.volume_current for o in orders if o.type in (mt5.ORDER_TYPE_BUY_STOP, mt5.ORDER_TYPE_SELL_STOP)]
+    volumes += [f.volume for f in fills]
+    initial_lot = spec.normalize_lot(min(volumes)) # The ladder starts at the smallest leg of the run
+
+    state = {'initialized': True, 'initial_lot': initial_lot}
+    last_side = fills[-1].side if fills else None
+    for side in ('buy', 'sell'):
+        side_fills = [f for f in fills if f.side == side]
+        state[f'initial_{side}_stop_level'] = levels[side]
+        state[f'next_{side}_lot'] = spec.next_lot(side_fills[-1].volume if side_fills else initial_lot, initial_lot)
+        level_order = next((o for o in stops[side] if abs(o.price_open - levels[side]) <= symbol_info.point / 2), None)
+
+        if side == last_side:
+            # Mid-run: armed with the lot of the run's first (level) fill, which already filled
+            run = []
+            for f in reversed(fills):
+                if f.side != side:
+                    break
+                run.insert(0, f)
+            state[f'{side}_armed_lot'] = run[0].volume
+            state[f'{side}_filled_legs'] = len(run)
+        elif level_order is not None:
+            state[f'{side}_armed_lot'] = level_order.volume_current
+            state[f'{side}_stop_ticket'] = level_order.ticket
+            state[f'{side}_filled_legs'] = 0
+        else:
+            # Waiting side whose order is gone: armed with its next lot, the planner places it again
+            state[f'{side}_armed_lot'] = spec.normalize_lot(state[f'next_{side}_lot']) if last_side else initial_lot
+            state[f'{side}_filled_legs'] = 0
+        state[f'last_placed_{side}_lot'] = state[f'{side}_armed_lot']
+
+    logger.info("Rebuilt grid state from %s orders, %s positions (%s fills): levels %s / %s, initial lot %s, last fill: %s.",
+                len(orders), len(positions), len(fills), levels['buy'], levels['sell'], initial_lot, last_side)
+    return state
+
+def last_deal(deals):
+    """(time_msc, ticket) of the newest deal, for starting the deal cursor after a warm start."""
+    if not deals:
+        return None
+    deal = max(deals, key=lambda d: (d.time_msc, d.ticket))
+    return deal.time_msc, deal.ticket
@@ -0,0 +1,140 @@
+from utils.logger import logger
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+import utils.constants as const
+import utils.metrics as metrics
+import mt5_functions.mt5_api as mt5_api
+import mt5_functions.execution_recorder as execution_recorder
+import mt5_functions.rate_limiter as rate_limiter
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+
+# Drawdown stop-out path: gets flat as fast as possible instead of closing positions one by one.
+# Every round builds all cancel and close requests from a single snapshot and sends the cancels
+# concurrently. The closes go out once the cancels are answered (at most
+# LIQUIDATION_CANCEL_WAIT_SECONDS), so no pending order of the grid fills while positions are
+# being closed. Then it re-snapshots and repeats only for whatever is still open, which includes
+# a position opened by a stop that filled before its cancel arrived.
+
+LiquidationReport = namedtuple('LiquidationReport', [
+    'flat', 'rounds', 'closed', 'cancelled', 'failed', 'remaining_positions', 'remaining_orders', 'time_to_flat'])
+
+_executor = None
+_liquidation_lock = threading.Lock() # The watchdog thread and the main loop may both fire a stop-out
+last_report = None # Most recent LiquidationReport (picked up by monitoring)
+
+def _get_executor():
+    # Created once and reused: spawning threads at stop-out time would only add latency
+    global _executor
+    if _executor is None:
+        # Concurrent requests only where the backend serves them concurrently (the simulator)
+        workers = const.LIQUIDATION_WORKERS if getattr(mt5, 'THREAD_SAFE', False) else 1
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="liquidation")
+    return _executor
+
+def build_cancel_request(order):
+    return {
+        "action": mt5.TRADE_ACTION_REMOVE,
+        "order": order.ticket,
+        "comment": "Drawdown Stop Out",
+    }
+
+def build_close_request(position, tick):
+    # Close with the opposite deal at the snapshot price
+    close_type = mt5.ORDER_TYPE_SELL if position.type == mt5.POSITION_TYPE_BUY else mt5.ORDER_TYPE_BUY
+    return {
+        "action": mt5.TRADE_ACTION_DEAL,
+        "position": position.ticket,
+        "symbol": position.symbol,
+        "volume": position.volume,
+        "type": close_type,
+        "price": tick.bid if close_type == mt5.ORDER_TYPE_SELL else tick.ask,
+        "deviation": const.DEFAULT_DEVIATION, # Allow some slippage for market close
+        "magic": position.magic,
+        "comment": "Drawdown Stop Out",
+        "type_time": mt5.ORDER_TIME_GTC,
+        "type_filling": mt5.ORDER_FILLING_IOC, # IOC or FOK commonly used for closing
+    }
+
+def _send_once(request, round_number, symbol):
+    # Single attempt: a failed request is rebuilt from a fresh snapshot next round, never resent stale.
+    # Liquidation is never held back by the rate limiter, but its requests use up the budget of the other classes.
+    rate_limiter.request_limiter.try_acquire(rate_limiter.LIQUIDATION, symbol)
+    try:
+        with metrics.timer('mt5_call_duration_seconds', call='order_send'):
+            return execution_recorder.timed_order_send(mt5.order_send, request, round_number)
+    except Exception as e:
+        logger.error("Exception sending liquidation request %s: %s", request, e, exc_info=True)
+        return None
+
+def liquidate(snapshot, max_rounds=None, timeout=None):
+    """Cancels all pending orders and closes all positions of the snapshot's symbol/magic.
+
+    Returns a LiquidationReport; time_to_flat is measured from the call until nothing is left
+    (or until the rounds/timeout budget ran out).
+    """
+    max_rounds = max_rounds or const.LIQUIDATION_MAX_ROUNDS
+    timeout = timeout if timeout is not None else const.LIQUIDATION_TIMEOUT_SECONDS
+    started = time.perf_counter()
+    # Grid orders (queued retries or new ones) must not re-open exposure behind the liquidation
+    mt5_api.order_scheduler.halt()
+    with _liquidation_lock:
+        return _liquidate(snapshot, max_rounds, timeout, started)
+
+def _residue(snapshot):
+    """(orders, positions, complete). A failed read is not flat: the next round reads again."""
+    orders, positions = snapshot.orders, snapshot.positions
+    return orders or [], positions or [], orders is not None and positions is not None
+
+def _liquidate(snapshot, max_rounds, timeout, started):
+    global last_report
+    executor = _get_executor()
+    closed = cancelled = failed = rounds = 0
+    orders, positions, complete = _residue(snapshot)
+
+    while (orders or positions or not complete) and rounds < max_rounds and time.perf_counter() - started < timeout:
+        rounds += 1
+        tick = snapshot.tick
+        if positions and not tick:
+            logger.error("Could not get tick for %s to close positions. Retrying with a new snapshot.", snapshot.symbol)
+        logger.info("Liquidation round %s: cancelling %s orders, closing %s positions", rounds, len(orders), len(positions))
+
+        # Cancels first, and the closes only once they are answered: a stop left pending could fill
+        # while positions are being closed. A cancel still outstanding after the wait is settled by
+        # the next round's snapshot.
+        cancel_futures = [executor.submit(_send_once, build_cancel_request(o), rounds, o.symbol) for o in orders]
+        if cancel_futures:
+            _, outstanding = wait(cancel_futures, timeout=const.LIQUIDATION_CANCEL_WAIT_SECONDS)
+            if outstanding:
+                logger.warning("%s cancel(s) still unanswered after %ss. Closing positions anyway.", len(outstanding), const.LIQUIDATION_CANCEL_WAIT_SECONDS)
+        close_futures = [executor.submit(_send_once, build_close_request(p, tick), rounds, p.symbol) for p in positions] if tick else []
+
+        for order, future in zip(orders, cancel_futures):
+            result = future.result()
+            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                cancelled += 1
+            else:
+                failed += 1
+                logger.error("Failed to cancel order %s during liquidation. Result: %s", order.ticket, result)
+        for position, future in zip(positions, close_futures):
+            result = future.result()
+            if result and result.retcode in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_DONE_PARTIAL):
+                closed += 1
+            else:
+                failed += 1
+                logger.error("Failed to close position %s during liquidation. Result: %s", position.ticket, result)
+
+        # Re-snapshot: only the residue (failed or partially closed) goes into the next round
+        snapshot = mt5_api.MarketSnapshot(snapshot.symbol, snapshot.magic)
+        orders, positions, complete = _residue(snapshot)
+
+    time_to_flat = time.perf_counter() - started
+    last_report = LiquidationReport(
+        flat=complete and not orders and not positions, rounds=rounds, closed=closed, cancelled=cancelled, failed=failed,
+        remaining_positions=len(positions), remaining_orders=len(orders), time_to_flat=time_to_flat)
+    if last_report.flat:
+        logger.warning("Liquidation flat after %s round(s): time_to_flat=%.1f ms, closed %s positions, cancelled %s orders.", rounds, time_to_flat * 1000, closed, cancelled)
+    else:
+        logger.error("Liquidation incomplete after %s round(s) / %.2fs: %s positions and %s orders remain.", rounds, time_to_flat, len(positions), len(orders))
+    return last_report
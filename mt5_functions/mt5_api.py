@@ -1,13 +1,24 @@
-import MetaTrader5 as mt5
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+import mt5_functions.backend as backend
 from utils.logger import logger
+import bisect
+import heapq
+import threading
+from collections import namedtuple
 import time
+from concurrent.futures import Future
 import utils.constants as const # Import constants for retry logic
+import utils.grid_math as grid_math
+import utils.metrics as metrics
+import mt5_functions.execution_recorder as execution_recorder
+import mt5_functions.rate_limiter as rate_limiter
+from mt5_functions.deal_reconciler import HISTORY_DATE_TO
 
 def connect_mt5():
     if not mt5.initialize():
-        logger.error(f"initialize() failed, error code = {mt5.last_error()}")
+        logger.error("initialize() failed, error code = %s", mt5.last_error())
         return False
-    logger.info(f"MetaTrader5 initialized successfully. Version: {mt5.version()}")
+    logger.info("MetaTrader5 initialized successfully. Version: %s", mt5.version())
     # Additional checks like login status could be added here if needed
     return True
 
@@ -15,74 +26,273 @@ def disconnect_mt5():
     mt5.shutdown()
     logger.info("MetaTrader5 connection shut down.")
 
+def wait_for_reconnect(timeout):
+    """Blocks until the terminal is reachable again (at most `timeout` seconds). Returns True if it is.
+
+    With the terminal worker the supervisor reconnects with backoff on its own; without it this
+    is one connect_mt5() attempt after LOOP_DELAY_SECONDS.
+    """
+    if backend.worker_running():
+        return mt5.wait_connected(timeout)
+    time.sleep(const.LOOP_DELAY_SECONDS)
+    return connect_mt5()
+
 def get_account_info():
-    account_info = mt5.account_info()
+    with metrics.timer('mt5_call_duration_seconds', call='account_info'):
+        account_info = mt5.account_info()
     if account_info is None:
-        logger.error(f"Failed to get account info, error code = {mt5.last_error()}")
+        logger.error("Failed to get account info, error code = %s", mt5.last_error())
         return None
     return account_info
 
 def get_symbol_info(symbol):
     symbol_info = mt5.symbol_info(symbol)
     if symbol_info is None:
-        logger.error(f"Failed to get symbol info for {symbol}, error code = {mt5.last_error()}")
+        logger.error("Failed to get symbol info for %s, error code = %s", symbol, mt5.last_error())
         return None
     # Ensure the symbol is available in MarketWatch
     if not symbol_info.visible:
-        logger.warning(f"Symbol {symbol} is not visible in MarketWatch. Attempting to select.")
+        logger.warning("Symbol %s is not visible in MarketWatch. Attempting to select.", symbol)
         if not mt5.symbol_select(symbol, True):
-            logger.error(f"Failed to select symbol {symbol} in MarketWatch, error code = {mt5.last_error()}")
+            logger.error("Failed to select symbol %s in MarketWatch, error code = %s", symbol, mt5.last_error())
             return None
         # Retry getting info after selecting
         symbol_info = mt5.symbol_info(symbol)
         if symbol_info is None:
-            logger.error(f"Failed to get symbol info for {symbol} even after selecting, error code = {mt5.last_error()}")
+            logger.error("Failed to get symbol info for %s even after selecting, error code = %s", symbol, mt5.last_error())
             return None
     return symbol_info
 
 def get_symbol_tick(symbol):
-    symbol_tick = mt5.symbol_info_tick(symbol)
+    with metrics.timer('mt5_call_duration_seconds', call='symbol_info_tick'):
+        symbol_tick = mt5.symbol_info_tick(symbol)
     if symbol_tick is None:
-        logger.error(f"Failed to get symbol tick for {symbol}, error code = {mt5.last_error()}")
+        logger.error("Failed to get symbol tick for %s, error code = %s", symbol, mt5.last_error())
         return None
     return symbol_tick
 
+# --- Symbol Spec Cache ---
+
+LotLadder = namedtuple('LotLadder', ['lots', 'margins']) # Normalized lot and margin (None if unknown) per grid leg
+
+class SymbolSpec:
+    """A symbol's trading spec (symbol_info plus the margin of one lot) and the lot ladders derived from it."""
+
+    def __init__(self, info, margin_per_lot):
+        self.info = info
+        self.margin_per_lot = margin_per_lot if margin_per_lot and margin_per_lot > 0 else None
+        self.fetched_at = time.monotonic()
+        self._ladders = {}
+
+    def normalize_lot(self, lot):
+        return grid_math.normalize_lot(lot, self.info.volume_min, self.info.volume_max, self.info.volume_step)
+
+    def ladder(self, initial_lot, multiplier=None):
+        """The LOT_MULTIPLIER series from initial_lot up to volume_max, built once per spec."""
+        multiplier = multiplier or const.LOT_MULTIPLIER
+        key = (initial_lot, multiplier)
+        ladder = self._ladders.get(key)
+        if ladder is None:
+            info = self.info
+            lots = grid_math.lot_ladder(initial_lot, multiplier, info.volume_min, info.volume_max, info.volume_step)
+            margins = [round(lot * self.margin_per_lot, 2) if self.margin_per_lot else None for lot in lots]
+            ladder = self._ladders[key] = LotLadder(lots, margins)
+        return ladder
+
+    def next_lot(self, lot, initial_lot=None):
+        """Normalized lot of the leg that follows a `lot` leg. A ladder lookup when `lot` is one of
+        the ladder's rungs (full fills); otherwise (partial fills, no initial lot known) computed."""
+        if initial_lot:
+            lots = self.ladder(initial_lot).lots
+            index = bisect.bisect_left(lots, lot - 1e-9)
+            if index < len(lots) and abs(lots[index] - lot) < 1e-9:
+                return lots[min(index + 1, len(lots) - 1)]
+        return self.normalize_lot(grid_math.next_lot(lot, const.LOT_MULTIPLIER))
+
+class SymbolSpecCache:
+    """Symbol specs kept for SYMBOL_SPEC_TTL_SECONDS, so sizing needs no terminal round-trip.
+
+    Trade errors that suggest a stale spec (invalid volume, price, stops or filling) drop the
+    symbol's entry; the next read refetches it.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._specs = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol):
+        with self._lock:
+            spec = self._specs.get(symbol)
+        if spec is not None and time.monotonic() - spec.fetched_at < self.ttl:
+            return spec
+        info = get_symbol_info(symbol)
+        if info is None:
+            return None
+        tick = get_symbol_tick(symbol)
+        margin_per_lot = None
+        if tick:
+            with metrics.timer('mt5_call_duration_seconds', call='order_calc_margin'):
+                margin_per_lot = mt5.order_calc_margin(mt5.ORDER_TYPE_BUY, symbol, 1.0, tick.ask)
+        spec = SymbolSpec(info, margin_per_lot)
+        with self._lock:
+            self._specs[symbol] = spec
+        logger.debug("Cached symbol spec for %s (margin per lot: %s)", symbol, spec.margin_per_lot)
+        return spec
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._specs.clear()
+            else:
+                self._specs.pop(symbol, None)
+
+symbol_specs = SymbolSpecCache(const.SYMBOL_SPEC_TTL_SECONDS)
+
+# --- Per-cycle Market Snapshot ---
+
+class TerminalSnapshot:
+    """Caches the terminal state the bot reads during one loop cycle, for all grids at once.
+
+    Account info, all orders and all positions are each fetched at most once per cycle, without
+    filters, and partitioned by (symbol, magic) in memory, so the number of terminal calls does not
+    grow with the number of grids. Ticks and symbol specs are cached per symbol. Trade actions that
+    change terminal state call invalidate() so the next read sees fresh data.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def _get(self, key, fetch):
+        # Failed fetches (None) are cached too, so a bad cycle costs the same number of calls
+        if key not in self._cache:
+            self._cache[key] = fetch()
+        return self._cache[key]
+
+    @property
+    def account(self):
+        return self._get('account', get_account_info)
+
+    def tick(self, symbol):
+        return self._get(('tick', symbol), lambda: get_symbol_tick(symbol))
+
+    def spec(self, symbol):
+        return self._get(('spec', symbol), lambda: symbol_specs.get(symbol))
+
+    def symbol_info(self, symbol):
+        spec = self.spec(symbol)
+        return spec.info if spec else None
+
+    def deals(self, symbol, magic):
+        """Recent deals (RECOVERY_HISTORY_DAYS), only read for a warm start."""
+        return self._get('deals', lambda: _partition(get_recent_deals(const.RECOVERY_HISTORY_DAYS))).get((symbol, magic), [])
+
+    def orders(self, symbol, magic):
+        """The grid's pending orders, or None if the read failed (unknown, not empty)."""
+        partitions = self._get('orders', lambda: _partition(get_orders()))
+        return partitions.get((symbol, magic), []) if partitions is not None else None
+
+    def positions(self, symbol, magic):
+        """The grid's open positions, or None if the read failed (unknown, not empty)."""
+        partitions = self._get('positions', lambda: _partition(get_positions()))
+        return partitions.get((symbol, magic), []) if partitions is not None else None
+
+    def invalidate(self):
+        """Drops everything a trade action can change. Symbol specs are kept (see SymbolSpecCache)."""
+        for key in list(self._cache):
+            if key in ('account', 'orders', 'positions', 'deals') or key[0] == 'tick':
+                del self._cache[key]
+
+def _partition(items):
+    if items is None:
+        return None
+    partitions = {}
+    for item in items:
+        partitions.setdefault((item.symbol, item.magic), []).append(item)
+    return partitions
+
+class MarketSnapshot:
+    """One grid's (symbol, magic) view of a TerminalSnapshot.
+
+    Each piece (account, tick, orders, positions, symbol info) is served from the shared
+    terminal snapshot; without one, the view gets a private snapshot of its own.
+    """
+
+    def __init__(self, symbol, magic, terminal=None):
+        self.symbol = symbol
+        self.magic = magic
+        self.terminal = terminal or TerminalSnapshot()
+
+    @property
+    def account(self):
+        return self.terminal.account
+
+    @property
+    def tick(self):
+        return self.terminal.tick(self.symbol)
+
+    @property
+    def orders(self):
+        return self.terminal.orders(self.symbol, self.magic)
+
+    @property
+    def positions(self):
+        return self.terminal.positions(self.symbol, self.magic)
+
+    @property
+    def deals(self):
+        return self.terminal.deals(self.symbol, self.magic)
+
+    @property
+    def symbol_info(self):
+        return self.terminal.symbol_info(self.symbol)
+
+    @property
+    def spec(self):
+        return self.terminal.spec(self.symbol)
+
+    def invalidate(self):
+        """Drops everything a trade action can change (for every grid sharing the terminal snapshot)."""
+        self.terminal.invalidate()
+
 # --- Functions for Trading Operations ---
 
 def get_positions(symbol=None, magic=None):
     try:
-        if symbol:
-            if magic:
-                positions = mt5.positions_get(symbol=symbol, magic=magic)
-            else:
+        # Note: mt5.positions_get doesn't have magic filter either, filter manually
+        with metrics.timer('mt5_call_duration_seconds', call='positions_get'):
+            if symbol:
                 positions = mt5.positions_get(symbol=symbol)
-        elif magic:
-            positions = mt5.positions_get(magic=magic)
-        else:
-            positions = mt5.positions_get()
+            else:
+                positions = mt5.positions_get()
 
         if positions is None:
-            logger.error(f"Failed to get positions, error code = {mt5.last_error()}")
-            return [] # Return empty list on error
-        return list(positions)
+            logger.error("Failed to get positions, error code = %s", mt5.last_error())
+            return None # Unknown, not "no positions": callers must not act on it
+
+        positions_list = list(positions)
+        if magic:
+            positions_list = [p for p in positions_list if p.magic == magic]
+        return positions_list
     except Exception as e:
-        logger.error(f"Exception in get_positions: {e}")
-        return []
+        logger.error("Exception in get_positions: %s", e)
+        return None
 
 def get_orders(symbol=None, magic=None):
     try:
-        if symbol:
-            if magic:
-                 # Note: mt5.orders_get doesn't have magic filter, filter manually
-                orders = mt5.orders_get(symbol=symbol)
+        with metrics.timer('mt5_call_duration_seconds', call='orders_get'):
+            if symbol:
+                if magic:
+                     # Note: mt5.orders_get doesn't have magic filter, filter manually
+                    orders = mt5.orders_get(symbol=symbol)
+                else:
+                    orders = mt5.orders_get(symbol=symbol)
             else:
-                orders = mt5.orders_get(symbol=symbol)
-        else:
-            orders = mt5.orders_get()
+                orders = mt5.orders_get()
 
         if orders is None:
-            logger.error(f"Failed to get orders, error code = {mt5.last_error()}")
-            return []
+            logger.error("Failed to get orders, error code = %s", mt5.last_error())
+            return None # Unknown, not "no orders": callers must not act on it
 
         orders_list = list(orders)
         if magic:
@@ -91,95 +301,300 @@ def get_orders(symbol=None, magic=None):
 
         return orders_list
     except Exception as e:
-        logger.error(f"Exception in get_orders: {e}")
+        logger.error("Exception in get_orders: %s", e)
+        return None
+
+def get_recent_deals(days):
+    """Deals of the last `days` days (all symbols), or [] if the history cannot be read."""
+    with metrics.timer('mt5_call_duration_seconds', call='history_deals_get'):
+        deals = backend.bulk_call('history_deals_get', int(time.time() - days * 86400), HISTORY_DATE_TO)
+    if deals is None:
+        logger.error("Failed to get deal history, error code = %s", mt5.last_error())
         return []
+    return list(deals)
 
-def cancel_order(ticket):
-    logger.info(f"Attempting to cancel order ticket: {ticket}")
+def cancel_order(ticket, snapshot=None, deadline=None):
+    """Queues removal of a pending order. Returns a Future resolving to True/False."""
+    logger.info("Attempting to cancel order ticket: %s", ticket)
     request = {
         "action": mt5.TRADE_ACTION_REMOVE, # Action type for removing pending orders
         "order": ticket,
         "comment": "Cancel Grid Order" # Simplified comment
     }
-    result = send_order(request) # Uses the improved send_order
-    # Check specifically for TRADE_RETCODE_DONE for cancellation
-    if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-        logger.info(f"Successfully cancelled order ticket: {ticket}, result: {result}")
-        return True
-    else:
+    cancelled = Future()
+
+    def on_done(send_future):
+        result = send_future.result()
+        # Check specifically for TRADE_RETCODE_DONE for cancellation
+        if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+            logger.info("Successfully cancelled order ticket: %s, result: %s", ticket, result)
+            cancelled.set_result(True)
+            return
         # Error already logged in send_order if it failed completely
         if result: # Log specific failure reason if result exists but code is wrong
-            logger.error(f"Failed to cancel order ticket: {ticket}, retcode: {result.retcode}, comment: {result.comment}")
-        else: # Log if send_order returned None
-             logger.error(f"Failed to cancel order ticket: {ticket}, send_order returned None")
-        return False
+            logger.error("Failed to cancel order ticket: %s, retcode: %s, comment: %s", ticket, result.retcode, result.comment)
+        else: # Log if send_order resolved to None
+            logger.error("Failed to cancel order ticket: %s, send_order returned None", ticket)
+        cancelled.set_result(False)
 
-def send_order(request):
-    """Sends an order request to MetaTrader 5 with retry logic."""
-    for attempt in range(const.RETRY_COUNT):
-        logger.debug(f"Sending order request (Attempt {attempt + 1}/{const.RETRY_COUNT}): {request}")
-        try:
-            result = mt5.order_send(request)
-            
-            if result is None:
-                last_error = mt5.last_error()
-                logger.error(f"order_send failed on attempt {attempt + 1}. Error code = {last_error}")
-                # Check if the error suggests retrying might help (e.g., connection issues, timeout)
-                # This requires knowledge of specific error codes, for now, retry on None result
-                if attempt < const.RETRY_COUNT - 1:
-                    logger.info(f"Waiting {const.RETRY_DELAY_SECONDS}s before retrying...")
-                    time.sleep(const.RETRY_DELAY_SECONDS)
-                    continue # Go to the next attempt
-                else:
-                    return None # Max retries reached
-            
-            logger.info(f"Order send attempt {attempt + 1} result: {result}")
-
-            # Check return code for success or specific retryable errors
-            # Success codes depend on action type (e.g., PLACED/DONE for pending/remove, DONE for market close)
-            success_codes = (
-                mt5.TRADE_RETCODE_PLACED, 
-                mt5.TRADE_RETCODE_DONE, 
-                mt5.TRADE_RETCODE_DONE_PARTIAL # Consider partial fills success for market orders if applicable
-            )
-            retryable_codes = (
-                mt5.TRADE_RETCODE_REQUOTE, 
-                mt5.TRADE_RETCODE_PRICE_OFF, 
-                mt5.TRADE_RETCODE_CONNECTION, 
-                mt5.TRADE_RETCODE_TIMEOUT
-                # Add other potentially temporary error codes here
-            )
-
-            if result.retcode in success_codes:
-                logger.debug(f"Order request successful with code {result.retcode}.")
-                return result # Success!
-            elif result.retcode in retryable_codes:
-                logger.warning(f"Order send attempt {attempt + 1} resulted in retryable code: {result.retcode} ({result.comment}).")
-                if attempt < const.RETRY_COUNT - 1:
-                    logger.info(f"Waiting {const.RETRY_DELAY_SECONDS}s before retrying...")
-                    time.sleep(const.RETRY_DELAY_SECONDS)
-                    continue # Go to the next attempt
-                else:
-                    logger.error(f"Max retries reached for retryable error code {result.retcode}.")
-                    return result # Return the last result even if it's an error
+    send_order(request, snapshot=snapshot, deadline=deadline, tag=f"cancel:{ticket}",
+               priority=rate_limiter.CANCEL).add_done_callback(on_done)
+    return cancelled
+
+# --- Order Retry Scheduler ---
+
+# last_error() code of a call that timed out in the terminal worker (outcome unknown, not retried)
+TIMEOUT_ERROR = getattr(mt5, 'RES_E_INTERNAL_FAIL_TIMEOUT', -10005)
+
+# Success codes depend on action type (e.g., PLACED/DONE for pending/remove, DONE for market close)
+SUCCESS_RETCODES = (
+    mt5.TRADE_RETCODE_PLACED,
+    mt5.TRADE_RETCODE_DONE,
+    mt5.TRADE_RETCODE_DONE_PARTIAL # Consider partial fills success for market orders if applicable
+)
+RETRYABLE_RETCODES = (
+    mt5.TRADE_RETCODE_REQUOTE,
+    mt5.TRADE_RETCODE_TOO_MANY_REQUESTS, # Broker throttling: the rate limiter also backs off
+    mt5.TRADE_RETCODE_PRICE_OFF,
+    mt5.TRADE_RETCODE_CONNECTION,
+    mt5.TRADE_RETCODE_TIMEOUT
+    # Add other potentially temporary error codes here
+)
+# Non-retryable retcodes that may come from a stale symbol spec (it is refetched before the next order)
+SPEC_ERROR_RETCODES = (
+    mt5.TRADE_RETCODE_INVALID_VOLUME,
+    mt5.TRADE_RETCODE_INVALID_PRICE,
+    mt5.TRADE_RETCODE_INVALID_STOPS,
+    mt5.TRADE_RETCODE_INVALID_FILL,
+)
+
+class OrderIntent:
+    """One queued trade request: its future, retry bookkeeping and the deadline after which it is stale."""
+    __slots__ = ('request', 'future', 'snapshot', 'deadline', 'tag', 'priority', 'symbol', 'attempt', 'due', 'throttled')
+
+    def __init__(self, request, future, snapshot, deadline, tag, priority):
+        self.request = request
+        self.future = future
+        self.snapshot = snapshot
+        self.deadline = deadline
+        self.tag = tag
+        self.priority = priority
+        # Removals carry no symbol: budget them against the snapshot's symbol
+        self.symbol = request.get('symbol') or (snapshot.symbol if snapshot is not None else None)
+        self.attempt = 0
+        self.due = 0.0
+        self.throttled = False # Waiting for a rate limiter token (counted once per wait)
+
+    def __lt__(self, other):
+        return (self.due, self.priority) < (other.due, other.priority)
+
+class OrderScheduler:
+    """Sends trade requests and schedules their retries instead of sleeping between attempts.
+
+    submit() makes the first attempt immediately and returns a Future. Retryable failures are
+    re-queued with exponential backoff and re-sent from poll(), which the main loop calls while
+    it keeps doing drawdown checks and grid management. An intent whose deadline passes before
+    its next attempt is dropped (its future resolves to None) rather than resent at a stale price.
+    Every attempt needs a token from the request limiter; an intent that gets none waits in the
+    queue, and intents that are due together are sent in priority order.
+    """
+
+    def __init__(self, retry_count, retry_delay, backoff_multiplier, max_delay, intent_ttl, limiter):
+        self.retry_count = retry_count
+        self.retry_delay = retry_delay
+        self.backoff_multiplier = backoff_multiplier
+        self.max_delay = max_delay
+        self.intent_ttl = intent_ttl
+        self.limiter = limiter
+        self._queue = [] # Heap of OrderIntent ordered by next attempt time
+        self._lock = threading.Lock()
+        self.halted = False
+
+    def submit(self, request, snapshot=None, deadline=None, tag=None, priority=None):
+        future = Future()
+        if self.halted:
+            logger.warning("Order scheduler halted (stop-out in progress), request not sent: %s", request)
+            future.set_result(None)
+            return future
+        if deadline is None:
+            deadline = time.monotonic() + self.intent_ttl
+        if priority is None:
+            priority = rate_limiter.CANCEL if request.get('action') == mt5.TRADE_ACTION_REMOVE else rate_limiter.GRID
+        self._dispatch(OrderIntent(request, future, snapshot, deadline, tag, priority))
+        return future
+
+    def poll(self):
+        """Runs every queued attempt that is due. Returns the number of intents that completed."""
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            while self._queue and self._queue[0].due <= now:
+                due.append(heapq.heappop(self._queue))
+        completed = 0
+        # Highest priority takes the tokens first; within a class, the earliest deadline
+        for intent in sorted(due, key=lambda i: (i.priority, i.deadline)):
+            if time.monotonic() > intent.deadline:
+                logger.warning("Dropping stale order intent after %s attempt(s) (deadline passed): %s", intent.attempt, intent.request)
+                intent.future.set_result(None)
             else:
-                # Non-retryable error code (e.g., invalid params, no money)
-                logger.error(f"Order send attempt {attempt + 1} failed with non-retryable code: {result.retcode} ({result.comment}).")
-                return result # Return the error result immediately
+                self._dispatch(intent)
+            if intent.future.done():
+                completed += 1
+        if due:
+            self._report_depth()
+        return completed
+
+    def next_due_in(self):
+        """Seconds until the next queued retry is due (None if nothing is queued)."""
+        with self._lock:
+            if not self._queue:
+                return None
+            return max(0.0, self._queue[0].due - time.monotonic())
+
+    def has_pending(self, tag=None):
+        with self._lock:
+            return any(tag is None or intent.tag == tag for intent in self._queue)
+
+    def cancel_pending(self):
+        """Drops every queued retry (their futures resolve to None). Returns how many were dropped."""
+        with self._lock:
+            dropped, self._queue = self._queue, []
+        for intent in dropped:
+            logger.warning("Dropping queued order intent: %s", intent.request)
+            intent.future.set_result(None)
+        return len(dropped)
+
+    def halt(self):
+        """Stops all grid order flow: queued retries are dropped and new submissions are refused.
+
+        There is no resume: a stop-out ends the run (run_bot exits after it), so the scheduler stays
+        halted until the bot is restarted.
+        """
+        self.halted = True
+        return self.cancel_pending()
+
+    def drain(self, timeout):
+        """Services retries until the queue is empty or timeout expires (used at shutdown)."""
+        end = time.monotonic() + timeout
+        while self.has_pending() and time.monotonic() < end:
+            self.poll()
+            wait = self.next_due_in()
+            time.sleep(min(wait if wait is not None else 0.0, max(0.0, end - time.monotonic())))
+        return not self.has_pending()
+
+    def wait(self, future, timeout):
+        """Polls the scheduler until `future` resolves. Only for scripts/tests; the bot never blocks on it."""
+        end = time.monotonic() + timeout
+        while not future.done() and time.monotonic() < end:
+            self.poll()
+            time.sleep(0.01)
+        return future.result() if future.done() else None
+
+    def _report_depth(self):
+        with self._lock:
+            depths = dict.fromkeys(rate_limiter.PRIORITY_NAMES, 0)
+            for intent in self._queue:
+                depths[intent.priority] += 1
+        for priority, depth in depths.items():
+            metrics.set_gauge('order_send_queue_depth', depth, priority=rate_limiter.PRIORITY_NAMES[priority])
+
+    def _dispatch(self, intent):
+        # Sends now if the limiter has a token for the intent, otherwise queues it until one is expected
+        wait = self.limiter.try_acquire(intent.priority, intent.symbol)
+        if wait <= 0:
+            intent.throttled = False
+            self._attempt(intent)
+            return
+        if not intent.throttled:
+            intent.throttled = True
+            metrics.inc('order_send_throttled_total', priority=rate_limiter.PRIORITY_NAMES[intent.priority])
+            logger.debug("Rate limit: holding %s request for %.3fs: %s", rate_limiter.PRIORITY_NAMES[intent.priority], wait, intent.request)
+        intent.due = time.monotonic() + wait
+        with self._lock:
+            heapq.heappush(self._queue, intent)
+        self._report_depth()
 
+    def _retry_later(self, intent, reason, retcode):
+        # retcode: metrics label for what caused the retry (trade retcode, "error" or "exception")
+        if intent.attempt >= self.retry_count:
+            metrics.inc('order_send_results_total', retcode=retcode)
+            return False
+        delay = min(self.retry_delay * self.backoff_multiplier ** (intent.attempt - 1), self.max_delay)
+        intent.due = time.monotonic() + delay
+        if intent.due > intent.deadline:
+            metrics.inc('order_send_results_total', retcode=retcode)
+            return False # The retry would land after the deadline: give up now
+        metrics.inc('order_send_retries_total', retcode=retcode)
+        logger.info("Retrying in %.2fs after %s (attempt %s/%s)", delay, reason, intent.attempt, self.retry_count)
+        with self._lock:
+            heapq.heappush(self._queue, intent)
+        return True
+
+    def _attempt(self, intent):
+        intent.attempt += 1
+        attempt, request = intent.attempt, intent.request
+        logger.debug("Sending order request (Attempt %s/%s): %s", attempt, self.retry_count, request)
+        try:
+            with metrics.timer('mt5_call_duration_seconds', call='order_send'):
+                result = execution_recorder.timed_order_send(mt5.order_send, request, attempt)
         except Exception as e:
-            logger.error(f"Exception during order_send attempt {attempt + 1}: {e}", exc_info=True)
-            if attempt < const.RETRY_COUNT - 1:
-                 logger.info(f"Waiting {const.RETRY_DELAY_SECONDS}s before retrying after exception...")
-                 time.sleep(const.RETRY_DELAY_SECONDS)
-                 continue # Go to the next attempt
-            else:
+            logger.error("Exception during order_send attempt %s: %s", attempt, e, exc_info=True)
+            if not self._retry_later(intent, "exception", "exception"):
                 logger.error("Max retries reached after exception in order_send.")
-                return None # Failed after retries
-                
-    # Should not be reached if loop completes correctly, but as a fallback:
-    logger.error("send_order finished all retries without returning a result.")
-    return None
+                intent.future.set_result(None) # Failed after retries
+            return
+
+        if result is None:
+            last_error = mt5.last_error()
+            logger.error("order_send failed on attempt %s. Error code = %s", attempt, last_error)
+            if last_error and last_error[0] == TIMEOUT_ERROR:
+                # The request may have reached the server: resending could duplicate it. The next
+                # cycle's snapshot shows whether it went through.
+                metrics.inc('order_send_results_total', retcode="timeout")
+                intent.future.set_result(None)
+                return
+            # Check if the error suggests retrying might help (e.g., connection issues, timeout)
+            # This requires knowledge of specific error codes, for now, retry on None result
+            if not self._retry_later(intent, f"error {last_error}", "error"):
+                intent.future.set_result(None) # Max retries reached
+            return
+
+        logger.info("Order send attempt %s result: %s", attempt, result)
+
+        if result.retcode in SUCCESS_RETCODES:
+            logger.debug("Order request successful with code %s.", result.retcode)
+            metrics.inc('order_send_results_total', retcode=result.retcode)
+            if intent.snapshot is not None:
+                intent.snapshot.invalidate() # Orders/positions/account changed on the terminal side
+            intent.future.set_result(result) # Success!
+        elif result.retcode in RETRYABLE_RETCODES:
+            if result.retcode == mt5.TRADE_RETCODE_TOO_MANY_REQUESTS:
+                self.limiter.penalize(intent.symbol)
+            logger.warning("Order send attempt %s resulted in retryable code: %s (%s).", attempt, result.retcode, result.comment)
+            if not self._retry_later(intent, f"retcode {result.retcode}", result.retcode):
+                logger.error("Max retries reached for retryable error code %s.", result.retcode)
+                intent.future.set_result(result) # Return the last result even if it's an error
+        else:
+            # Non-retryable error code (e.g., invalid params, no money)
+            logger.error("Order send attempt %s failed with non-retryable code: %s (%s).", attempt, result.retcode, result.comment)
+            metrics.inc('order_send_results_total', retcode=result.retcode)
+            if result.retcode in SPEC_ERROR_RETCODES and request.get('symbol'):
+                symbol_specs.invalidate(request['symbol'])
+            intent.future.set_result(result) # Return the error result immediately
+
+order_scheduler = OrderScheduler(
+    const.RETRY_COUNT, const.RETRY_DELAY_SECONDS, const.RETRY_BACKOFF_MULTIPLIER,
+    const.RETRY_MAX_DELAY_SECONDS, const.ORDER_INTENT_TTL_SECONDS, rate_limiter.request_limiter)
+
+def send_order(request, snapshot=None, deadline=None, tag=None, priority=None):
+    """Sends an order request to MetaTrader 5; retries are scheduled, never slept on.
+
+    Returns a Future resolving to the final OrderSendResult (or None). If a snapshot is given
+    it is invalidated once the terminal accepts the request. `deadline` is a time.monotonic()
+    value after which pending retries are dropped; `tag` lets callers check for in-flight intents.
+    `priority` is the rate limiter class (default: cancel for removals, grid otherwise).
+    """
+    return order_scheduler.submit(request, snapshot=snapshot, deadline=deadline, tag=tag, priority=priority)
 
 # Functions for interacting with the MetaTrader 5 API will go here
 # e.g., get_symbol_info, get_account_info, place_order, etc.
@@ -190,26 +605,26 @@ if __name__ == '__main__':
         # Test account info
         acc_info = get_account_info()
         if acc_info:
-            logger.info(f"Account Info: Login={acc_info.login}, Balance={acc_info.balance}, Equity={acc_info.equity}")
+            logger.info("Account Info: Login=%s, Balance=%s, Equity=%s", acc_info.login, acc_info.balance, acc_info.equity)
 
         # Test symbol info (use a common symbol like EURUSD)
         test_symbol = "EURUSD"
         sym_info = get_symbol_info(test_symbol)
         if sym_info:
-            logger.info(f"Symbol Info ({test_symbol}): Point={sym_info.point}, Digits={sym_info.digits}, StopLevel={sym_info.trade_stops_level}")
+            logger.info("Symbol Info (%s): Point=%s, Digits=%s, StopLevel=%s", test_symbol, sym_info.point, sym_info.digits, sym_info.trade_stops_level)
 
         # Test tick info
         tick_info = get_symbol_tick(test_symbol)
         if tick_info:
-            logger.info(f"Tick Info ({test_symbol}): Bid={tick_info.bid}, Ask={tick_info.ask}, Time={tick_info.time}")
+            logger.info("Tick Info (%s): Bid=%s, Ask=%s, Time=%s", test_symbol, tick_info.bid, tick_info.ask, tick_info.time)
 
         # Test get_positions
-        positions = get_positions(magic=12345) # Example magic number
-        logger.info(f"Found {len(positions)} positions with magic 12345: {positions}")
+        positions = get_positions(magic=12345) or [] # Example magic number
+        logger.info("Found %s positions with magic 12345: %s", len(positions), positions)
 
         # Test get_orders
-        orders = get_orders(magic=12345) # Example magic number
-        logger.info(f"Found {len(orders)} orders with magic 12345: {orders}")
+        orders = get_orders(magic=12345) or [] # Example magic number
+        logger.info("Found %s orders with magic 12345: %s", len(orders), orders)
 
         # Test order placement (Example: place a small pending order if none exist)
         if not orders and not positions:
@@ -229,13 +644,13 @@ if __name__ == '__main__':
                     "type_time": mt5.ORDER_TIME_GTC,
                     "type_filling": mt5.ORDER_FILLING_IOC, # Or FOK depending on broker
                 }
-                result = send_order(test_request)
+                result = order_scheduler.wait(send_order(test_request, priority=rate_limiter.DIAGNOSTIC), timeout=30)
                 if result and result.order:
                     test_order_ticket = result.order
-                    logger.info(f"Placed test order with ticket: {test_order_ticket}")
+                    logger.info("Placed test order with ticket: %s", test_order_ticket)
                     # Test cancel order
                     time.sleep(2) # Give time for order to appear
-                    if cancel_order(test_order_ticket):
+                    if order_scheduler.wait(cancel_order(test_order_ticket), timeout=30):
                         logger.info("Successfully cancelled test order.")
                     else:
                         logger.error("Failed to cancel test order.")
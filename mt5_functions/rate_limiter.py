@@ -0,0 +1,96 @@
+import threading
+import time
+import utils.constants as const
+import utils.metrics as metrics
+
+# Request budget for order_send, shared by every caller (grid orders, cancels, liquidation).
+#
+# Each request takes one token from the global bucket and one from its symbol's bucket. Buckets
+# refill at the broker's allowed rate up to a burst size. Priority classes are kept apart by
+# reserves: a class may only take a token while the bucket stays above its floor, so the last
+# ORDER_RATE_RESERVE tokens are left to the classes above it, and under contention cancels go out
+# before new grid orders. Liquidation never waits: it always takes its token (the bucket may go
+# into debt), which holds back everything else until the budget has refilled.
+
+LIQUIDATION, CANCEL, GRID, DIAGNOSTIC = 0, 1, 2, 3
+PRIORITY_NAMES = {LIQUIDATION: 'liquidation', CANCEL: 'cancel', GRID: 'grid', DIAGNOSTIC: 'diagnostic'}
+
+class TokenBucket:
+    """Tokens refilling at `rate` per second up to `burst`. Not thread-safe (guarded by the limiter)."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, floor):
+        """Seconds until a token can be taken without going below `floor` (0 = now)."""
+        missing = floor + 1 - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float('inf')
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+class RequestRateLimiter:
+    """Global and per-symbol token buckets with priority reserves (rate <= 0 disables the limit)."""
+
+    def __init__(self, rate, burst, symbol_rate, symbol_burst, reserve):
+        self.symbol_rate = symbol_rate
+        self.symbol_burst = symbol_burst
+        self.reserve = reserve
+        self.enabled = rate > 0
+        self._global = TokenBucket(rate, burst)
+        self._symbols = {} # symbol -> TokenBucket
+        self._lock = threading.Lock()
+
+    def _buckets(self, symbol, now):
+        buckets = [self._global]
+        if symbol and self.symbol_rate > 0:
+            bucket = self._symbols.get(symbol)
+            if bucket is None:
+                bucket = self._symbols[symbol] = TokenBucket(self.symbol_rate, self.symbol_burst)
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.refill(now)
+        return buckets
+
+    def _floor(self, priority):
+        # Tokens a class must leave in the bucket for the classes above it
+        return (priority - CANCEL) * self.reserve
+
+    def try_acquire(self, priority, symbol=None):
+        """Takes a token for one request. Returns 0 if it may be sent now, otherwise the seconds to
+        wait before asking again. Liquidation is always granted."""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            buckets = self._buckets(symbol, time.monotonic())
+            if priority != LIQUIDATION:
+                floor = self._floor(priority)
+                wait = max(bucket.wait_time(floor) for bucket in buckets)
+                if wait > 0:
+                    return wait
+            for bucket in buckets:
+                # Debt is bounded, so a long stop-out does not block grid orders for minutes afterwards
+                bucket.tokens = max(bucket.tokens - 1, -bucket.burst)
+        metrics.inc('order_send_tokens_total', priority=PRIORITY_NAMES[priority])
+        return 0.0
+
+    def penalize(self, symbol=None):
+        """The broker rejected a request for sending too fast: empties the buckets involved."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for bucket in self._buckets(symbol, time.monotonic()):
+                bucket.drain()
+
+request_limiter = RequestRateLimiter(
+    const.ORDER_RATE_LIMIT_PER_SECOND, const.ORDER_RATE_BURST,
+    const.ORDER_SYMBOL_RATE_LIMIT_PER_SECOND, const.ORDER_SYMBOL_RATE_BURST, const.ORDER_RATE_RESERVE)
@@ -0,0 +1,755 @@
+"""Offline stand-in for the MetaTrader5 package.
+
+Exposes the subset of the MetaTrader5 module API used by the bot (initialize, account_info,
+symbol_info, symbol_info_tick, orders_get, positions_get, history_deals_get, order_send,
+order_calc_margin, last_error and the trade constants) on top of a small in-process matching engine.
+copy_ticks_range / copy_ticks_from / copy_rates_range serve the ticks the simulator has produced
+so far (the last SIM_TICK_HISTORY per symbol).
+Prices come from a recorded tick file (CSV: time_msc,bid,ask) or a seeded random walk and
+advance with wall-clock time at SIM_TICKS_PER_SECOND, so the real run_bot loop can be
+load-tested and profiled on machines without a terminal.
+
+Select it at startup with MT5_BACKEND=sim (see mt5_functions/backend.py).
+"""
+import bisect
+import csv
+import fnmatch
+import random
+import threading
+import time
+from collections import namedtuple
+
+import utils.constants as const
+
+# Every entry point runs under the terminal lock and last_error() is kept per thread, so the
+# terminal worker may serve calls to the simulator concurrently (the MetaTrader5 package makes no
+# such promise: its calls are serialized).
+THREAD_SAFE = True
+
+# --- MetaTrader5 Constants ---
+
+TRADE_ACTION_DEAL = 1
+TRADE_ACTION_PENDING = 5
+TRADE_ACTION_SLTP = 6
+TRADE_ACTION_MODIFY = 7
+TRADE_ACTION_REMOVE = 8
+TRADE_ACTION_CLOSE_BY = 10
+
+ORDER_TYPE_BUY = 0
+ORDER_TYPE_SELL = 1
+ORDER_TYPE_BUY_LIMIT = 2
+ORDER_TYPE_SELL_LIMIT = 3
+ORDER_TYPE_BUY_STOP = 4
+ORDER_TYPE_SELL_STOP = 5
+
+POSITION_TYPE_BUY = 0
+POSITION_TYPE_SELL = 1
+
+ORDER_TIME_GTC = 0
+ORDER_TIME_DAY = 1
+ORDER_TIME_SPECIFIED = 2
+ORDER_TIME_SPECIFIED_DAY = 3
+
+ORDER_FILLING_FOK = 0
+ORDER_FILLING_IOC = 1
+ORDER_FILLING_RETURN = 2
+
+SYMBOL_FILLING_FOK = 1
+SYMBOL_FILLING_IOC = 2
+
+SYMBOL_TRADE_MODE_FULL = 4
+
+DEAL_TYPE_BUY = 0
+DEAL_TYPE_SELL = 1
+
+DEAL_ENTRY_IN = 0
+DEAL_ENTRY_OUT = 1
+
+DEAL_REASON_CLIENT = 0
+DEAL_REASON_EXPERT = 3
+DEAL_REASON_SO = 6
+
+COPY_TICKS_ALL = -1
+COPY_TICKS_INFO = 1
+COPY_TICKS_TRADE = 2
+
+TIMEFRAME_M1 = 1
+TIMEFRAME_M5 = 5
+TIMEFRAME_M15 = 15
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1 = 16385
+TIMEFRAME_H4 = 16388
+TIMEFRAME_D1 = 16408
+_TIMEFRAME_SECONDS = {TIMEFRAME_M1: 60, TIMEFRAME_M5: 300, TIMEFRAME_M15: 900, TIMEFRAME_M30: 1800,
+                      TIMEFRAME_H1: 3600, TIMEFRAME_H4: 14400, TIMEFRAME_D1: 86400}
+
+ORDER_STATE_PLACED = 1
+ORDER_STATE_CANCELED = 2
+ORDER_STATE_FILLED = 4
+
+TRADE_RETCODE_REQUOTE = 10004
+TRADE_RETCODE_REJECT = 10006
+TRADE_RETCODE_CANCEL = 10007
+TRADE_RETCODE_PLACED = 10008
+TRADE_RETCODE_DONE = 10009
+TRADE_RETCODE_DONE_PARTIAL = 10010
+TRADE_RETCODE_ERROR = 10011
+TRADE_RETCODE_TIMEOUT = 10012
+TRADE_RETCODE_INVALID = 10013
+TRADE_RETCODE_INVALID_VOLUME = 10014
+TRADE_RETCODE_INVALID_PRICE = 10015
+TRADE_RETCODE_INVALID_STOPS = 10016
+TRADE_RETCODE_TRADE_DISABLED = 10017
+TRADE_RETCODE_MARKET_CLOSED = 10018
+TRADE_RETCODE_NO_MONEY = 10019
+TRADE_RETCODE_PRICE_CHANGED = 10020
+TRADE_RETCODE_PRICE_OFF = 10021
+TRADE_RETCODE_INVALID_EXPIRATION = 10022
+TRADE_RETCODE_ORDER_CHANGED = 10023
+TRADE_RETCODE_TOO_MANY_REQUESTS = 10024
+TRADE_RETCODE_NO_CHANGES = 10025
+TRADE_RETCODE_INVALID_FILL = 10030
+TRADE_RETCODE_CONNECTION = 10031
+TRADE_RETCODE_INVALID_ORDER = 10035
+TRADE_RETCODE_POSITION_CLOSED = 10036
+
+RES_S_OK = 1
+RES_E_FAIL = -1
+RES_E_INVALID_PARAMS = -2
+RES_E_NOT_FOUND = -4
+RES_E_INTERNAL_FAIL_INIT = -10003
+RES_E_INTERNAL_FAIL_TIMEOUT = -10005
+
+# --- Result Types (same field names as the MetaTrader5 package) ---
+
+AccountInfo = namedtuple('AccountInfo', [
+    'login', 'trade_mode', 'leverage', 'limit_orders', 'margin_so_mode', 'trade_allowed', 'trade_expert',
+    'margin_mode', 'currency_digits', 'fifo_close', 'balance', 'credit', 'profit', 'equity', 'margin',
+    'margin_free', 'margin_level', 'margin_so_call', 'margin_so_so', 'name', 'server', 'currency', 'company'])
+TerminalInfo = namedtuple('TerminalInfo', [
+    'community_account', 'connected', 'trade_allowed', 'tradeapi_disabled', 'build', 'name', 'company', 'path'])
+SymbolInfo = namedtuple('SymbolInfo', [
+    'name', 'visible', 'select', 'digits', 'point', 'spread', 'trade_stops_level', 'trade_freeze_level',
+    'trade_contract_size', 'trade_tick_size', 'trade_tick_value', 'volume_min', 'volume_max', 'volume_step',
+    'filling_mode', 'trade_mode', 'bid', 'ask', 'time', 'currency_base', 'currency_profit', 'currency_margin',
+    'description'])
+Tick = namedtuple('Tick', ['time', 'bid', 'ask', 'last', 'volume', 'time_msc', 'flags', 'volume_real'])
+# Record layouts of copy_ticks_* / copy_rates_* (NumPy structured arrays in the MetaTrader5 package)
+TICK_DTYPE = [('time', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<u8'),
+              ('time_msc', '<i8'), ('flags', '<u4'), ('volume_real', '<f8')]
+RATE_DTYPE = [('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+              ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')]
+TradeOrder = namedtuple('TradeOrder', [
+    'ticket', 'time_setup', 'time_setup_msc', 'time_done', 'time_done_msc', 'time_expiration', 'type',
+    'type_time', 'type_filling', 'state', 'magic', 'position_id', 'position_by_id', 'reason',
+    'volume_initial', 'volume_current', 'price_open', 'sl', 'tp', 'price_current', 'price_stoplimit',
+    'symbol', 'comment', 'external_id'])
+TradePosition = namedtuple('TradePosition', [
+    'ticket', 'time', 'time_msc', 'time_update', 'time_update_msc', 'type', 'magic', 'identifier', 'reason',
+    'volume', 'price_open', 'sl', 'tp', 'price_current', 'swap', 'profit', 'symbol', 'comment', 'external_id'])
+TradeDeal = namedtuple('TradeDeal', [
+    'ticket', 'order', 'time', 'time_msc', 'type', 'entry', 'magic', 'position_id', 'reason', 'volume', 'price',
+    'commission', 'swap', 'profit', 'fee', 'symbol', 'comment', 'external_id'])
+OrderSendResult = namedtuple('OrderSendResult', [
+    'retcode', 'deal', 'order', 'volume', 'price', 'bid', 'ask', 'comment', 'request_id', 'retcode_external',
+    'request'])
+
+# --- Tick Sources ---
+
+def synthetic_ticks(start_price, volatility_points, spread_points, point, digits, interval_ms, seed, start_msc=None):
+    """Endless seeded random walk of (time_msc, bid, ask)."""
+    rng = random.Random(seed)
+    time_msc = start_msc if start_msc is not None else int(time.time() * 1000)
+    mid = start_price
+    half_spread = spread_points * point / 2
+    while True:
+        mid += rng.gauss(0.0, volatility_points) * point
+        yield time_msc, round(mid - half_spread, digits), round(mid + half_spread, digits)
+        time_msc += interval_ms
+
+def csv_ticks(path):
+    """Replays recorded ticks from a CSV file with time_msc,bid,ask columns (header optional)."""
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip().lstrip('-').isdigit():
+                continue # Skip header / blank lines
+            yield int(row[0]), float(row[1]), float(row[2])
+
+def ring_ticks(path):
+    """Replays a tick capture file written by the tick recorder (mt5_functions/tick_recorder.py)."""
+    from mt5_functions.tick_recorder import load_ticks
+    time_msc, bid, ask = load_ticks(path)
+    yield from zip(time_msc.tolist(), bid.tolist(), ask.tolist())
+
+# --- Matching Engine ---
+
+class _SimSymbol:
+    def __init__(self, name, feed, digits=5, contract_size=100000.0, stops_level=0,
+                 volume_min=0.01, volume_max=100.0, volume_step=0.01):
+        self.name = name
+        self.feed = feed
+        self.digits = digits
+        self.point = 10 ** -digits
+        self.contract_size = contract_size
+        self.stops_level = stops_level
+        self.volume_min = volume_min
+        self.volume_max = volume_max
+        self.volume_step = volume_step
+        self.tick = None
+        self.exhausted = False
+        self.history_msc, self.history_bid, self.history_ask = [], [], [] # For copy_ticks_* / copy_rates_range
+
+    def advance(self):
+        try:
+            time_msc, bid, ask = next(self.feed)
+        except StopIteration:
+            self.exhausted = True # Replay finished: the market freezes on the last tick
+            return False
+        self.tick = Tick(time_msc // 1000, bid, ask, 0.0, 0, time_msc, 6, 0.0)
+        self.history_msc.append(time_msc)
+        self.history_bid.append(bid)
+        self.history_ask.append(ask)
+        if len(self.history_msc) > 2 * const.SIM_TICK_HISTORY:
+            # Trimmed in halves, so appending stays O(1) amortized
+            del self.history_msc[:-const.SIM_TICK_HISTORY], self.history_bid[:-const.SIM_TICK_HISTORY], self.history_ask[:-const.SIM_TICK_HISTORY]
+        return True
+
+    def history(self, from_msc, to_msc=None, count=None):
+        """(time_msc, bid, ask) lists of the recorded ticks from `from_msc` up to `to_msc` or `count` ticks."""
+        start = bisect.bisect_left(self.history_msc, from_msc)
+        end = bisect.bisect_right(self.history_msc, to_msc) if to_msc is not None else len(self.history_msc)
+        if count is not None:
+            end = min(end, start + count)
+        return self.history_msc[start:end], self.history_bid[start:end], self.history_ask[start:end]
+
+    def info(self):
+        bid, ask = self.tick.bid, self.tick.ask
+        return SymbolInfo(
+            self.name, True, True, self.digits, self.point, int(round((ask - bid) / self.point)), self.stops_level, 0,
+            self.contract_size, self.point, self.contract_size * self.point, self.volume_min, self.volume_max,
+            self.volume_step, SYMBOL_FILLING_IOC, SYMBOL_TRADE_MODE_FULL, bid, ask, self.tick.time, self.name[:3], self.name[3:6],
+            self.name[:3], f"Simulated {self.name}")
+
+class SimulatedTerminal:
+    """Single-account hedging terminal with stop/limit order triggering, margin and equity tracking."""
+
+    def __init__(self, balance, leverage, ticks_per_second=0.0, stop_out_level=50.0,
+                 requote_probability=0.0, order_latency_ms=0, seed=None):
+        self.lock = threading.RLock()
+        self.balance = float(balance)
+        self.leverage = leverage
+        self.ticks_per_second = ticks_per_second
+        self.stop_out_level = stop_out_level
+        self.requote_probability = requote_probability
+        self.order_latency_ms = order_latency_ms
+        self.rng = random.Random(seed)
+        self.symbols = {}
+        self.orders = {}
+        self.positions = {}
+        self.deals = [] # Append-only deal history, in execution order
+        self.next_ticket = 1
+        self.connected = False
+        self._errors = threading.local() # last_error() of each calling thread
+        self.ticks_processed = 0
+        self.clock_start = None
+
+    @property
+    def error(self):
+        return getattr(self._errors, 'value', (RES_S_OK, 'Success'))
+
+    @error.setter
+    def error(self, value):
+        self._errors.value = value
+
+    # --- Setup / clock ---
+
+    def add_symbol(self, name, feed, **spec):
+        with self.lock:
+            sim_symbol = _SimSymbol(name, feed, **spec)
+            if not sim_symbol.advance():
+                raise ValueError(f"Tick source for {name} is empty")
+            self.symbols[name] = sim_symbol
+
+    def _sync(self):
+        # Catch the market up with wall-clock time (no-op in manual stepping mode)
+        if self.ticks_per_second <= 0 or self.clock_start is None:
+            return
+        due = int((time.perf_counter() - self.clock_start) * self.ticks_per_second) - self.ticks_processed
+        if due > 0:
+            self.step(due)
+
+    def step(self, count=1):
+        """Advances every symbol by `count` ticks, triggering pending orders on each tick."""
+        with self.lock:
+            for _ in range(count):
+                moved = False
+                for sim_symbol in self.symbols.values():
+                    if not sim_symbol.exhausted and sim_symbol.advance():
+                        moved = True
+                        self._match(sim_symbol)
+                self.ticks_processed += 1
+                if not moved:
+                    break
+                if self.positions:
+                    self._check_stop_out()
+
+    # --- Accounting ---
+
+    def _position_profit(self, pos):
+        tick = self.symbols[pos['symbol']].tick
+        contract_size = self.symbols[pos['symbol']].contract_size
+        if pos['type'] == POSITION_TYPE_BUY:
+            return (tick.bid - pos['price_open']) * pos['volume'] * contract_size
+        return (pos['price_open'] - tick.ask) * pos['volume'] * contract_size
+
+    def _margin_for(self, symbol, volume, price):
+        return volume * self.symbols[symbol].contract_size * price / self.leverage
+
+    def _totals(self):
+        profit = sum(self._position_profit(p) for p in self.positions.values())
+        margin = sum(self._margin_for(p['symbol'], p['volume'], p['price_open']) for p in self.positions.values())
+        return profit, margin
+
+    def _check_stop_out(self):
+        profit, margin = self._totals()
+        while margin > 0 and (self.balance + profit) / margin * 100 < self.stop_out_level:
+            worst = min(self.positions.values(), key=self._position_profit)
+            self._close_position(worst, worst['volume'], reason=DEAL_REASON_SO)
+            if not self.positions:
+                break
+            profit, margin = self._totals()
+
+    # --- Order / position lifecycle ---
+
+    def _new_ticket(self):
+        ticket = self.next_ticket
+        self.next_ticket += 1
+        return ticket
+
+    def _match(self, sim_symbol):
+        tick = sim_symbol.tick
+        for order in [o for o in self.orders.values() if o['symbol'] == sim_symbol.name]:
+            order_type, price = order['type'], order['price_open']
+            if ((order_type == ORDER_TYPE_BUY_STOP and tick.ask >= price)
+                    or (order_type == ORDER_TYPE_SELL_STOP and tick.bid <= price)
+                    or (order_type == ORDER_TYPE_BUY_LIMIT and tick.ask <= price)
+                    or (order_type == ORDER_TYPE_SELL_LIMIT and tick.bid >= price)):
+                del self.orders[order['ticket']]
+                side = POSITION_TYPE_BUY if order_type in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_BUY_LIMIT) else POSITION_TYPE_SELL
+                # Stops fill at the market price that crossed them (slippage included), limits at their price
+                if order_type in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_SELL_STOP):
+                    fill_price = tick.ask if side == POSITION_TYPE_BUY else tick.bid
+                else:
+                    fill_price = price
+                self._open_position(order['symbol'], side, order['volume'], fill_price, order['magic'],
+                                    order['comment'], ticket=order['ticket'])
+
+    def _record_deal(self, order, position_id, symbol, deal_type, entry, volume, price, magic, comment,
+                     profit=0.0, reason=DEAL_REASON_EXPERT):
+        tick = self.symbols[symbol].tick
+        deal = TradeDeal(self._new_ticket(), order, tick.time, tick.time_msc, deal_type, entry, magic, position_id,
+                         reason, volume, price, 0.0, 0.0, round(profit, 2), 0.0, symbol, comment, '')
+        self.deals.append(deal)
+        return deal.ticket
+
+    def _open_position(self, symbol, side, volume, price, magic, comment, ticket=None):
+        tick = self.symbols[symbol].tick
+        # Like MT5 hedging accounts, a position opened by an order keeps the order's ticket
+        ticket = ticket if ticket is not None else self._new_ticket()
+        self.positions[ticket] = {
+            'ticket': ticket, 'symbol': symbol, 'type': side, 'volume': volume, 'price_open': price,
+            'magic': magic, 'comment': comment, 'time_msc': tick.time_msc, 'sl': 0.0, 'tp': 0.0,
+        }
+        self._record_deal(ticket, ticket, symbol, DEAL_TYPE_BUY if side == POSITION_TYPE_BUY else DEAL_TYPE_SELL,
+                          DEAL_ENTRY_IN, volume, price, magic, comment)
+        return ticket
+
+    def _close_position(self, pos, volume, order=0, reason=DEAL_REASON_EXPERT):
+        profit = self._position_profit(pos) * (volume / pos['volume'])
+        tick = self.symbols[pos['symbol']].tick
+        close_price = tick.bid if pos['type'] == POSITION_TYPE_BUY else tick.ask
+        self._record_deal(order, pos['ticket'], pos['symbol'],
+                          DEAL_TYPE_SELL if pos['type'] == POSITION_TYPE_BUY else DEAL_TYPE_BUY, DEAL_ENTRY_OUT,
+                          volume, close_price, pos['magic'], pos['comment'], profit=profit, reason=reason)
+        self.balance += profit
+        remaining = round(pos['volume'] - volume, 8)
+        if remaining <= 0:
+            del self.positions[pos['ticket']]
+        else:
+            pos['volume'] = remaining
+
+    # --- MetaTrader5-compatible API ---
+
+    def _fail(self, code, message):
+        self.error = (code, message)
+        return None
+
+    def account_info(self):
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            profit, margin = self._totals()
+            equity = self.balance + profit
+            margin_level = equity / margin * 100 if margin > 0 else 0.0
+            return AccountInfo(
+                1, 0, self.leverage, 0, 0, True, True, 2, 2, False, round(self.balance, 2), 0.0, round(profit, 2),
+                round(equity, 2), round(margin, 2), round(equity - margin, 2), round(margin_level, 2), 100.0,
+                self.stop_out_level, 'Simulated Account', 'Sim-Server', 'USD', 'Simulator')
+
+    def terminal_info(self):
+        with self.lock:
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            return TerminalInfo(False, True, True, False, 0, 'Simulated Terminal', 'Simulator', '')
+
+    def symbol_info(self, symbol):
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            if symbol not in self.symbols:
+                return self._fail(RES_E_NOT_FOUND, f'Symbol {symbol} not found')
+            return self.symbols[symbol].info()
+
+    def symbol_info_tick(self, symbol):
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            if symbol not in self.symbols:
+                return self._fail(RES_E_NOT_FOUND, f'Symbol {symbol} not found')
+            return self.symbols[symbol].tick
+
+    def copy_ticks(self, symbol, from_msc, to_msc=None, count=None):
+        import numpy as np # Only history requests need NumPy
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            if symbol not in self.symbols:
+                return self._fail(RES_E_NOT_FOUND, f'Symbol {symbol} not found')
+            time_msc, bid, ask = self.symbols[symbol].history(from_msc, to_msc, count)
+        ticks = np.zeros(len(time_msc), dtype=TICK_DTYPE)
+        ticks['time_msc'] = time_msc
+        ticks['time'] = ticks['time_msc'] // 1000
+        ticks['bid'] = bid
+        ticks['ask'] = ask
+        ticks['flags'] = 6 # TICK_FLAG_BID | TICK_FLAG_ASK
+        return ticks
+
+    def copy_rates(self, symbol, timeframe, from_msc, to_msc):
+        import numpy as np
+        seconds = _TIMEFRAME_SECONDS.get(timeframe)
+        if seconds is None:
+            return self._fail(RES_E_INVALID_PARAMS, f'Unsupported timeframe {timeframe}')
+        ticks = self.copy_ticks(symbol, from_msc, to_msc)
+        if ticks is None or not len(ticks):
+            return ticks if ticks is None else np.zeros(0, dtype=RATE_DTYPE)
+        point = self.symbols[symbol].point
+        bar_time = ticks['time'] // seconds * seconds
+        starts = np.flatnonzero(np.diff(bar_time, prepend=bar_time[0] - 1))
+        ends = np.append(starts[1:], len(ticks))
+        rates = np.zeros(len(starts), dtype=RATE_DTYPE)
+        rates['time'] = bar_time[starts]
+        rates['open'] = ticks['bid'][starts]
+        rates['close'] = ticks['bid'][ends - 1]
+        rates['high'] = np.maximum.reduceat(ticks['bid'], starts)
+        rates['low'] = np.minimum.reduceat(ticks['bid'], starts)
+        rates['tick_volume'] = ends - starts
+        rates['spread'] = np.round((ticks['ask'][starts] - ticks['bid'][starts]) / point)
+        return rates
+
+    def orders_get(self, symbol=None, group=None, ticket=None):
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            result = []
+            for o in self.orders.values():
+                if (symbol and o['symbol'] != symbol) or (ticket and o['ticket'] != ticket):
+                    continue
+                tick = self.symbols[o['symbol']].tick
+                price_current = tick.ask if o['type'] in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_BUY_LIMIT) else tick.bid
+                result.append(TradeOrder(
+                    o['ticket'], o['time_msc'] // 1000, o['time_msc'], 0, 0, 0, o['type'], o['type_time'],
+                    o['type_filling'], ORDER_STATE_PLACED, o['magic'], 0, 0, 3, o['volume'], o['volume'],
+                    o['price_open'], o['sl'], o['tp'], price_current, 0.0, o['symbol'], o['comment'], ''))
+            return tuple(result)
+
+    def positions_get(self, symbol=None, group=None, ticket=None):
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            result = []
+            for p in self.positions.values():
+                if (symbol and p['symbol'] != symbol) or (ticket and p['ticket'] != ticket):
+                    continue
+                tick = self.symbols[p['symbol']].tick
+                price_current = tick.bid if p['type'] == POSITION_TYPE_BUY else tick.ask
+                result.append(TradePosition(
+                    p['ticket'], p['time_msc'] // 1000, p['time_msc'], tick.time, tick.time_msc, p['type'],
+                    p['magic'], p['ticket'], 3, p['volume'], p['price_open'], p['sl'], p['tp'], price_current, 0.0,
+                    round(self._position_profit(p), 2), p['symbol'], p['comment'], ''))
+            return tuple(result)
+
+    def history_deals_get(self, date_from=None, date_to=None, group=None, ticket=None, position=None):
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            if ticket is None and position is None and (date_from is None or date_to is None):
+                return self._fail(RES_E_INVALID_PARAMS, 'Invalid arguments')
+            date_from, date_to = _timestamp(date_from), _timestamp(date_to)
+            result = []
+            for deal in self.deals:
+                if ticket is not None:
+                    if deal.ticket == ticket:
+                        result.append(deal)
+                elif position is not None:
+                    if deal.position_id == position:
+                        result.append(deal)
+                elif date_from <= deal.time <= date_to and (not group or fnmatch.fnmatch(deal.symbol, group)):
+                    result.append(deal)
+            return tuple(result)
+
+    def order_calc_margin(self, action, symbol, volume, price):
+        with self.lock:
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            if symbol not in self.symbols:
+                return self._fail(RES_E_NOT_FOUND, f'Symbol {symbol} not found')
+            return round(self._margin_for(symbol, volume, price), 2)
+
+    def order_calc_profit(self, action, symbol, volume, price_open, price_close):
+        with self.lock:
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            if symbol not in self.symbols:
+                return self._fail(RES_E_NOT_FOUND, f'Symbol {symbol} not found')
+            direction = 1 if action == ORDER_TYPE_BUY else -1
+            return round((price_close - price_open) * direction * volume * self.symbols[symbol].contract_size, 2)
+
+    def order_send(self, request):
+        if self.order_latency_ms > 0:
+            time.sleep(self.order_latency_ms / 1000.0) # Broker round trip, outside the lock like a real IPC call
+        with self.lock:
+            self._sync()
+            if not self.connected:
+                return self._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal not initialized')
+            retcode, deal, order, volume, price, comment = self._execute(request)
+            tick = None
+            symbol = request.get('symbol') or self._symbol_of(request)
+            if symbol in self.symbols:
+                tick = self.symbols[symbol].tick
+            self.error = (RES_S_OK, 'Success')
+            return OrderSendResult(
+                retcode, deal, order, volume, price, tick.bid if tick else 0.0, tick.ask if tick else 0.0,
+                comment, 0, 0, request)
+
+    def _symbol_of(self, request):
+        if request.get('order') in self.orders:
+            return self.orders[request['order']]['symbol']
+        if request.get('position') in self.positions:
+            return self.positions[request['position']]['symbol']
+        return None
+
+    def _valid_volume(self, sim_symbol, volume):
+        if volume < sim_symbol.volume_min - 1e-9 or volume > sim_symbol.volume_max + 1e-9:
+            return False
+        steps = volume / sim_symbol.volume_step
+        return abs(steps - round(steps)) < 1e-6
+
+    def _execute(self, request):
+        # Returns (retcode, deal, order, volume, price, comment)
+        action = request.get('action')
+        if self.requote_probability > 0 and action in (TRADE_ACTION_DEAL, TRADE_ACTION_PENDING) \
+                and self.rng.random() < self.requote_probability:
+            return TRADE_RETCODE_REQUOTE, 0, 0, 0.0, 0.0, 'Requote'
+
+        if action == TRADE_ACTION_REMOVE:
+            if self.orders.pop(request.get('order'), None) is None:
+                return TRADE_RETCODE_INVALID_ORDER, 0, 0, 0.0, 0.0, 'Invalid order'
+            return TRADE_RETCODE_DONE, 0, request['order'], 0.0, 0.0, 'Request executed'
+
+        if action == TRADE_ACTION_MODIFY:
+            order = self.orders.get(request.get('order'))
+            if order is None:
+                return TRADE_RETCODE_INVALID_ORDER, 0, 0, 0.0, 0.0, 'Invalid order'
+            sim_symbol = self.symbols[order['symbol']]
+            new_price = request.get('price', order['price_open'])
+            if not self._valid_pending_price(sim_symbol, order['type'], new_price):
+                return TRADE_RETCODE_INVALID_PRICE, 0, 0, 0.0, 0.0, 'Invalid price'
+            order.update(price_open=new_price, sl=request.get('sl', order['sl']), tp=request.get('tp', order['tp']))
+            return TRADE_RETCODE_DONE, 0, order['ticket'], order['volume'], new_price, 'Request executed'
+
+        if action == TRADE_ACTION_SLTP:
+            pos = self.positions.get(request.get('position'))
+            if pos is None:
+                return TRADE_RETCODE_POSITION_CLOSED, 0, 0, 0.0, 0.0, 'Position closed'
+            pos.update(sl=request.get('sl', pos['sl']), tp=request.get('tp', pos['tp']))
+            return TRADE_RETCODE_DONE, 0, 0, 0.0, 0.0, 'Request executed'
+
+        sim_symbol = self.symbols.get(request.get('symbol'))
+        if sim_symbol is None:
+            return TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, 'Invalid request'
+        volume = float(request.get('volume', 0.0))
+        if not self._valid_volume(sim_symbol, volume):
+            return TRADE_RETCODE_INVALID_VOLUME, 0, 0, 0.0, 0.0, 'Invalid volume'
+        tick = sim_symbol.tick
+
+        if action == TRADE_ACTION_PENDING:
+            order_type, price = request.get('type'), float(request.get('price', 0.0))
+            if order_type not in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_SELL_STOP, ORDER_TYPE_BUY_LIMIT, ORDER_TYPE_SELL_LIMIT):
+                return TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, 'Invalid request'
+            if not self._valid_pending_price(sim_symbol, order_type, price):
+                return TRADE_RETCODE_INVALID_PRICE, 0, 0, 0.0, 0.0, 'Invalid price'
+            ticket = self._new_ticket()
+            self.orders[ticket] = {
+                'ticket': ticket, 'symbol': sim_symbol.name, 'type': order_type, 'volume': volume,
+                'price_open': price, 'magic': request.get('magic', 0), 'comment': request.get('comment', ''),
+                'type_time': request.get('type_time', ORDER_TIME_GTC),
+                'type_filling': request.get('type_filling', ORDER_FILLING_RETURN),
+                'sl': request.get('sl', 0.0), 'tp': request.get('tp', 0.0), 'time_msc': tick.time_msc,
+            }
+            return TRADE_RETCODE_DONE, 0, ticket, volume, price, 'Request executed'
+
+        if action == TRADE_ACTION_DEAL:
+            side = request.get('type')
+            price = tick.ask if side == ORDER_TYPE_BUY else tick.bid
+            deviation = request.get('deviation')
+            if deviation is not None and request.get('price') and \
+                    abs(request['price'] - price) > deviation * sim_symbol.point + 1e-12:
+                return TRADE_RETCODE_REQUOTE, 0, 0, 0.0, 0.0, 'Requote'
+            order_ticket = self._new_ticket()
+            position_ticket = request.get('position')
+            if position_ticket:
+                pos = self.positions.get(position_ticket)
+                if pos is None:
+                    return TRADE_RETCODE_POSITION_CLOSED, 0, 0, 0.0, 0.0, 'Position closed'
+                if volume > pos['volume'] + 1e-9:
+                    return TRADE_RETCODE_INVALID_VOLUME, 0, 0, 0.0, 0.0, 'Invalid volume'
+                self._close_position(pos, volume, order=order_ticket)
+            else:
+                profit, margin = self._totals()
+                if self.balance + profit - margin < self._margin_for(sim_symbol.name, volume, price):
+                    return TRADE_RETCODE_NO_MONEY, 0, 0, 0.0, 0.0, 'No money'
+                self._open_position(sim_symbol.name, POSITION_TYPE_BUY if side == ORDER_TYPE_BUY else POSITION_TYPE_SELL,
+                                    volume, price, request.get('magic', 0), request.get('comment', ''), ticket=order_ticket)
+            return TRADE_RETCODE_DONE, order_ticket, order_ticket, volume, price, 'Request executed'
+
+        return TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, 'Unsupported trade action'
+
+    def _valid_pending_price(self, sim_symbol, order_type, price):
+        tick = sim_symbol.tick
+        min_gap = sim_symbol.stops_level * sim_symbol.point
+        if order_type == ORDER_TYPE_BUY_STOP:
+            return price > tick.ask + min_gap - 1e-12 and price > tick.ask
+        if order_type == ORDER_TYPE_SELL_STOP:
+            return price < tick.bid - min_gap + 1e-12 and price < tick.bid
+        if order_type == ORDER_TYPE_BUY_LIMIT:
+            return price < tick.ask - min_gap + 1e-12
+        if order_type == ORDER_TYPE_SELL_LIMIT:
+            return price > tick.bid + min_gap - 1e-12
+        return False
+
+def _timestamp(value):
+    # MT5 accepts datetime or seconds since epoch for history date ranges
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return int(value.timestamp())
+
+# --- Module-level API (drop-in for `import MetaTrader5 as mt5`) ---
+
+_terminal = None
+
+def _default_terminal():
+    terminal = SimulatedTerminal(
+        const.SIM_INITIAL_BALANCE, const.SIM_LEVERAGE, ticks_per_second=const.SIM_TICKS_PER_SECOND,
+        stop_out_level=const.SIM_STOP_OUT_LEVEL, requote_probability=const.SIM_REQUOTE_PROBABILITY,
+        order_latency_ms=const.SIM_ORDER_LATENCY_MS, seed=const.SIM_SEED)
+    digits = 5
+    # Every traded symbol gets a feed; the recorded ticks (if any) drive SYMBOL, the others are synthetic
+    symbols = list(dict.fromkeys([const.SYMBOL] + [grid['symbol'] for grid in const.GRIDS]))
+    for index, symbol in enumerate(symbols):
+        if const.SIM_TICK_FILE and symbol == const.SYMBOL:
+            feed = ring_ticks(const.SIM_TICK_FILE) if const.SIM_TICK_FILE.endswith('.ring') else csv_ticks(const.SIM_TICK_FILE)
+        else:
+            feed = synthetic_ticks(const.SIM_START_PRICE, const.SIM_VOLATILITY_POINTS, const.SIM_SPREAD_POINTS,
+                                   10 ** -digits, digits, const.SIM_TICK_INTERVAL_MS, const.SIM_SEED + index)
+        terminal.add_symbol(symbol, feed, digits=digits)
+    return terminal
+
+def get_terminal():
+    """Returns the simulated terminal instance (for tests/benchmarks that step or inspect it)."""
+    global _terminal
+    if _terminal is None:
+        _terminal = _default_terminal()
+    return _terminal
+
+def initialize(*args, **kwargs):
+    terminal = get_terminal()
+    with terminal.lock:
+        terminal.connected = True
+        if terminal.clock_start is None:
+            terminal.clock_start = time.perf_counter()
+        terminal.error = (RES_S_OK, 'Success')
+    return True
+
+def shutdown():
+    if _terminal is not None:
+        _terminal.connected = False
+    return True
+
+def version():
+    return (500, 0, 'Simulated')
+
+def last_error():
+    return get_terminal().error
+
+def terminal_info():
+    return get_terminal().terminal_info()
+
+def account_info():
+    return get_terminal().account_info()
+
+def symbol_info(symbol):
+    return get_terminal().symbol_info(symbol)
+
+def symbol_select(symbol, enable=True):
+    return symbol in get_terminal().symbols
+
+def symbol_info_tick(symbol):
+    return get_terminal().symbol_info_tick(symbol)
+
+def orders_get(symbol=None, group=None, ticket=None):
+    return get_terminal().orders_get(symbol=symbol, group=group, ticket=ticket)
+
+def positions_get(symbol=None, group=None, ticket=None):
+    return get_terminal().positions_get(symbol=symbol, group=group, ticket=ticket)
+
+def history_deals_get(date_from=None, date_to=None, group=None, ticket=None, position=None):
+    return get_terminal().history_deals_get(date_from, date_to, group=group, ticket=ticket, position=position)
+
+def order_send(request):
+    return get_terminal().order_send(request)
+
+def order_calc_margin(action, symbol, volume, price):
+    return get_terminal().order_calc_margin(action, symbol, volume, price)
+
+def order_calc_profit(action, symbol, volume, price_open, price_close):
+    return get_terminal().order_calc_profit(action, symbol, volume, price_open, price_close)
+
+def copy_ticks_range(symbol, date_from, date_to, flags=COPY_TICKS_ALL):
+    return get_terminal().copy_ticks(symbol, _timestamp(date_from) * 1000, _timestamp(date_to) * 1000 + 999)
+
+def copy_ticks_from(symbol, date_from, count, flags=COPY_TICKS_ALL):
+    return get_terminal().copy_ticks(symbol, _timestamp(date_from) * 1000, count=count)
+
+def copy_rates_range(symbol, timeframe, date_from, date_to):
+    return get_terminal().copy_rates(symbol, timeframe, _timestamp(date_from) * 1000, _timestamp(date_to) * 1000 + 999)
+
+def step(count=1):
+    """Advances the simulated market by `count` ticks (manual mode, SIM_TICKS_PER_SECOND = 0)."""
+    get_terminal().step(count)
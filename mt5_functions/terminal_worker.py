@@ -0,0 +1,386 @@
+from utils.logger import logger
+import contextlib
+import importlib
+import inspect
+import itertools
+import multiprocessing
+import queue
+import random
+import signal
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import utils.constants as const
+
+# Runs every terminal call in a supervised worker process.
+#
+# The bot talks to a TerminalProxy that looks like the backend module: constants are read
+# locally, function calls are put on a request queue and answered by the worker process, which
+# serves them on a small thread pool (calls into the MetaTrader5 package run one at a time; only
+# the simulator is called concurrently). Every call has a timeout; a call that times out resolves to
+# None with last_error() = RES_E_INTERNAL_FAIL_TIMEOUT, so a hung terminal IPC call can no longer
+# block the main loop or the equity watchdog. Only that call fails: the worker is restarted when it
+# dies, or when it does not answer a terminal_info() health check after a timeout either (calls
+# still pending on it resolve to None then). A supervisor thread health-checks the terminal every
+# TERMINAL_HEALTH_INTERVAL_SECONDS and reconnects (replaying the last initialize() arguments) with
+# exponential backoff and jitter. Bulk history requests get a longer timeout (backend.bulk_call).
+# Positions and orders live on the trade server, and the bot state in the state file, so a
+# worker or terminal restart loses nothing.
+
+TIMEOUT_ERROR = -10005 # RES_E_INTERNAL_FAIL_TIMEOUT in the MetaTrader5 package
+_STOP = None # Request that ends the worker loop
+
+class TerminalError(Exception):
+    """A terminal call raised inside the worker process (the message is the remote repr)."""
+
+# --- Result encoding ---
+# Terminal records (TradePosition, Tick, ...) are namedtuple-like types that only exist in the
+# worker's backend module, so they cross the process boundary as plain tuples and are rebuilt as
+# namedtuples with the same type and field names on the bot side.
+
+_Record = namedtuple('_Record', ['typename', 'fields', 'values'])
+_record_types = {}
+
+def _encode(value):
+    if hasattr(value, '_asdict'):
+        fields = value._asdict()
+        return _Record(type(value).__name__, tuple(fields), tuple(_encode(v) for v in fields.values()))
+    if isinstance(value, (tuple, list)):
+        return type(value)(_encode(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    return value
+
+def _decode(value):
+    if isinstance(value, _Record):
+        key = (value.typename, value.fields)
+        record_type = _record_types.get(key)
+        if record_type is None:
+            record_type = _record_types[key] = namedtuple(value.typename, value.fields)
+        return record_type(*(_decode(v) for v in value.values))
+    if isinstance(value, (tuple, list)):
+        return type(value)(_decode(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _decode(v) for k, v in value.items()}
+    return value
+
+# --- Worker process ---
+
+def _serve(module_name, requests, responses, threads):
+    """Worker process entry point: runs requested backend calls and answers (call_id, ok, value, last_error)."""
+    # Ctrl+C reaches the whole process group: the bot shuts down, then stops this process itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    module = importlib.import_module(module_name)
+    # The MetaTrader5 package is not documented as thread-safe and its last_error() is
+    # process-global: one call at a time, with its last_error() read before the next one starts.
+    # Only a backend that says otherwise (the simulator) is called concurrently.
+    serial = contextlib.nullcontext() if getattr(module, 'THREAD_SAFE', False) else threading.Lock()
+
+    def run(call_id, name, args, kwargs):
+        try:
+            with serial:
+                result = getattr(module, name)(*args, **kwargs)
+                error = module.last_error() if result is None or result is False else None
+            responses.put((call_id, True, _encode(result), error))
+        except Exception as e:
+            responses.put((call_id, False, repr(e), None))
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            request = requests.get()
+            if request is _STOP:
+                break
+            pool.submit(run, *request)
+
+# --- Bot side ---
+
+class TerminalWorker:
+    """Owns the worker process: request/response queues, call timeouts, restarts and reconnects."""
+
+    def __init__(self, module_name, threads=None, call_timeout=None, health_interval=None,
+                 backoff_base=None, backoff_max=None):
+        self.module_name = module_name
+        self.threads = threads or const.TERMINAL_WORKER_THREADS
+        self.call_timeout = call_timeout or const.TERMINAL_CALL_TIMEOUT_SECONDS
+        self.health_interval = health_interval or const.TERMINAL_HEALTH_INTERVAL_SECONDS
+        self.backoff_base = backoff_base or const.TERMINAL_RECONNECT_BASE_SECONDS
+        self.backoff_max = backoff_max or const.TERMINAL_RECONNECT_MAX_SECONDS
+        self.connected = threading.Event()
+        self.started = False # Set by start(); the proxy calls the backend in-process until then
+        self.restarts = 0
+        self.init_args = None # (args, kwargs) of the last initialize(), replayed on reconnect
+        self._context = multiprocessing.get_context('spawn') # The only start method on Windows
+        self._ids = itertools.count(1)
+        self._pending = {} # call_id -> (future, deadline)
+        self._lock = threading.RLock()
+        self._process = None
+        self._requests = None
+        self._hung = False
+        self._wake = threading.Event() # Set to make the supervisor check the connection now
+        self._stopping = threading.Event()
+        self._supervisor = None
+
+    # --- Process lifecycle ---
+
+    def _start_process(self):
+        requests, responses = self._context.Queue(), self._context.Queue()
+        process = self._context.Process(target=_serve, args=(self.module_name, requests, responses, self.threads),
+                                        name="terminal-worker", daemon=True)
+        process.start()
+        self._process, self._requests, self._hung = process, requests, False
+        threading.Thread(target=self._read_responses, args=(process, responses),
+                         name="terminal-responses", daemon=True).start()
+        logger.info("Terminal worker process started (pid %s).", process.pid)
+
+    def _stop_process(self, graceful):
+        process, requests = self._process, self._requests
+        self._process = self._requests = None
+        if process is None:
+            return
+        if graceful:
+            requests.put(_STOP)
+            process.join(timeout=2)
+        if process.is_alive():
+            process.kill()
+            process.join(timeout=2)
+        self._fail_pending("terminal worker restarted")
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._stopping.is_set():
+                return False
+            if self._process is None:
+                self._start_process()
+            if self._supervisor is None:
+                self._supervisor = threading.Thread(target=self._supervise, name="terminal-supervisor", daemon=True)
+                self._supervisor.start()
+            return True
+
+    def start(self):
+        """Starts the worker process and its supervisor."""
+        self.started = True
+        self._ensure_started()
+
+    def stop(self):
+        """Stops the supervisor and the worker process (idempotent; registered with atexit)."""
+        self._stopping.set()
+        self._wake.set()
+        with self._lock:
+            self._stop_process(graceful=True)
+
+    # --- Calls ---
+
+    def submit(self, name, args=(), kwargs=None, timeout=None):
+        """Queues one backend call. Returns a Future resolving to the result (None on timeout);
+        the backend's last_error() for a failed call is attached as `future.last_error`."""
+        future = Future()
+        future.last_error = None
+        with self._lock:
+            if not self._ensure_started():
+                future.last_error = (TIMEOUT_ERROR, "Terminal worker stopped")
+                future.set_result(None)
+                return future
+            call_id = next(self._ids)
+            self._pending[call_id] = (future, time.monotonic() + (timeout or self.call_timeout))
+            self._requests.put((call_id, name, args, kwargs or {}))
+        return future
+
+    def _read_responses(self, process, responses):
+        # One reader per worker process; it ends when its process is gone and its queue is empty
+        while True:
+            try:
+                call_id, ok, value, error = responses.get(timeout=0.5)
+            except queue.Empty:
+                if not process.is_alive():
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                entry = self._pending.pop(call_id, None)
+            if entry is None:
+                continue # Already timed out
+            future = entry[0]
+            if ok:
+                future.last_error = error
+                future.set_result(_decode(value))
+            else:
+                future.set_exception(TerminalError(value))
+
+    def _expire(self):
+        """Resolves the calls past their deadline to None. Returns how many there were."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [call_id for call_id, (_, deadline) in self._pending.items() if deadline <= now]
+            entries = [self._pending.pop(call_id) for call_id in expired]
+        for future, _ in entries:
+            future.last_error = (TIMEOUT_ERROR, "Terminal call timed out")
+            future.set_result(None)
+        if entries:
+            logger.error("%s terminal call(s) timed out.", len(entries))
+        return len(entries)
+
+    def _fail_pending(self, reason):
+        with self._lock:
+            entries, self._pending = list(self._pending.values()), {}
+        for future, _ in entries:
+            future.last_error = (TIMEOUT_ERROR, reason)
+            future.set_result(None)
+
+    # --- Supervision ---
+
+    def request_reconnect(self):
+        """Marks the terminal as lost and makes the supervisor reconnect now."""
+        self.connected.clear()
+        self._wake.set()
+
+    def _call(self, name, *args, timeout=None, **kwargs):
+        future = self.submit(name, args, kwargs, timeout)
+        try:
+            return future.result(timeout=(timeout or self.call_timeout) + 1)
+        except (FutureTimeout, TerminalError):
+            return None
+
+    def _healthy(self):
+        return self._process is not None and self._process.is_alive() and not self._hung
+
+    def _responsive(self):
+        """Health check after a timeout: True if the worker still answers terminal_info() in time.
+        Calls into a serialized backend queue behind each other, so it allows for the calls still
+        pending (a slow bulk request is not a hang)."""
+        with self._lock:
+            latest = max((deadline for _, deadline in self._pending.values()), default=0)
+        timeout = max(self.call_timeout, latest - time.monotonic())
+        future = self.submit('terminal_info', timeout=timeout)
+        try:
+            future.result(timeout=timeout + 1)
+        except FutureTimeout:
+            return False
+        except TerminalError:
+            return True # It answered
+        return not (future.last_error and future.last_error[0] == TIMEOUT_ERROR)
+
+    def _restart_if_needed(self):
+        # A dead or hung worker is replaced; calls still pending on it resolve to None
+        with self._lock:
+            if not self._healthy() and not self._stopping.is_set():
+                self._stop_process(graceful=False)
+                self._start_process()
+                self.restarts += 1
+
+    def _reconnect(self):
+        attempt = 0
+        while not self._stopping.is_set() and self.init_args is not None:
+            self._restart_if_needed()
+            args, kwargs = self.init_args
+            if self._call('initialize', *args, timeout=const.TERMINAL_INIT_TIMEOUT_SECONDS, **kwargs) and self._call('terminal_info'):
+                self.connected.set()
+                logger.info("Terminal reconnected after %s attempt(s).", attempt + 1)
+                return
+            # Exponential backoff with full jitter, so restarts of several bots do not hit the terminal in lockstep
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            attempt += 1
+            logger.warning("Terminal reconnect attempt %s failed. Next attempt in %.1fs.", attempt, delay)
+            self._stopping.wait(delay)
+
+    def _supervise(self):
+        next_check = time.monotonic() + self.health_interval
+        while not self._stopping.is_set():
+            self._wake.wait(min(0.1, self.health_interval))
+            expired = self._expire()
+            if self._stopping.is_set():
+                break
+            if expired and self._healthy():
+                if self._responsive():
+                    self._wake.set() # Check the terminal connection now as well
+                elif not self._stopping.is_set():
+                    logger.error("The terminal worker does not answer a health check either. Restarting it.")
+                    self._hung = True
+            if self.init_args is None:
+                # Not connected on purpose (before initialize() / after shutdown()): only keep the worker usable
+                self._wake.clear()
+                self._restart_if_needed()
+                continue
+            due = self._wake.is_set() or time.monotonic() >= next_check
+            if not due and self._healthy():
+                continue
+            self._wake.clear()
+            next_check = time.monotonic() + self.health_interval
+            if self._healthy() and self.connected.is_set() and self._call('terminal_info'):
+                continue
+            self.connected.clear()
+            logger.warning("Terminal connection lost. Reconnecting...")
+            self._reconnect()
+
+class TerminalProxy:
+    """Drop-in for the backend module with every function call routed through a TerminalWorker
+    once the worker is started (before that, calls go to the backend module in-process).
+
+    Calls block for at most their timeout; submit() is the non-blocking form returning a Future.
+    last_error() is kept per calling thread, since calls from different threads run concurrently.
+    """
+
+    def __init__(self, module, worker):
+        self._module = module
+        self._worker = worker
+        self._local = threading.local()
+        self._timeout_error = getattr(module, 'RES_E_INTERNAL_FAIL_TIMEOUT', TIMEOUT_ERROR)
+
+    def __getattr__(self, name):
+        value = getattr(self._module, name)
+        if not (inspect.isfunction(value) or inspect.isbuiltin(value)):
+            return value # Constants and types are read locally
+
+        def call(*args, **kwargs):
+            return self._call(name, args, kwargs)
+        call.__name__ = name
+        setattr(self, name, call) # Cache: __getattr__ only runs for the first access
+        return call
+
+    def call(self, name, *args, timeout=None, **kwargs):
+        """Calls `name` with its own timeout instead of the per-call one (bulk history requests)."""
+        return self._call(name, args, kwargs, timeout)
+
+    def _call(self, name, args, kwargs, timeout=None):
+        if not self._worker.started:
+            return getattr(self._module, name)(*args, **kwargs)
+        future = self._worker.submit(name, args, kwargs, timeout)
+        try:
+            result = future.result(timeout=timeout or self._worker.call_timeout)
+            self._local.last_error = future.last_error
+        except FutureTimeout:
+            result = None
+            self._local.last_error = (self._timeout_error, f"Terminal call {name} timed out")
+        return result
+
+    def submit(self, name, *args, **kwargs):
+        """Non-blocking call: returns a Future resolving to the result (None on failure or timeout)."""
+        if not self._worker.started:
+            future = Future()
+            future.set_result(self._call(name, args, kwargs))
+            future.last_error = self._module.last_error()
+            return future
+        return self._worker.submit(name, args, kwargs)
+
+    def last_error(self):
+        if not self._worker.started:
+            return self._module.last_error()
+        return getattr(self._local, 'last_error', None) or (self._module.RES_S_OK, 'Success')
+
+    def initialize(self, *args, **kwargs):
+        self._worker.init_args = (args, kwargs) # Replayed by the supervisor after a reconnect
+        result = self._call('initialize', args, kwargs, const.TERMINAL_INIT_TIMEOUT_SECONDS)
+        if result:
+            self._worker.connected.set()
+        return result
+
+    def shutdown(self):
+        self._worker.init_args = None # Disconnected on purpose: no reconnects
+        self._worker.connected.clear()
+        return self._call('shutdown', (), {})
+
+    def wait_connected(self, timeout):
+        """Makes the supervisor reconnect now and waits up to `timeout` seconds for the terminal."""
+        self._worker.request_reconnect()
+        return self._worker.connected.wait(timeout)
@@ -0,0 +1,170 @@
+"""Continuous tick capture of the traded symbols, for post-mortems and session replays.
+
+A background thread pulls each symbol's ticks in batches with copy_ticks_from from a moving
+cursor (the newest captured tick) and appends them to a memory-mapped ring file per symbol
+(TICK_CAPTURE_FILE), one fixed-width record per tick. Other processes read the file without
+locking (utils.mmap_ring.read_ordered), so the exact price path around a trigger or a stop-out
+can be inspected while the bot keeps running. A restarted recorder resumes from the newest
+tick in its file, as long as it is not older than TICK_CAPTURE_BACKFILL_SECONDS.
+
+Analysis / replay:
+    python -m mt5_functions.tick_recorder ticks_EURUSD.ring --npz session.npz
+    MT5_BACKEND=sim MT5_SIM_TICKS=ticks_EURUSD.ring python mt5_script.py
+"""
+import argparse
+import os
+import threading
+from utils.logger import logger
+import utils.constants as const
+import utils.metrics as metrics
+from utils.mmap_ring import MmapRing, read_ordered, record_dtype
+
+FIELDS = [
+    ('seq', 'Q'),
+    ('time_msc', 'q'), # Tick time (trade server clock)
+    ('bid', 'd'),
+    ('ask', 'd'),
+    ('flags', 'I'), # TICK_FLAG_* bits of the tick
+]
+
+def _terminal():
+    # Imported on use: readers of capture files (backtests, the simulator's replay) need no terminal
+    from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
+    return mt5
+
+def capture_path(symbol):
+    return const.TICK_CAPTURE_FILE.format(symbol=symbol)
+
+class _Cursor:
+    """Newest captured tick of a symbol: its time and how many captured ticks share that millisecond."""
+
+    def __init__(self, time_msc, count_at_time=0):
+        self.time_msc = time_msc
+        self.count_at_time = count_at_time
+
+    def advance(self, ticks):
+        """Drops the ticks of `ticks` (a copy_ticks_from batch starting at the cursor's second) that
+        were already captured, and moves the cursor past the rest. Returns the new ticks."""
+        times = ticks['time_msc']
+        first_new = int(times.searchsorted(self.time_msc, side='left')) + self.count_at_time
+        ticks = ticks[min(first_new, len(ticks)):]
+        if len(ticks):
+            last = int(ticks['time_msc'][-1])
+            at_last = len(ticks) - int(ticks['time_msc'].searchsorted(last, side='left'))
+            self.count_at_time = at_last + (self.count_at_time if last == self.time_msc else 0)
+            self.time_msc = last
+        return ticks
+
+class TickRecorder(threading.Thread):
+    """Captures the ticks of `symbols` into their ring files every `interval` seconds."""
+
+    def __init__(self, symbols, interval=None, capacity=None, batch=None):
+        super().__init__(name="tick-recorder", daemon=True)
+        self.symbols = list(dict.fromkeys(symbols))
+        self.interval = interval if interval is not None else const.TICK_CAPTURE_INTERVAL_SECONDS
+        self.capacity = capacity or const.TICK_CAPTURE_CAPACITY
+        self.batch = batch or const.TICK_CAPTURE_BATCH
+        self.dtype = None # Record dtype, built on the recorder thread (NumPy import)
+        self.rings = {}
+        self.cursors = {}
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        logger.info("Tick recorder started for %s (every %.1fs, %s ticks per file).", ", ".join(self.symbols), self.interval, self.capacity)
+        self.dtype = record_dtype(FIELDS)
+        try:
+            while True:
+                for symbol in self.symbols:
+                    try:
+                        self.capture(symbol)
+                    except Exception as e:
+                        logger.error("Error capturing %s ticks: %s", symbol, e, exc_info=True)
+                if self._stop_event.wait(self.interval):
+                    break
+        finally:
+            for ring in self.rings.values():
+                ring.close()
+        logger.info("Tick recorder stopped.")
+
+    def _open(self, symbol):
+        """Opens the symbol's ring and places its cursor (None until the terminal has a tick)."""
+        mt5 = _terminal()
+        tick = mt5.symbol_info_tick(symbol)
+        if tick is None:
+            return None
+        if symbol not in self.rings:
+            path = capture_path(symbol)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.rings[symbol] = MmapRing(path, FIELDS, self.capacity)
+        ring = self.rings[symbol]
+        # Tick times are in trade server time, so the backfill window is measured from the current tick
+        oldest = tick.time_msc - const.TICK_CAPTURE_BACKFILL_SECONDS * 1000
+        cursor = _Cursor(oldest)
+        if ring.count:
+            tail, _ = read_ordered(ring.path, FIELDS, since=ring.count - self.batch)
+            last = int(tail['time_msc'][-1])
+            if last >= oldest:
+                cursor = _Cursor(last, len(tail) - int(tail['time_msc'].searchsorted(last, side='left')))
+                logger.info("Resuming %s tick capture after %s (%s ticks already in %s).", symbol, last, ring.count, ring.path)
+        self.cursors[symbol] = cursor
+        return cursor
+
+    def capture(self, symbol):
+        """Appends the symbol's ticks since the cursor. Returns the number of new ticks."""
+        import numpy as np # Loaded on the recorder thread, not during bot startup
+        mt5 = _terminal()
+        cursor = self.cursors.get(symbol) or self._open(symbol)
+        if cursor is None:
+            return 0
+        count, captured = self.batch, 0
+        while True:
+            with metrics.timer('mt5_call_duration_seconds', call='copy_ticks_from'):
+                ticks = mt5.copy_ticks_from(symbol, cursor.time_msc // 1000, count, mt5.COPY_TICKS_ALL)
+            if ticks is None:
+                logger.warning("copy_ticks_from(%s) failed: %s", symbol, mt5.last_error())
+                break
+            full = len(ticks) == count
+            ticks = cursor.advance(ticks)
+            if len(ticks):
+                records = np.zeros(len(ticks), dtype=self.dtype)
+                for name in ('time_msc', 'bid', 'ask', 'flags'):
+                    records[name] = ticks[name]
+                self.rings[symbol].extend(records)
+                captured += len(ticks)
+                count = self.batch
+            elif full:
+                count *= 2 # A whole batch inside the cursor's second was already captured: ask for more
+                continue
+            if not full:
+                break # Caught up
+        if captured:
+            metrics.inc('tick_capture_ticks_total', captured, symbol=symbol)
+        return captured
+
+# --- Analysis ---
+
+def load_ticks(path, since=0):
+    """(time_msc, bid, ask) arrays of a capture file in time order (a consistent copy, also while the
+    recorder is writing)."""
+    records, _ = read_ordered(path, FIELDS, since)
+    return records['time_msc'], records['bid'], records['ask']
+
+if __name__ == '__main__':
+    import numpy as np
+    parser = argparse.ArgumentParser(description="Summary of a tick capture file, optionally exported for the backtest tools.")
+    parser.add_argument('path')
+    parser.add_argument('--npz', help="Write the ticks to this .npz (time_msc/bid/ask)")
+    args = parser.parse_args()
+    time_msc, bid, ask = load_ticks(args.path)
+    if not len(time_msc):
+        raise SystemExit(f"No ticks in {args.path}")
+    gaps = np.diff(time_msc)
+    print(f"{len(time_msc)} ticks in {args.path}: {time_msc[0]} .. {time_msc[-1]} "
+          f"({(time_msc[-1] - time_msc[0]) / 1000:.0f}s), largest gap {gaps.max() / 1000 if len(gaps) else 0:.1f}s, "
+          f"bid {bid.min()} .. {bid.max()}")
+    if args.npz:
+        np.savez(args.npz, time_msc=time_msc, bid=bid, ask=ask)
+        print(f"Wrote {args.npz}")
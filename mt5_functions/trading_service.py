@@ -1,62 +1,146 @@
 from utils.logger import logger
+from collections import namedtuple
 import mt5_functions.mt5_api as mt5_api
+import mt5_functions.liquidation as liquidation
+from utils.state_manager import NamespacedState
 import utils.constants as const
-import math
-import MetaTrader5 as mt5
+import utils.grid_math as grid_math
+import mt5_functions.grid_planner as grid_planner
+import mt5_functions.grid_recovery as grid_recovery
+import mt5_functions.exposure_model as exposure_model
+import utils.metrics as metrics
+from mt5_functions.backend import mt5 # MetaTrader5 or the offline simulator
 
 # Core trading logic functions will go here
 # e.g., calculate_lot, check_drawdown, manage_orders, etc.
 
+# --- Grid Book ---
+
+BookDelta = namedtuple('BookDelta', [
+    'added_orders', 'removed_orders', 'modified_orders', 'added_positions', 'removed_positions', 'modified_positions'])
+
+def _order_fingerprint(order):
+    return hash((order.type, order.volume_current, order.price_open, order.sl, order.tp))
+
+def _position_fingerprint(position):
+    return hash((position.type, position.volume, position.sl, position.tp))
+
+class GridBook:
+    """The bot's orders and positions indexed by ticket, with the changes since the previous cycle.
+
+    update() costs one pass over what the terminal returned; every lookup after that
+    (is this ticket still pending, which position did it open) is a dict access.
+    """
+
+    def __init__(self):
+        self.orders = {} # ticket -> TradeOrder
+        self.positions = {} # ticket -> TradePosition
+        self.positions_by_order = {} # opening order ticket (position identifier) -> TradePosition
+        self._fingerprints = {} # ('o'|'p', ticket) -> hash of the fields that can change
+
+    def update(self, orders, positions):
+        """Re-indexes the book. Returns a BookDelta of tickets, or None if nothing changed."""
+        previous_orders, previous_positions, previous_fingerprints = self.orders, self.positions, self._fingerprints
+        self.orders = {o.ticket: o for o in orders}
+        self.positions = {p.ticket: p for p in positions}
+        self.positions_by_order = {p.identifier: p for p in positions}
+        self._fingerprints = {('o', t): _order_fingerprint(o) for t, o in self.orders.items()}
+        self._fingerprints.update({('p', t): _position_fingerprint(p) for t, p in self.positions.items()})
+
+        delta = BookDelta(
+            added_orders=self.orders.keys() - previous_orders.keys(),
+            removed_orders=previous_orders.keys() - self.orders.keys(),
+            modified_orders={t for t in self.orders.keys() & previous_orders.keys()
+                             if self._fingerprints[('o', t)] != previous_fingerprints[('o', t)]},
+            added_positions=self.positions.keys() - previous_positions.keys(),
+            removed_positions=previous_positions.keys() - self.positions.keys(),
+            modified_positions={t for t in self.positions.keys() & previous_positions.keys()
+                                if self._fingerprints[('p', t)] != previous_fingerprints[('p', t)]})
+        return delta if any(delta) else None
+
+    def position_for_order(self, order_ticket):
+        # In MT5 a position's identifier is the ticket of the order that opened it
+        return self.positions_by_order.get(order_ticket)
+
+    def find_order(self, order_type, price, tolerance):
+        for o in self.orders.values():
+            if o.type == order_type and abs(o.price_open - price) <= tolerance:
+                return o.ticket
+        return None
+
+# --- Grid Instance ---
+
+class GridInstance:
+    """One grid: a symbol/magic pair with its own namespaced state, grid book and order tags."""
+
+    def __init__(self, symbol, magic, root_state, reconciler):
+        self.symbol = symbol
+        self.magic = magic
+        self.key = f"{symbol}|{magic}"
+        self.state = NamespacedState(root_state, self.key + "|") # e.g. root key 'EURUSD|12345|initialized'
+        self.book = GridBook()
+        self.reconciler = reconciler # Shared deal reconciler (one history query for all grids)
+        if const.GRID_DEPTH < 1:
+            raise ValueError(f"GRID_DEPTH must be at least 1 (the level order), got {const.GRID_DEPTH}")
+        self.depth = const.GRID_DEPTH # Legs per side: trigger detection, planning and tracking all use this bound
+        # Scheduler tags for in-flight order intents, so a retrying placement is not duplicated next cycle
+        self.init_tag = f"grid_init:{self.key}"
+        self.place_buy_tag = f"grid_place_buy:{self.key}"
+        self.place_sell_tag = f"grid_place_sell:{self.key}"
+        self.volatility = grid_planner.PriceRange(const.VOLATILITY_WINDOW_SECONDS)
+        self.gated = {} # Legs resized/dropped by the exposure gate last cycle: (side, leg, price, lot) -> new volume
+
+    def place_tag(self, side, leg):
+        tag = self.place_buy_tag if side == 'buy' else self.place_sell_tag
+        return tag if leg == 0 else f"{tag}:{leg}"
+
+    def __repr__(self):
+        return f"GridInstance({self.symbol}, magic={self.magic})"
+
 # --- Helper Functions ---
 
+def is_order_placed(result):
+    return bool(result) and result.order > 0 and result.retcode in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_PLACED)
+
+def log_cancel_result(label, ticket):
+    # Done-callback for cancel_order futures; cancellation outcome is informational only
+    def log(future):
+        if future.result():
+            logger.info("Cancelled %s order %s", label, ticket)
+        else:
+            logger.warning("Failed to cancel %s %s, continuing but state might be inconsistent.", label, ticket)
+    return log
+
 def calculate_adjusted_distance(symbol_info, distance_pips):
-    point = symbol_info.point
     stops_level = symbol_info.trade_stops_level
     # Convert pips to points (assuming 1 pip = 10 points for 5-digit, 1 point for 3-digit)
     # More robust check might be needed for exotic symbols
-    pip_multiplier = 10 if symbol_info.digits == 5 or symbol_info.digits == 3 else 1
-    distance_points = distance_pips * pip_multiplier
-
-    adjusted_distance = max(distance_points, stops_level)
+    adjusted_distance, distance_points = grid_math.distance_points(distance_pips, symbol_info.digits, stops_level)
     if adjusted_distance > distance_points:
-        logger.warning(f"Order distance ({distance_pips} pips / {distance_points} points) increased to broker's stops_level ({stops_level} points)")
+        logger.warning("Order distance (%s pips / %s points) increased to broker's stops_level (%s points)", distance_pips, distance_points, stops_level)
     return adjusted_distance
 
-def calculate_initial_lot(symbol_info, account_info):
+def calculate_initial_lot(spec, account_info):
+    symbol_info = spec.info
     if const.INITIAL_LOT > 0:
         lot = const.INITIAL_LOT
         # logger.info(f"Using fixed initial lot: {lot}") # Keep log concise
     else:
         balance = account_info.balance
-        percentage = const.BALANCE_PERCENT_FOR_LOT / 100.0
-        target_amount = balance * percentage
-        
-        # Basic calculation: Lot = Target Amount / Margin for 1 Lot
-        tick = mt5_api.get_symbol_tick(symbol_info.name)
-        if not tick:
-             logger.error("Cannot calculate lot based on balance: failed to get tick.")
-             return 0.01 # Fallback to a small default lot
-        
-        margin_required_one_lot = mt5.order_calc_margin(mt5.ORDER_TYPE_BUY, symbol_info.name, 1.0, tick.ask)
-        if not margin_required_one_lot or margin_required_one_lot <= 0:
-            logger.warning(f"Could not calculate margin for {symbol_info.name}. Using fallback balance percentage calc.")
-            # Simplified fallback - might be inaccurate
-            lot = round((balance * percentage) / 1000, 2) 
-        else:
-            lot = round(target_amount / margin_required_one_lot, 2)
+
+        # Basic calculation: Lot = Target Amount / Margin for 1 Lot (cached with the symbol spec)
+        margin_required_one_lot = spec.margin_per_lot
+        if not margin_required_one_lot:
+            # Simplified fallback (balance / 1000) - might be inaccurate
+            logger.warning("Could not calculate margin for %s. Using fallback balance percentage calc.", symbol_info.name)
+        lot = grid_math.balance_percent_lot(balance, const.BALANCE_PERCENT_FOR_LOT, margin_required_one_lot)
 
         # logger.info(f"Calculated initial lot based on {const.BALANCE_PERCENT_FOR_LOT}% of balance ({balance}): {lot}") # Keep log concise
 
-    # Ensure lot meets symbol's volume constraints
-    lot = max(lot, symbol_info.volume_min)
-    lot = min(lot, symbol_info.volume_max)
-    if symbol_info.volume_step > 0:
-        lot = math.floor(lot / symbol_info.volume_step) * symbol_info.volume_step
-    
-    lot = round(lot, 2) # Final rounding
+    lot = spec.normalize_lot(lot)
 
     if lot <= 0:
-        logger.error(f"Calculated lot is zero or negative ({lot}). Falling back to minimum volume: {symbol_info.volume_min}")
+        logger.error("Calculated lot is zero or negative (%s). Falling back to minimum volume: %s", lot, symbol_info.volume_min)
         lot = symbol_info.volume_min
 
     # logger.info(f"Final adjusted initial lot: {lot}") # Log moved to initialize_strategy
@@ -64,36 +148,47 @@ def calculate_initial_lot(symbol_info, account_info):
 
 # --- Core Logic Functions ---
 
-def initialize_strategy(state):
-    logger.info("Initializing strategy...")
-    symbol = const.SYMBOL
-    magic = const.MAGIC_NUMBER
+def initialize_strategy(grid, snapshot):
+    logger.info("Initializing strategy for %s...", grid)
+    state = grid.state
+    symbol = snapshot.symbol
+    magic = snapshot.magic
 
     # Check if already initialized (orders or positions exist)
-    existing_orders = mt5_api.get_orders(symbol=symbol, magic=magic)
-    existing_positions = mt5_api.get_positions(symbol=symbol, magic=magic)
+    existing_orders = snapshot.orders
+    existing_positions = snapshot.positions
+
+    if mt5_api.order_scheduler.has_pending(grid.init_tag):
+        logger.info("Initial orders from a previous cycle are still being retried. Initialization skipped.")
+        return False
+
+    if existing_orders is None or existing_positions is None:
+        logger.error("Cannot initialize strategy: failed to read the existing orders or positions.")
+        return False
 
     if existing_orders or existing_positions:
-        logger.info(f"Strategy already has active orders ({len(existing_orders)}) or positions ({len(existing_positions)}). Initialization skipped.")
-        # TODO: Load state relevant to existing grid (next lots, levels etc.)
-        return False # Indicate no changes made
+        logger.info("Strategy already has active orders (%s) or positions (%s). Rebuilding the grid state from the terminal.", len(existing_orders), len(existing_positions))
+        return recover_strategy(grid, snapshot)
 
     logger.info("No existing orders or positions found for this magic number. Placing initial grid.")
 
-    # Get necessary info
-    symbol_info = mt5_api.get_symbol_info(symbol)
-    account_info = mt5_api.get_account_info()
-    tick = mt5_api.get_symbol_tick(symbol)
+    # Get necessary info (served from the cycle snapshot)
+    spec = snapshot.spec
+    account_info = snapshot.account
+    tick = snapshot.tick
 
-    if not symbol_info or not account_info or not tick:
+    if not spec or not account_info or not tick:
         logger.error("Failed to get required info (symbol, account, tick) for initialization.")
         return False
+    symbol_info = spec.info
 
     # Calculate parameters
-    initial_lot = calculate_initial_lot(symbol_info, account_info)
+    initial_lot = calculate_initial_lot(spec, account_info)
     if initial_lot <= 0:
         logger.error("Initial lot calculation resulted in zero or negative value. Cannot place orders.")
         return False
+    ladder = spec.ladder(initial_lot)
+    logger.info("Lot ladder: %s legs from %s to %s lots (margin of the last leg: %s)", len(ladder.lots), ladder.lots[0], ladder.lots[-1], ladder.margins[-1])
         
     distance_points = calculate_adjusted_distance(symbol_info, const.ORDER_DISTANCE_PIPS)
     point = symbol_info.point
@@ -108,7 +203,7 @@ def initialize_strategy(state):
     # sell_stop_price = mt5.normalize_double(sell_stop_price, digits)
     # The round() function above already handles the normalization to the correct number of digits.
 
-    logger.info(f"Calculated initial parameters: Lot={initial_lot}, Distance={distance_points} points, BuyStopPrice={buy_stop_price}, SellStopPrice={sell_stop_price}")
+    logger.info("Calculated initial parameters: Lot=%s, Distance=%s points, BuyStopPrice=%s, SellStopPrice=%s", initial_lot, distance_points, buy_stop_price, sell_stop_price)
 
     # Prepare requests
     buy_request = {
@@ -135,62 +230,83 @@ def initialize_strategy(state):
         "type_filling": symbol_info.filling_mode
     }
 
-    # Send orders
-    buy_result = mt5_api.send_order(buy_request)
-    sell_result = mt5_api.send_order(sell_request)
-    
-    orders_placed_count = 0
-    buy_success = False
-    sell_success = False
-
-    # Check BuyStop result
-    if buy_result and buy_result.order > 0 and buy_result.retcode in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_PLACED):
-        logger.info(f"Initial BuyStop order accepted/placed successfully. Ticket: {buy_result.order}")
-        orders_placed_count += 1
-        buy_success = True
-    else:
-        logger.error(f"Failed to place initial BuyStop order. Result: {buy_result}")
-
-    # Check SellStop result
-    if sell_result and sell_result.order > 0 and sell_result.retcode in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_PLACED):
-        logger.info(f"Initial SellStop order accepted/placed successfully. Ticket: {sell_result.order}")
-        orders_placed_count += 1
-        sell_success = True
-    else:
-        logger.error(f"Failed to place initial SellStop order. Result: {sell_result}")
-
-    if orders_placed_count > 0:
-        # Only update state if at least one order was placed successfully
-        state['initialized'] = True
-        if buy_success:
-             state['initial_buy_stop_level'] = buy_stop_price
-             state['last_placed_buy_lot'] = initial_lot
-             state['next_buy_lot'] = round(initial_lot * const.LOT_MULTIPLIER, 2)
-        if sell_success:
-            state['initial_sell_stop_level'] = sell_stop_price
-            state['last_placed_sell_lot'] = initial_lot
-            state['next_sell_lot'] = round(initial_lot * const.LOT_MULTIPLIER, 2)
-        
-        # Store initial deposit only once
-        if 'initial_deposit' not in state:
-             state['initial_deposit'] = account_info.equity # Use equity at init time
-             logger.info(f"Recorded initial deposit for drawdown calculation: {state['initial_deposit']}")
-             
-        logger.info(f"Strategy initialized partially or fully ({orders_placed_count} orders). State updated.")
-        # Consider returning True even if only one order succeeded, 
+    # Fills of the orders below are picked up from the deal history from this point on
+    grid.reconciler.start(tick.time_msc)
+
+    # Send orders. Each result is applied to state in its future's callback: right away if the first
+    # attempt settles, otherwise later from order_scheduler.poll() in the main loop.
+    def on_initial_order_done(side, label, price):
+        def apply(future):
+            result = future.result()
+            if not is_order_placed(result):
+                logger.error("Failed to place initial %s order. Result: %s", label, result)
+                return
+            logger.info("Initial %s order accepted/placed successfully. Ticket: %s", label, result.order)
+            # Only update state if at least one order was placed successfully
+            state['initialized'] = True
+            state[f'initial_{side}_stop_level'] = price
+            state[f'{side}_armed_lot'] = initial_lot
+            state[f'{side}_stop_ticket'] = result.order
+            state['initial_lot'] = initial_lot # Start of the lot ladder
+            state[f'last_placed_{side}_lot'] = initial_lot
+            state[f'next_{side}_lot'] = spec.next_lot(initial_lot, initial_lot)
+            # Store initial deposit only once
+            if 'initial_deposit' not in state:
+                state['initial_deposit'] = account_info.equity # Use equity at init time
+                logger.info("Recorded initial deposit for drawdown calculation: %s", state['initial_deposit'])
+        return apply
+
+    mt5_api.send_order(buy_request, snapshot=snapshot, tag=grid.init_tag).add_done_callback(
+        on_initial_order_done('buy', 'BuyStop', buy_stop_price))
+    mt5_api.send_order(sell_request, snapshot=snapshot, tag=grid.init_tag).add_done_callback(
+        on_initial_order_done('sell', 'SellStop', sell_stop_price))
+
+    if state.get('initialized', False):
+        logger.info("Strategy initialized partially or fully. State updated.")
+        # Consider returning True even if only one order succeeded,
         # the logic in check_and_manage_grid should handle inconsistencies.
         return True # Indicate state potentially changed
-    else:
-        logger.error("Failed to place any initial orders.")
+    if mt5_api.order_scheduler.has_pending(grid.init_tag):
+        logger.info("Initial orders are being retried; state will be updated when they settle.")
         return False
+    logger.error("Failed to place any initial orders.")
+    return False
+
+def recover_strategy(grid, snapshot):
+    """Warm start: rebuilds the state of a grid whose orders/positions outlived its state file."""
+    spec = snapshot.spec
+    account_info = snapshot.account
+    if not spec or not account_info:
+        logger.error("Failed to get required info (symbol, account) for rebuilding the grid state.")
+        return False
+    deals = snapshot.deals
+    distance = calculate_adjusted_distance(spec.info, const.ORDER_DISTANCE_PIPS) * spec.info.point
+    recovered = grid_recovery.rebuild_state(snapshot.orders, snapshot.positions, deals, spec, distance)
+    if not recovered:
+        return False
+    state = grid.state
+    for key in [k for k in state if '_stop_ticket' in k]:
+        state.pop(key, None) # Tickets of a lost state are not trusted; the planner adopts the live orders
+    state.update(recovered)
+    if 'initial_deposit' not in state:
+        # The deposit at the original start is unknown: balance excludes the floating loss of the open grid
+        state['initial_deposit'] = account_info.balance
+        logger.warning("Initial deposit unknown after rebuilding the state; using the current balance %s for drawdown checks.", account_info.balance)
+    cursor = grid_recovery.last_deal(deals)
+    if cursor:
+        grid.reconciler.start(*cursor) # Fills of the rebuilt run are not reported again
+    else:
+        grid.reconciler.start(snapshot.tick.time_msc if snapshot.tick else 0)
+    return True
 
-def check_drawdown_and_close_all(state):
+def check_drawdown_and_close_all(grid, snapshot):
+    state = grid.state
     initial_deposit = state.get('initial_deposit')
     if not initial_deposit:
         # Cannot check drawdown if initial deposit wasn't recorded
         return False
 
-    account_info = mt5_api.get_account_info()
+    account_info = snapshot.account
     if not account_info:
         logger.warning("Cannot check drawdown: failed to get account info.")
         return False
@@ -202,265 +318,236 @@ def check_drawdown_and_close_all(state):
     drawdown = initial_deposit - current_equity
     drawdown_percent = (drawdown / initial_deposit) * 100 if initial_deposit > 0 else 0
 
-    logger.debug(f"Drawdown Check: Initial={initial_deposit}, Current Equity={current_equity}, DD={drawdown:.2f} ({drawdown_percent:.2f}%), Max Allowed={max_dd_percent}%")
+    logger.debug("Drawdown Check: Initial=%s, Current Equity=%s, DD=%.2f (%.2f%%), Max Allowed=%s%%", initial_deposit, current_equity, drawdown, drawdown_percent, max_dd_percent)
 
     if drawdown_percent >= max_dd_percent:
-        logger.warning(f"MAX DRAWDOWN LIMIT REACHED: {drawdown_percent:.2f}% >= {max_dd_percent}%! Closing all positions and orders for magic {const.MAGIC_NUMBER}!")
-        symbol = const.SYMBOL
-        magic = const.MAGIC_NUMBER
-        closed_count = 0
-        cancelled_count = 0
-
-        # 1. Close all open positions
-        positions = mt5_api.get_positions(symbol=symbol, magic=magic)
-        logger.info(f"Closing {len(positions)} positions...")
-        for pos in positions:
-            pos_type = pos.type
-            pos_volume = pos.volume
-            pos_symbol = pos.symbol
-            pos_ticket = pos.ticket
-
-            # Determine opposite action type
-            close_action_type = mt5.ORDER_TYPE_SELL if pos_type == mt5.POSITION_TYPE_BUY else mt5.ORDER_TYPE_BUY
-            
-            # Get current price for closing
-            tick = mt5_api.get_symbol_tick(pos_symbol)
-            if not tick:
-                logger.error(f"Could not get tick for {pos_symbol} to close position {pos_ticket}. Skipping.")
-                continue
-                
-            price = tick.bid if close_action_type == mt5.ORDER_TYPE_SELL else tick.ask
-            
-            close_request = {
-                "action": mt5.TRADE_ACTION_DEAL,
-                "position": pos_ticket,
-                "symbol": pos_symbol,
-                "volume": pos_volume,
-                "type": close_action_type,
-                "price": price,
-                "deviation": const.DEFAULT_DEVIATION, # Allow some slippage for market close
-                "magic": magic,
-                "comment": "Drawdown Stop Out",
-                "type_time": mt5.ORDER_TIME_GTC,
-                "type_filling": mt5.ORDER_FILLING_IOC, # IOC or FOK commonly used for closing
-            }
-            
-            logger.info(f"Sending close request for position {pos_ticket} ({pos_symbol} {pos_type} {pos_volume})")
-            result = mt5_api.send_order(close_request)
-            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                 logger.info(f"Successfully closed position {pos_ticket}. Result: {result}")
-                 closed_count += 1
-            else:
-                 logger.error(f"Failed to close position {pos_ticket}. Result: {result}")
-                 # Continue trying to close others
-
-        # 2. Cancel all pending orders
-        orders = mt5_api.get_orders(symbol=symbol, magic=magic)
-        logger.info(f"Cancelling {len(orders)} pending orders...")
-        for order in orders:
-            if mt5_api.cancel_order(order.ticket):
-                cancelled_count += 1
-            # cancel_order already logs errors
-
-        logger.warning(f"Drawdown Stop Out complete. Closed {closed_count}/{len(positions)} positions. Cancelled {cancelled_count}/{len(orders)} orders.")
-
-        # 3. Reset state (keep initial_deposit for potential future reference?)
-        state['initialized'] = False
-        state.pop('initial_buy_stop_level', None)
-        state.pop('initial_sell_stop_level', None)
-        state.pop('next_buy_lot', None)
-        state.pop('next_sell_lot', None)
-        state.pop('last_placed_buy_lot', None)
-        state.pop('last_placed_sell_lot', None)
-        # state.pop('initial_deposit', None) # Optional: Decide whether to keep or remove
-        logger.info("Strategy state has been reset due to drawdown stop out.")
-        
+        magic = snapshot.magic
+        logger.warning("MAX DRAWDOWN LIMIT REACHED: %.2f%% >= %s%%! Closing all positions and orders for magic %s!", drawdown_percent, max_dd_percent, magic)
+
+        # 1./2. Cancel all pending orders and close all open positions, concurrently from one snapshot
+        report = liquidation.liquidate(snapshot)
+        snapshot.invalidate() # Terminal state changed underneath the cycle snapshot
+        logger.warning("Drawdown Stop Out complete. Closed %s positions, cancelled %s orders in %.1f ms (%s positions / %s orders remain).", report.closed, report.cancelled, report.time_to_flat * 1000, report.remaining_positions, report.remaining_orders)
+
+        # 3. Reset state
+        reset_grid_state(state)
         return True # Indicate that stop out occurred
     else:
         # Drawdown is within limits
         return False
 
-def check_and_manage_grid(state):
-    logger.debug("Checking and managing grid...")
-    symbol = const.SYMBOL
-    magic = const.MAGIC_NUMBER
-    state_changed = False
+def reset_grid_state(state):
+    # Reset state after a stop out (keep initial_deposit for potential future reference?)
+    state['initialized'] = False
+    state.pop('initial_buy_stop_level', None)
+    state.pop('initial_sell_stop_level', None)
+    state.pop('next_buy_lot', None)
+    state.pop('next_sell_lot', None)
+    state.pop('buy_armed_lot', None)
+    state.pop('sell_armed_lot', None)
+    state.pop('initial_lot', None)
+    state.pop('last_placed_buy_lot', None)
+    state.pop('last_placed_sell_lot', None)
+    for key in [k for k in state if '_stop_ticket' in k or k.endswith('_filled_legs')]:
+        state.pop(key, None) # Level and continuation leg tickets, filled leg counts
+    # state.pop('initial_deposit', None) # Optional: Decide whether to keep or remove
+    logger.info("Strategy state has been reset due to drawdown stop out.")
+
+def triggered_volume(book, label, ticket, fills):
+    """Filled volume of a stop order that left the book, or None if it never filled."""
+    position = book.position_for_order(ticket)
+    fill = fills.get(ticket)
+    if fill and fill.entry == mt5.DEAL_ENTRY_IN:
+        # Prefer the open position's volume: it covers partial fills reported in earlier cycles
+        volume = position.volume if position else fill.volume
+        logger.info("%s %s triggered: filled %s lots at %s (%s deal(s))%s.", label, ticket, fill.volume, fill.price, fill.deals, '' if position else ', position already closed')
+        return volume
+    if position:
+        logger.info("%s %s triggered: position %s, %s lots at %s.", label, ticket, position.ticket, position.volume, position.price_open)
+        return position.volume
+    return None
+
+def _apply_fill(state, spec, side, leg, fill_volume):
+    """Applies a fill of one leg of `side`. The level leg (0) starts a run of that side and re-arms
+    the opposite side with its next lot; continuation legs only advance the run."""
+    other = 'sell' if side == 'buy' else 'buy'
+    state.pop(grid_planner.ticket_key(side, leg), None)
+    state[f'{side}_filled_legs'] = max(state.get(f'{side}_filled_legs', 0), leg + 1)
+    if leg == 0:
+        if state.get(f'next_{other}_lot'):
+            state[f'{other}_armed_lot'] = spec.normalize_lot(state[f'next_{other}_lot'])
+            state[f'{other}_filled_legs'] = 0 # Unfilled legs of the other side's last run are re-planned with the new lots
+        else:
+            logger.error("Cannot arm the %s side: next_%s_lot is missing from the state.", other, other)
+    state[f'next_{side}_lot'] = spec.next_lot(fill_volume, state.get('initial_lot')) # Next lot after the one that TRIGGERED (ladder lookup)
+    if leg == 0:
+        logger.info("State updated: %s side armed with %s lots, next_%s_lot=%s.", other, state.get(f'{other}_armed_lot'), side, state[f'next_{side}_lot'])
+    else:
+        logger.info("State updated: %s continuation leg %s filled, next_%s_lot=%s.", side, leg, side, state[f'next_{side}_lot'])
+
+def _adopt_armed_lots(grid, state, symbol_info):
+    # State saved before the planner: derive the armed lots from the tracked (or resting) orders
+    for side, order_type in grid_planner.SIDES:
+        if f'{side}_armed_lot' in state or not state.get(f'initial_{side}_stop_level'):
+            continue
+        ticket = state.get(f'{side}_stop_ticket') or grid.book.find_order(order_type, state[f'initial_{side}_stop_level'], symbol_info.point / 2)
+        order = grid.book.orders.get(ticket)
+        if order is not None:
+            state[f'{side}_armed_lot'] = order.volume_current
+            state[f'{side}_stop_ticket'] = ticket
+            logger.info("Tracking existing %s stop order %s (%s lots) at level %s.", side, ticket, order.volume_current, order.price_open)
+
+def apply_plan(grid, snapshot, actions):
+    """Sends the planner's actions in one pass. State is updated from each request's future, so a
+    failed request leaves the grid state as it was and the next plan retries it."""
+    state = grid.state
+    symbol_info = snapshot.symbol_info
+    for action in actions:
+        kind, side, order, desired = action
+        label = 'BuyStop' if (desired.type if desired else order.type) == mt5.ORDER_TYPE_BUY_STOP else 'SellStop'
+
+        if kind == grid_planner.KEEP:
+            key = grid_planner.ticket_key(side, desired.leg)
+            if state.get(key) != order.ticket:
+                logger.info("Tracking existing %s order %s (leg %s) at %s.", label, order.ticket, desired.leg, order.price_open)
+                state[key] = order.ticket
+            continue
+
+        if kind == grid_planner.CANCEL:
+            if mt5_api.order_scheduler.has_pending(f"cancel:{order.ticket}"):
+                continue
+            logger.info("Cancelling %s order %s (%s lots at %s): not part of the planned grid.", label, order.ticket, order.volume_current, order.price_open)
+            mt5_api.cancel_order(order.ticket, snapshot=snapshot).add_done_callback(log_cancel_result(label, order.ticket))
+            for key in [k for k, v in state.items() if '_stop_ticket' in k and v == order.ticket]:
+                state.pop(key, None)
+            continue
+
+        tag = grid.place_tag(side, desired.leg)
+        if mt5_api.order_scheduler.has_pending(tag):
+            continue # A request for this leg is still being retried
+
+        if kind == grid_planner.MODIFY:
+            logger.info("Moving %s order %s (leg %s) from %s to %s.", label, order.ticket, desired.leg, order.price_open, desired.price)
+            request = {
+                "action": mt5.TRADE_ACTION_MODIFY,
+                "order": order.ticket,
+                "price": desired.price,
+                "type_time": mt5.ORDER_TIME_GTC,
+            }
+        else:
+            logger.info("Placing new %s (leg %s) at %s with lot %s", label, desired.leg, desired.price, desired.volume)
+            request = {
+                "action": mt5.TRADE_ACTION_PENDING,
+                "symbol": snapshot.symbol,
+                "volume": desired.volume,
+                "type": desired.type,
+                "price": desired.price,
+                "magic": snapshot.magic,
+                "comment": ("Grid Buy" if side == 'buy' else "Grid Sell") + (f" L{desired.leg}" if desired.leg else ""),
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": symbol_info.filling_mode
+            }
+
+        def on_done(future, side=side, label=label, desired=desired, kind=kind):
+            result = future.result()
+            if not is_order_placed(result):
+                logger.error("Failed to %s %s order (leg %s). Result: %s. The next cycle will retry.", kind, label, desired.leg, result)
+                return
+            logger.info("%s order %s (leg %s): %s done.", label, result.order, desired.leg, kind)
+            state[grid_planner.ticket_key(side, desired.leg)] = result.order
+            if desired.leg == 0:
+                state[f'last_placed_{side}_lot'] = desired.volume
+
+        mt5_api.send_order(request, snapshot=snapshot, tag=tag).add_done_callback(on_done)
+
+def check_and_manage_grid(grid, snapshot, fills=None):
+    """`fills`: this grid's new fill events from the deal reconciler ({order ticket: FillEvent}), or None.
+
+    Returns True if the grid state changed (requests still being retried update it later)."""
+    logger.debug("Checking and managing grid %s...", grid)
+    state = grid.state
 
     if not state.get('initialized', False):
         logger.debug("Strategy not initialized, skipping grid management.")
         return False
 
-    # Get current market state
-    orders = mt5_api.get_orders(symbol=symbol, magic=magic)
-    positions = mt5_api.get_positions(symbol=symbol, magic=magic)
-    symbol_info = mt5_api.get_symbol_info(symbol)
-    if not symbol_info:
+    # Get current market state (served from the cycle snapshot)
+    spec = snapshot.spec
+    if not spec:
         logger.error("Cannot manage grid: failed to get symbol info.")
         return False
-
-    # --- Identify triggered orders --- 
-    # An order is considered triggered if it no longer exists in the orders list,
-    # but a position with the corresponding direction and volume potentially exists.
-    # We need the state to know what orders *should* exist.
-
-    # Get expected order tickets from state (if stored)
-    # For simplicity now, let's find orders by type and price level
-    expected_buy_stop_level = state.get('initial_buy_stop_level')
-    expected_sell_stop_level = state.get('initial_sell_stop_level')
-
-    active_buy_stop = None
-    active_sell_stop = None
-    for o in orders:
-        if o.type == mt5.ORDER_TYPE_BUY_STOP and o.price_open == expected_buy_stop_level:
-            active_buy_stop = o
-        elif o.type == mt5.ORDER_TYPE_SELL_STOP and o.price_open == expected_sell_stop_level:
-            active_sell_stop = o
-            
-    # --- Check Buy Trigger --- 
-    # If we expected a buy stop, but it's gone, assume it triggered (or was cancelled externally)
-    # A more robust check involves matching position entry price/time or order fill history
-    buy_triggered = False
-    if expected_buy_stop_level and not active_buy_stop:
-        # Check if a corresponding BUY position exists (simplistic check)
-        # We need to know the *last placed* buy lot to potentially match volume
-        last_buy_lot = state.get('last_placed_buy_lot')
-        if any(p.type == mt5.POSITION_TYPE_BUY and p.volume == last_buy_lot for p in positions):
-             logger.info(f"Detected potential BuyStop trigger at level {expected_buy_stop_level}.")
-             buy_triggered = True
-             # Action implemented below
-             state_changed = True
-
-    # --- Check Sell Trigger --- 
-    # Similar logic for sell side
-    sell_triggered = False
-    if expected_sell_stop_level and not active_sell_stop:
-        last_sell_lot = state.get('last_placed_sell_lot')
-        # Ensure last_sell_lot is not None before comparison
-        if last_sell_lot is not None and any(p.type == mt5.POSITION_TYPE_SELL and p.volume == last_sell_lot for p in positions):
-             logger.info(f"Detected potential SellStop trigger at level {expected_sell_stop_level}.")
-             sell_triggered = True
-             # Action implemented below
-             state_changed = True
-             
-    # --- Implement Actions based on triggers --- 
-    if buy_triggered:
-        logger.info("Handling Buy trigger...")
-        # 1. Cancel existing SellStop (if any)
-        if active_sell_stop:
-            logger.info(f"Attempting to cancel SellStop order {active_sell_stop.ticket}")
-            cancel_success = mt5_api.cancel_order(active_sell_stop.ticket)
-            if not cancel_success:
-                logger.warning(f"Failed to cancel SellStop {active_sell_stop.ticket}, continuing but state might be inconsistent.")
-            else:
-                 logger.info(f"Cancelled SellStop order {active_sell_stop.ticket}")
-        else:
-             logger.info("Buy triggered, and no active SellStop order found (expected if grid just started or after previous trigger).")
-        
-        # 2. Place new SellStop
-        new_sell_lot = state.get('next_sell_lot')
-        sell_level = state.get('initial_sell_stop_level') 
-        last_buy_lot = state.get('last_placed_buy_lot') # Lot of the position that just triggered
-
-        if new_sell_lot and sell_level and last_buy_lot:
-             # Ensure lot meets symbol's volume constraints
-             new_sell_lot = max(new_sell_lot, symbol_info.volume_min)
-             new_sell_lot = min(new_sell_lot, symbol_info.volume_max)
-             if symbol_info.volume_step > 0:
-                new_sell_lot = math.floor(new_sell_lot / symbol_info.volume_step) * symbol_info.volume_step
-             new_sell_lot = round(new_sell_lot, 2)
-
-             if new_sell_lot > 0:
-                logger.info(f"Placing new SellStop at {sell_level} with lot {new_sell_lot}")
-                sell_request = {
-                    "action": mt5.TRADE_ACTION_PENDING,
-                    "symbol": symbol,
-                    "volume": new_sell_lot,
-                    "type": mt5.ORDER_TYPE_SELL_STOP,
-                    "price": sell_level,
-                    "magic": magic,
-                    "comment": "Grid Sell",
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": symbol_info.filling_mode
-                }
-                sell_result = mt5_api.send_order(sell_request)
-                if sell_result and sell_result.order > 0 and sell_result.retcode in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_PLACED):
-                    logger.info(f"New SellStop order accepted/placed successfully. Ticket: {sell_result.order}")
-                    # Update state AFTER successful placement
-                    state['last_placed_sell_lot'] = new_sell_lot
-                    state['next_buy_lot'] = round(last_buy_lot * const.LOT_MULTIPLIER, 2) # Calculate next lot based on the one that TRIGGERED
-                    # Mark the buy trigger as handled by removing its level from state
-                    state.pop('initial_buy_stop_level', None)
-                    logger.info(f"State updated: last_placed_sell_lot={state.get('last_placed_sell_lot')}, next_buy_lot={state.get('next_buy_lot')}, initial_buy_stop_level removed.")
-                else:
-                    logger.error(f"Failed to place new SellStop order. Result: {sell_result}. State not updated for this action.")
-                    state_changed = False # Revert state change if this crucial step failed
-             else:
-                 logger.error(f"Calculated new sell lot is zero or negative ({new_sell_lot}). Cannot place order.")
-                 state_changed = False
-        else:
-            logger.error("Cannot place new SellStop: Missing required state variables (next_sell_lot, initial_sell_stop_level, last_placed_buy_lot).")
-            state_changed = False
-
-    if sell_triggered:
-        logger.info("Handling Sell trigger...")
-        # 1. Cancel existing BuyStop (if any)
-        if active_buy_stop:
-            logger.info(f"Attempting to cancel BuyStop order {active_buy_stop.ticket}")
-            cancel_success = mt5_api.cancel_order(active_buy_stop.ticket)
-            if not cancel_success:
-                logger.warning(f"Failed to cancel BuyStop {active_buy_stop.ticket}, continuing but state might be inconsistent.")
+    symbol_info = spec.info
+    before = dict(state)
+
+    # --- Identify triggered orders ---
+    # Each armed side is tracked by its order ticket (state buy_stop_ticket / sell_stop_ticket).
+    # Fills come from the deal history (new deals only, see deal_reconciler), so a stop that filled
+    # and closed between two cycles still counts. If the history is unavailable, the grid book
+    # tells whether a position was opened from the ticket (position identifier = order ticket):
+    # exact, no price/volume matching.
+    if snapshot.orders is None or snapshot.positions is None:
+        # Unknown, not empty: every tracked ticket would look gone and be placed again
+        logger.warning("Cannot manage grid: failed to read orders or positions. Skipping this cycle.")
+        return False
+    fills = fills or {}
+    delta = grid.book.update(snapshot.orders, snapshot.positions)
+    if delta:
+        logger.debug("Grid book changes: %s", delta)
+    _adopt_armed_lots(grid, state, symbol_info)
+
+    triggers = []
+    for side, label in (('buy', 'BuyStop'), ('sell', 'SellStop')):
+        for leg in range(grid.depth):
+            ticket = state.get(grid_planner.ticket_key(side, leg))
+            if not ticket or ticket in grid.book.orders:
+                continue
+            fill_volume = triggered_volume(grid.book, label, ticket, fills)
+            if fill_volume:
+                fill = fills.get(ticket)
+                triggers.append((fill.time_msc if fill else 0, leg, side, fill_volume))
             else:
-                logger.info(f"Cancelled BuyStop order {active_buy_stop.ticket}")
-        else:
-             logger.info("Sell triggered, and no active BuyStop order found (expected if grid just started or after previous trigger).")
-             
-        # 2. Place new BuyStop
-        new_buy_lot = state.get('next_buy_lot')
-        buy_level = state.get('initial_buy_stop_level')
-        last_sell_lot = state.get('last_placed_sell_lot') # Lot of the position that just triggered
-
-        if new_buy_lot and buy_level and last_sell_lot:
-             # Ensure lot meets symbol's volume constraints
-             new_buy_lot = max(new_buy_lot, symbol_info.volume_min)
-             new_buy_lot = min(new_buy_lot, symbol_info.volume_max)
-             if symbol_info.volume_step > 0:
-                 new_buy_lot = math.floor(new_buy_lot / symbol_info.volume_step) * symbol_info.volume_step
-             new_buy_lot = round(new_buy_lot, 2)
-
-             if new_buy_lot > 0:
-                logger.info(f"Placing new BuyStop at {buy_level} with lot {new_buy_lot}")
-                buy_request = {
-                    "action": mt5.TRADE_ACTION_PENDING,
-                    "symbol": symbol,
-                    "volume": new_buy_lot,
-                    "type": mt5.ORDER_TYPE_BUY_STOP,
-                    "price": buy_level,
-                    "magic": magic,
-                    "comment": "Grid Buy",
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": symbol_info.filling_mode
-                }
-                buy_result = mt5_api.send_order(buy_request)
-                if buy_result and buy_result.order > 0 and buy_result.retcode in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_PLACED):
-                    logger.info(f"New BuyStop order accepted/placed successfully. Ticket: {buy_result.order}")
-                    # Update state AFTER successful placement
-                    state['last_placed_buy_lot'] = new_buy_lot
-                    state['next_sell_lot'] = round(last_sell_lot * const.LOT_MULTIPLIER, 2) # Calculate next lot based on the one that TRIGGERED
-                    # Mark the sell trigger as handled by removing its level from state
-                    state.pop('initial_sell_stop_level', None)
-                    logger.info(f"State updated: last_placed_buy_lot={state.get('last_placed_buy_lot')}, next_sell_lot={state.get('next_sell_lot')}, initial_sell_stop_level removed.")
-                else:
-                    logger.error(f"Failed to place new BuyStop order. Result: {buy_result}. State not updated for this action.")
-                    state_changed = False # Revert state change if this crucial step failed
-             else:
-                 logger.error(f"Calculated new buy lot is zero or negative ({new_buy_lot}). Cannot place order.")
-                 state_changed = False
-        else:
-             logger.error("Cannot place new BuyStop: Missing required state variables (next_buy_lot, initial_buy_stop_level, last_placed_sell_lot).")
-             state_changed = False
-
-    # Ensure state_changed reflects if *any* action successfully modified the state
-    # The logic above sets state_changed = False if placing the new order fails.
+                # Gone without a fill: cancelled/expired externally. The leg stays planned and is re-placed.
+                logger.warning("%s %s (leg %s) is gone but no position was opened from it. It will be placed again.", label, ticket, leg)
+                state.pop(grid_planner.ticket_key(side, leg), None)
+
+    # --- State transitions, in fill order (both sides can fill between two cycles) ---
+    for _, leg, side, fill_volume in sorted(triggers):
+        logger.info("Handling %s trigger (leg %s)...", side.capitalize(), leg)
+        _apply_fill(state, spec, side, leg, fill_volume)
+
+    # --- Converge the live orders on the desired grid ---
+    step = grid_math.distance_points(const.GRID_DEPTH_STEP_PIPS, symbol_info.digits, symbol_info.trade_stops_level)[0] * symbol_info.point
+    next_lot = lambda lot: spec.next_lot(lot, state.get('initial_lot'))
+    desired = grid_planner.desired_orders(state, grid.depth, step, next_lot, symbol_info.digits)
+    # Legs that would lead to a stop-out before the grid can act again are resized or dropped (no terminal calls)
+    exposure = exposure_model.ExposureModel.from_snapshot(snapshot, state.get('initial_deposit'))
+    desired, gated = exposure_model.gate(exposure, state, desired, previous=grid.gated)
+    gated = {(d.side, d.leg, d.price, d.volume): volume for d, volume in gated}
+    for (side, leg, price, lot), volume in gated.items():
+        if grid.gated.get((side, leg, price, lot)) == volume:
+            continue # Same decision as last cycle
+        logger.warning("%s leg %s at %s: a %s lot fill would leave equity below the drawdown floor at the opposite level. %s.", side.capitalize(), leg, price, lot, f"Resized to {volume} lots" if volume else "Not placed")
+        metrics.inc('grid_exposure_gated_total', grid=grid.key, outcome='resized' if volume else 'dropped')
+    grid.gated = gated
+    if exposure is not None:
+        for index, projection in enumerate(exposure.project_ladder(state, const.EXPOSURE_PROJECTION_STEPS, next_lot)):
+            metrics.set_gauge('grid_projected_drawdown_percent', round(projection.drawdown_percent, 2), grid=grid.key, fill=index + 1)
+    tracked = {(side, leg): state.get(grid_planner.ticket_key(side, leg)) for side, _ in grid_planner.SIDES for leg in range(grid.depth)}
+    actions = grid_planner.plan(desired, grid.book.orders.values(), symbol_info.point / 2, tracked=tracked)
+    # Under high volatility continuation legs are placed a few per cycle instead of in one burst
+    tick = snapshot.tick
+    pip = grid_math.pip_multiplier(symbol_info.digits) * symbol_info.point
+    if tick and grid.volatility.update(tick.time_msc, (tick.bid + tick.ask) / 2) >= const.VOLATILE_RANGE_PIPS * pip:
+        throttled = grid_planner.throttle(actions, const.VOLATILE_LEG_PLACEMENTS_PER_CYCLE)
+        if len(throttled) < len(actions):
+            logger.info("Volatile market: holding back %s continuation leg placement(s) until the next cycle.", len(actions) - len(throttled))
+        actions = throttled
+    changes = [a for a in actions if a.kind != grid_planner.KEEP]
+    if changes:
+        logger.debug("Grid plan: %s", [(a.kind, a.side, a.order.ticket if a.order else None) for a in changes])
+    apply_plan(grid, snapshot, actions)
+
+    state_changed = dict(state) != before
     if state_changed:
         logger.info("Grid managed. State updated.") # Changed log message slightly
 
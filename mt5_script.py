@@ -1,116 +1,189 @@
 import time
+PROCESS_STARTED = time.perf_counter() # Before the other imports: startup time includes them
 import sys
-import MetaTrader5 as mt5
+import threading
+from mt5_functions.backend import mt5, start_terminal_worker # MetaTrader5 or the offline simulator
 
-from utils.logger import logger
+from utils.logger import logger, shutdown_logging
 import utils.constants as const
-from utils.state_manager import load_state, save_state
+import utils.metrics as metrics
+from utils.state_manager import load_state, save_state, close_state
 import mt5_functions.mt5_api as mt5_api
-import mt5_functions.trading_service as trading_service
+from mt5_functions.grid_orchestrator import GridOrchestrator
+from mt5_functions.equity_watchdog import EquityWatchdog
+from mt5_functions.cycle_scheduler import CycleScheduler
+from mt5_functions.tick_recorder import TickRecorder
+
+def record_phase(phase, started):
+    """Records the duration of a main loop phase that began at `started`; returns now (start of the next phase)."""
+    now = time.perf_counter()
+    metrics.observe('bot_phase_duration_seconds', now - started, phase=phase)
+    return now
+
+def stop_after_watchdog(orchestrator, state):
+    """The watchdog liquidated on its own thread; the main loop resets and saves the state it owns."""
+    logger.warning("Equity watchdog hit the drawdown limit. Strategy halted and state reset.")
+    orchestrator.reset_all()
+    save_state(state)
+
+def report_startup_time():
+    """Logs and records the time from process start to the end of the first managed cycle."""
+    elapsed = time.perf_counter() - PROCESS_STARTED
+    metrics.observe('bot_startup_seconds', elapsed)
+    if elapsed > const.STARTUP_BUDGET_SECONDS:
+        logger.warning("First grid cycle finished %.0f ms after process start (budget %.0f ms).", elapsed * 1000, const.STARTUP_BUDGET_SECONDS * 1000)
+    else:
+        logger.info("First grid cycle finished %.0f ms after process start.", elapsed * 1000)
 
 def run_bot():
     """Main function to run the trading bot logic."""
     logger.info("Starting MT5 Trading Bot...")
 
     # --- Initial Connection ---
+    start_terminal_worker() # Terminal calls run in the supervised worker process from here on (TERMINAL_WORKER_ENABLED)
     if not mt5_api.connect_mt5():
         logger.error("Fatal: Failed to initialize MetaTrader 5 connection on startup. Exiting.")
         sys.exit(1)
 
     # --- Load Initial State ---
     state = load_state()
-    logger.info(f"Loaded initial state: {state}")
+    logger.info("Loaded initial state: %s", state)
+    orchestrator = GridOrchestrator(state)
+    if orchestrator.migrated:
+        save_state(state)
+
+    # --- Start Equity Watchdog ---
+    # Checks drawdown every WATCHDOG_INTERVAL_SECONDS, independently of this loop
+    halted = threading.Event()
+    watchdog = None
+    if const.WATCHDOG_ENABLED:
+        watchdog = EquityWatchdog(orchestrator.grids, halted=halted)
+        watchdog.start()
+
+    # --- Start Tick Recorder ---
+    # Captures every tick of the traded symbols to ring files (post-mortems, sim replays)
+    tick_recorder = None
+    if const.TICK_CAPTURE_ENABLED:
+        tick_recorder = TickRecorder(grid.symbol for grid in orchestrator.grids)
+        tick_recorder.start()
+
+    cycle_scheduler = CycleScheduler()
+    if const.METRICS_ENABLED:
+        metrics.start_server()
+
+    def on_retries_settled():
+        logger.info("Queued order retries settled, saving state.")
+        save_state(state)
 
+    first_cycle_done = False
     is_running = True
     while is_running:
         try:
+            if halted.is_set():
+                stop_after_watchdog(orchestrator, state)
+                is_running = False
+                continue
+
             # --- 1. Check Connection --- 
+            cycle_started = phase_started = time.perf_counter()
             if not mt5.terminal_info(): # Quick check if terminal is available
-                logger.error("MetaTrader 5 terminal connection lost. Attempting to reconnect...")
-                time.sleep(const.LOOP_DELAY_SECONDS) # Wait before reconnect attempt
-                if not mt5_api.connect_mt5():
-                    logger.error("Fatal: Reconnect failed. Stopping the bot.")
-                    is_running = False
-                    continue # Skip to the end of the loop
-                else:
-                    logger.info("Successfully reconnected to MetaTrader 5.")
-                    # Re-fetch state potentially missed during disconnection? For now, continue.
+                logger.error("MetaTrader 5 terminal connection lost. Waiting for reconnect...")
+                # The terminal worker's supervisor reconnects with backoff; positions and state are kept meanwhile
+                if not mt5_api.wait_for_reconnect(const.TERMINAL_RECONNECT_WAIT_SECONDS):
+                    logger.error("Terminal still unavailable after %ss. Trying again.", const.TERMINAL_RECONNECT_WAIT_SECONDS)
+                    continue
+                logger.info("Successfully reconnected to MetaTrader 5.")
+                # Fills missed while disconnected are caught up from the deal history next cycle
+
+            # Retries that came due since the last cycle (their callbacks may update state)
+            if mt5_api.order_scheduler.poll():
+                save_state(state)
+
+            # Terminal state for this cycle is fetched lazily, once, and shared by all grids and steps below
+            snapshots = orchestrator.snapshots()
+            phase_started = record_phase('connection', phase_started)
             
             # --- 2. Check Drawdown --- 
             # Perform drawdown check first, as it can reset the state
             drawdown_hit = False
             try:
-                drawdown_hit = trading_service.check_drawdown_and_close_all(state)
+                drawdown_hit = orchestrator.check_drawdown_and_close_all(snapshots)
                 if drawdown_hit:
                     logger.warning("Drawdown limit hit. Strategy halted and state reset.")
                     save_state(state) # Save the reset state
                     is_running = False # Stop the main loop after reset
                     continue # Skip the rest of this iteration
             except Exception as e:
-                logger.error(f"Error during drawdown check: {e}", exc_info=True)
+                logger.error("Error during drawdown check: %s", e, exc_info=True)
                 # Consider if bot should stop on drawdown check error. For now, continue.
+            phase_started = record_phase('drawdown', phase_started)
 
             # --- 3. Initialize Strategy (if needed) ---
-            # Check if strategy needs initialization (only if not already initialized)
-            if not state.get('initialized', False):
-                logger.info("Strategy requires initialization.")
-                try:
-                    initialized_now = trading_service.initialize_strategy(state)
-                    if initialized_now:
-                        logger.info("Strategy initialized successfully in this cycle.")
-                        save_state(state) # Save state after successful init
-                    else:
-                        # Might fail due to market conditions or temporary errors
-                        logger.warning("Initialization attempt failed or was skipped (e.g., existing orders). Will retry next cycle.")
-                except Exception as e:
-                    logger.error(f"Error during strategy initialization: {e}", exc_info=True)
-                    # Continue, will retry initialization in the next cycle
-            
-            # --- 4. Manage Grid (if initialized) ---
-            # Only manage grid if the strategy is marked as initialized
-            if state.get('initialized', False):
-                try:
-                    grid_state_changed = trading_service.check_and_manage_grid(state)
-                    if grid_state_changed:
-                        logger.info("Grid state was modified, saving state.")
-                        save_state(state)
-                    else:
-                        logger.debug("Grid check complete, no changes required.")
-                except Exception as e:
-                    logger.error(f"Error during grid management: {e}", exc_info=True)
-                    # Continue, assuming temporary error or issue with a single cycle
+            # Grids that are not initialized yet (failures are retried next cycle)
+            if orchestrator.initialize(snapshots):
+                save_state(state) # Save state after successful init
+            phase_started = record_phase('initialization', phase_started)
+
+            # --- 4. Manage Grids (if initialized) ---
+            # Only manage grids that are marked as initialized (and only if the watchdog has not fired meanwhile)
+            if halted.is_set():
+                continue
+            if orchestrator.manage(snapshots):
+                logger.info("Grid state was modified, saving state.")
+                save_state(state)
             else:
-                 logger.debug("Skipping grid management as strategy is not initialized.")
+                logger.debug("Grid check complete, no changes required.")
+            phase_started = record_phase('grid', phase_started)
+            if not first_cycle_done:
+                first_cycle_done = True
+                report_startup_time()
 
             # --- 5. Monitoring (Optional Logging) ---
             # Placed after management actions to reflect current state
-            current_orders = mt5_api.get_orders(symbol=const.SYMBOL, magic=const.MAGIC_NUMBER)
-            current_positions = mt5_api.get_positions(symbol=const.SYMBOL, magic=const.MAGIC_NUMBER)
-            logger.info(f"Monitoring: {len(current_orders)} orders, {len(current_positions)} positions (Magic: {const.MAGIC_NUMBER})")
+            # Only costs terminal calls if a trade action invalidated the snapshot this cycle
+            orchestrator.log_monitoring(snapshots)
+            record_phase('monitoring', phase_started)
+            record_phase('cycle', cycle_started) # Whole cycle, without the wait
 
             # --- 6. Wait for next cycle --- 
-            logger.debug(f"Main loop iteration finished. Waiting for {const.LOOP_DELAY_SECONDS} seconds...")
-            time.sleep(const.LOOP_DELAY_SECONDS)
+            # Watches the tick between cycles: wakes early near a grid level, otherwise idles up to MAX_IDLE_CYCLE_SECONDS
+            logger.debug("Main loop iteration finished. Waiting for the next cycle...")
+            reason = cycle_scheduler.wait(snapshots, halted, on_retries_settled)
+            logger.debug("Next cycle (%s). Tick polls so far: %s, early wakes: %s", reason, cycle_scheduler.polls, cycle_scheduler.wakes)
 
         except KeyboardInterrupt:
             logger.info("KeyboardInterrupt received. Initiating shutdown...")
             is_running = False # Signal loop to stop
         except Exception as e: # Catch unexpected errors in the main loop itself
-            logger.error(f"Unhandled exception in main loop: {e}", exc_info=True)
+            logger.error("Unhandled exception in main loop: %s", e, exc_info=True)
             # Consider adding a delay or specific recovery logic here if needed
             time.sleep(const.LOOP_DELAY_SECONDS) # Basic delay to prevent rapid error loops
 
     # --- Shutdown Sequence ---
     logger.info("Bot loop finished. Finalizing...")
+    if watchdog:
+        watchdog.stop()
+        watchdog.join(timeout=const.LIQUIDATION_TIMEOUT_SECONDS) # Let a running liquidation finish
+    if tick_recorder:
+        tick_recorder.stop()
+        tick_recorder.join(timeout=const.TICK_CAPTURE_INTERVAL_SECONDS + 5) # Closes the capture files
+    try:
+        # Let in-flight retries (e.g. stop-out closes) settle; each intent's deadline bounds this
+        if not mt5_api.order_scheduler.drain(timeout=const.ORDER_INTENT_TTL_SECONDS):
+            logger.warning("Some order retries were still pending at shutdown.")
+    except Exception as e:
+        logger.error("Error draining order retries: %s", e, exc_info=True)
     try:
         # Save the very final state, whatever it may be
         logger.info("Saving final state...")
         save_state(state) 
+        close_state() # Compact the journal into the snapshot
     except Exception as e:
-         logger.error(f"Error saving final state: {e}", exc_info=True)
+         logger.error("Error saving final state: %s", e, exc_info=True)
          
     mt5_api.disconnect_mt5()
     logger.info("MT5 Trading Bot stopped gracefully.")
+    shutdown_logging() # Flush the background log writer
 
 if __name__ == "__main__":
     run_bot() # Call the main bot function
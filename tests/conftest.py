@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# The tests run against the offline simulator, in-process, with prices that only move through
+# sim_terminal.step(). Set before utils.constants is first imported.
+os.environ.setdefault("MT5_BACKEND", "sim")
+os.environ.setdefault("MT5_SIM_TICK_RATE", "0")
+os.environ["MT5_TERMINAL_WORKER"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.constants as const
+
+# Keep the test log out of the checkout; the execution ring file (about 6 MB) is not written at all
+const.LOG_FILE = os.path.join(tempfile.gettempdir(), "mt5_bot_tests.log")
+const.EXECUTION_LOG_ENABLED = False
@@ -0,0 +1,97 @@
+from collections import namedtuple
+
+import pytest
+
+import mt5_functions.mt5_api as mt5_api
+import mt5_functions.sim_terminal as sim_terminal
+from mt5_functions import grid_planner
+from mt5_functions.backend import mt5
+from mt5_functions.grid_orchestrator import GridOrchestrator
+from mt5_functions.grid_planner import CANCEL, KEEP, MODIFY, PLACE, DesiredOrder
+
+Order = namedtuple('Order', ['ticket', 'type', 'price_open', 'volume_current'])
+
+BUY, SELL = mt5.ORDER_TYPE_BUY_STOP, mt5.ORDER_TYPE_SELL_STOP
+TOLERANCE = 0.000005
+
+def kinds(actions):
+    return [(a.kind, a.order.ticket if a.order else None, a.desired.leg if a.desired else None) for a in actions]
+
+# --- plan() ---
+
+def test_matching_orders_are_kept():
+    desired = [DesiredOrder('buy', 0, BUY, 1.10200, 0.1), DesiredOrder('sell', 0, SELL, 1.09800, 0.1)]
+    live = [Order(1, BUY, 1.10200, 0.1), Order(2, SELL, 1.09800, 0.1)]
+    assert kinds(grid_planner.plan(desired, live, TOLERANCE)) == [(KEEP, 1, 0), (KEEP, 2, 0)]
+
+def test_moved_order_is_modified():
+    desired = [DesiredOrder('buy', 0, BUY, 1.10200, 0.1)]
+    actions = grid_planner.plan(desired, [Order(1, BUY, 1.10150, 0.1)], TOLERANCE)
+    assert kinds(actions) == [(MODIFY, 1, 0)]
+    assert actions[0].desired.price == 1.10200
+
+def test_resized_order_is_cancelled_and_placed():
+    # TRADE_ACTION_MODIFY cannot change the volume
+    desired = [DesiredOrder('buy', 0, BUY, 1.10200, 0.15)]
+    assert kinds(grid_planner.plan(desired, [Order(1, BUY, 1.10200, 0.1)], TOLERANCE)) == [(CANCEL, 1, None), (PLACE, None, 0)]
+
+def test_foreign_orders_are_cancelled_and_missing_legs_placed():
+    desired = [DesiredOrder('buy', 1, BUY, 1.10400, 0.15), DesiredOrder('buy', 0, BUY, 1.10200, 0.1)]
+    live = [Order(7, SELL, 1.09000, 0.3)]
+    # Cancels first, then places nearest to price first
+    assert kinds(grid_planner.plan(desired, live, TOLERANCE)) == [(CANCEL, 7, None), (PLACE, None, 0), (PLACE, None, 1)]
+
+def test_tracked_ticket_is_preferred_among_matches():
+    desired = [DesiredOrder('buy', 0, BUY, 1.10200, 0.1)]
+    live = [Order(1, BUY, 1.10200, 0.1), Order(2, BUY, 1.10200, 0.1)]
+    actions = grid_planner.plan(desired, live, TOLERANCE, tracked={('buy', 0): 2})
+    assert kinds(actions) == [(KEEP, 2, 0), (CANCEL, 1, None)]
+
+def test_desired_orders_skip_filled_legs():
+    state = {'buy_armed_lot': 0.1, 'initial_buy_stop_level': 1.102, 'buy_filled_legs': 1}
+    desired = grid_planner.desired_orders(state, depth=3, step=0.002, next_lot=lambda lot: round(lot * 2, 2))
+    assert [(d.leg, d.price, d.volume) for d in desired] == [(1, 1.104, 0.2), (2, 1.106, 0.4)]
+
+def test_throttle_holds_back_continuation_legs_only():
+    desired = [DesiredOrder('buy', leg, BUY, 1.102 + leg * 0.002, 0.1) for leg in range(3)]
+    actions = grid_planner.throttle(grid_planner.plan(desired, [], TOLERANCE), 1)
+    assert kinds(actions) == [(PLACE, None, 0), (PLACE, None, 1)]
+
+# --- A cycle whose order read fails ---
+
+@pytest.fixture
+def simulated_grid(monkeypatch):
+    """A freshly initialized grid on a new simulated terminal: (orchestrator, cycle)."""
+    monkeypatch.setattr(sim_terminal, '_terminal', None)
+    assert mt5_api.connect_mt5()
+    orchestrator = GridOrchestrator({}, configs=[{'symbol': 'EURUSD', 'magic': 4242}])
+
+    def cycle():
+        snapshots = orchestrator.snapshots()
+        orchestrator.initialize(snapshots)
+        orchestrator.manage(snapshots)
+        mt5_api.order_scheduler.drain(5)
+    cycle()
+    return orchestrator, cycle
+
+def grid_orders(magic=4242):
+    return [o for o in mt5.orders_get() if o.magic == magic]
+
+def test_failed_order_read_does_not_place_the_grid_again(simulated_grid, monkeypatch):
+    orchestrator, cycle = simulated_grid
+    grid = orchestrator.grids[0]
+    tickets = (grid.state['buy_stop_ticket'], grid.state['sell_stop_ticket'])
+    assert len(grid_orders()) == 2
+
+    polls = []
+    monkeypatch.setattr(orchestrator.reconciler, 'poll', lambda: polls.append(1) or {})
+    with monkeypatch.context() as failing:
+        failing.setattr(mt5_api, 'get_orders', lambda symbol=None, magic=None: None)
+        snapshots = orchestrator.snapshots()
+        assert snapshots[0][1].orders is None # Unknown, not "no orders"
+        assert orchestrator.manage(snapshots) is False
+    assert polls == [] # The deal cursor stays put for the skipped grid
+    assert (grid.state['buy_stop_ticket'], grid.state['sell_stop_ticket']) == tickets
+
+    cycle()
+    assert sorted(o.ticket for o in grid_orders()) == sorted(tickets)
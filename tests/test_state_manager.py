@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+import utils.constants as const
+import utils.state_manager as state_manager
+from mt5_functions.deal_reconciler import CURSOR_KEY
+from mt5_functions.grid_orchestrator import migrate_legacy_state
+from utils.state_manager import NamespacedState
+
+@pytest.fixture
+def state_files(tmp_path, monkeypatch):
+    """Points the state manager at a temp snapshot/journal and starts it like a new process."""
+    snapshot = tmp_path / "state.json"
+    monkeypatch.setattr(state_manager, 'STATE_FILE', str(snapshot))
+    monkeypatch.setattr(state_manager, 'JOURNAL_FILE', str(snapshot) + ".journal")
+    restart()
+    yield snapshot, tmp_path / "state.json.journal"
+    state_manager.close_state()
+
+def restart():
+    """Simulates a process that died without close_state(): the module state is lost, the files stay."""
+    if state_manager._journal is not None:
+        state_manager._journal.close()
+    state_manager._journal = None
+    state_manager._persisted = {}
+    state_manager._entries = 0
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def test_journal_is_replayed_on_top_of_the_snapshot(state_files):
+    snapshot, journal = state_files
+    state = state_manager.load_state()
+    state.update({'initialized': True, 'buy_stop_ticket': 1, 'sell_stop_ticket': 2})
+    state_manager.save_state(state)
+    state['buy_stop_ticket'] = 3
+    del state['sell_stop_ticket']
+    state_manager.save_state(state)
+
+    assert read_json(snapshot) == {} # Only the journal was written
+    assert len(journal.read_text().splitlines()) == 2
+    restart()
+    assert state_manager.load_state() == {'initialized': True, 'buy_stop_ticket': 3}
+    # Loading compacts: the replayed state is the new snapshot and the journal starts over
+    assert read_json(snapshot) == {'initialized': True, 'buy_stop_ticket': 3}
+    assert journal.read_text() == ''
+
+def test_torn_last_line_is_skipped(state_files):
+    snapshot, journal = state_files
+    snapshot.write_text(json.dumps({'initialized': True}))
+    journal.write_text('{"set":{"buy_stop_ticket":5}}\n{"set":{"sell_stop_ti')
+    assert state_manager.load_state() == {'initialized': True, 'buy_stop_ticket': 5}
+
+def test_saves_after_a_torn_line_survive_the_next_restart(state_files):
+    snapshot, journal = state_files
+    journal.write_text('{"set":{"initialized":true}}\n{"set":{"buy_stop_tick') # Partial line, no newline
+    state = state_manager.load_state()
+    state['sell_stop_ticket'] = 9
+    state_manager.save_state(state) # Must not be glued onto the partial line
+
+    restart()
+    assert state_manager.load_state() == {'initialized': True, 'sell_stop_ticket': 9}
+
+def test_journal_is_compacted_every_snapshot_interval(state_files, monkeypatch):
+    snapshot, journal = state_files
+    monkeypatch.setattr(const, 'STATE_SNAPSHOT_EVERY', 3)
+    state = state_manager.load_state()
+    for ticket in range(1, 4):
+        state['buy_stop_ticket'] = ticket
+        state_manager.save_state(state)
+    assert read_json(snapshot) == {'buy_stop_ticket': 3}
+    assert journal.read_text() == ''
+
+    state['sell_stop_ticket'] = 4
+    state_manager.save_state(state)
+    assert read_json(snapshot) == {'buy_stop_ticket': 3}
+    assert len(journal.read_text().splitlines()) == 1
+    restart()
+    assert state_manager.load_state() == {'buy_stop_ticket': 3, 'sell_stop_ticket': 4}
+
+def test_crash_between_snapshot_rename_and_journal_truncation(state_files, monkeypatch):
+    snapshot, journal = state_files
+    monkeypatch.setattr(const, 'STATE_SNAPSHOT_EVERY', 3)
+    state = state_manager.load_state()
+    state.update({'initialized': True, 'buy_stop_ticket': 1, 'temporary': 'x'})
+    state_manager.save_state(state)
+    state['buy_stop_ticket'] = 2
+    state_manager.save_state(state)
+
+    def crash(truncate):
+        raise OSError("crashed before the journal was truncated")
+    with monkeypatch.context() as crashing:
+        crashing.setattr(state_manager, '_open_journal', crash)
+        del state['temporary']
+        state['sell_stop_ticket'] = 7
+        state_manager.save_state(state) # Third entry: the snapshot is renamed into place, then the crash
+
+    expected = {'initialized': True, 'buy_stop_ticket': 2, 'sell_stop_ticket': 7}
+    assert read_json(snapshot) == expected
+    assert len(journal.read_text().splitlines()) == 3 # Still holds the entries the snapshot contains
+    restart()
+    # Entries hold absolute values, so replaying them over the newer snapshot changes nothing
+    assert state_manager.load_state() == expected
+
+# --- Per-grid state ---
+
+def test_namespaced_states_are_isolated(state_files):
+    root = state_manager.load_state()
+    # Magic 1 is a prefix of magic 11: the '|' separator keeps them apart
+    first, second = NamespacedState(root, "EURUSD|1|"), NamespacedState(root, "EURUSD|11|")
+    first.update({'initialized': True, 'buy_stop_ticket': 1})
+    second.update({'initialized': True, 'buy_stop_ticket': 2})
+    del first['initialized']
+
+    assert dict(first) == {'buy_stop_ticket': 1}
+    assert dict(second) == {'initialized': True, 'buy_stop_ticket': 2}
+    assert len(first) == 1 and 'initialized' not in first
+    state_manager.save_state(root)
+    restart()
+    assert state_manager.load_state() == {'EURUSD|1|buy_stop_ticket': 1, 'EURUSD|11|initialized': True, 'EURUSD|11|buy_stop_ticket': 2}
+
+def test_legacy_state_moves_under_the_configured_grid(monkeypatch):
+    monkeypatch.setattr(const, 'SYMBOL', 'EURUSD')
+    monkeypatch.setattr(const, 'MAGIC_NUMBER', 12345)
+    state = {'initialized': True, 'buy_stop_ticket': 1, CURSOR_KEY: [1000, 7]}
+    assert migrate_legacy_state(state, [('GBPUSD', 1), ('EURUSD', 12345)])
+    # The deal cursor is shared by all grids and stays at the root
+    assert state == {'EURUSD|12345|initialized': True, 'EURUSD|12345|buy_stop_ticket': 1, CURSOR_KEY: [1000, 7]}
+    assert not migrate_legacy_state(state, [('GBPUSD', 1), ('EURUSD', 12345)]) # Already migrated
+
+def test_legacy_state_moves_under_the_first_grid_when_its_own_is_gone(monkeypatch):
+    monkeypatch.setattr(const, 'SYMBOL', 'EURUSD')
+    monkeypatch.setattr(const, 'MAGIC_NUMBER', 12345)
+    state = {'initialized': True}
+    assert migrate_legacy_state(state, [('GBPUSD', 1), ('USDJPY', 2)])
+    assert state == {'GBPUSD|1|initialized': True}
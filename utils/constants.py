@@ -1,3 +1,5 @@
+import os
+
 # MetaTrader 5 Connection
 # MT5_TERMINAL_PATH = None # Path to the MetaTrader 5 terminal installation. If None, attempts to find it automatically.
 # Add MT5 login credentials if needed, or manage them via the terminal UI / environment variables.
@@ -15,17 +17,104 @@ LOT_MULTIPLIER = 1.5  # K_Lot: Multiplier for subsequent orders in the grid
 
 ORDER_DISTANCE_PIPS = 20  # Distance from current price for initial BuyStop/SellStop orders (in pips)
 
+GRID_DEPTH = 1  # Stop orders kept on the server per armed side: the level plus GRID_DEPTH - 1 continuation legs further out with the next ladder lots (1 = level order only)
+GRID_DEPTH_STEP_PIPS = ORDER_DISTANCE_PIPS  # Spacing of the continuation legs beyond the level (in pips)
+VOLATILITY_WINDOW_SECONDS = 60  # Price range window for the volatility check below
+VOLATILE_RANGE_PIPS = 30  # A grid is volatile while its price range over the window is at least this (in pips)...
+VOLATILE_LEG_PLACEMENTS_PER_CYCLE = 1  # ...and then places at most this many continuation legs per cycle (level orders are never held back)
+
 # TRAILING_STOP_START_PIPS = 0 # Not used according to refined logic
 # TRAILING_STOP_DISTANCE_PIPS = 15 # Not used according to refined logic
 
 MAX_DRAWDOWN_PERCENT = 20.0  # Maximum allowed drawdown percentage from the initial deposit before closing all positions/orders.
+EXPOSURE_GATE = "off"  # Legs whose fill would leave equity below the drawdown floor (and below not placing them) on a reversal or continuation: "resize" them, "reject" them, or "off" (default; the backtests do not model the gate)
+EXPOSURE_RESIZE_HYSTERESIS_PERCENT = 10.0  # A resized leg keeps its volume until the safe volume moves by more than this (in % of it, at least one volume step)
+EXPOSURE_BUFFER_PERCENT = 0.0  # Extra equity (in % of the initial deposit) a leg must leave above that floor
+EXPOSURE_PROJECTION_STEPS = 6  # Ladder fills projected each cycle for the grid_projected_drawdown_percent gauge
 
 MAGIC_NUMBER = 12345  # Magic number to identify EA's orders and positions
 
+# Grids run by one bot process over the same terminal connection. Each (symbol, magic) pair is an
+# independent grid with its own state; the trading parameters above apply to all of them.
+GRIDS = [
+    {"symbol": SYMBOL, "magic": MAGIC_NUMBER},
+    # {"symbol": "GBPUSD", "magic": 12346},
+]
+
 # Other Settings
 DEFAULT_DEVIATION = 10  # Default slippage/deviation in points for market order execution (not directly used by stop orders, but might be useful later)
 RETRY_COUNT = 3         # Number of retries for failed operations (e.g., order placement)
-RETRY_DELAY_SECONDS = 2 # Delay between retries in seconds
-STATE_FILE = "state.json" # File to store the robot's state
+RETRY_DELAY_SECONDS = 2 # Delay before the first retry in seconds
+RETRY_BACKOFF_MULTIPLIER = 2.0 # Each further retry waits this many times longer
+RETRY_MAX_DELAY_SECONDS = 8 # Upper bound for the retry delay
+STARTUP_BUDGET_SECONDS = 1.0 # Process start to first managed cycle above this is logged as a warning (bot_startup_seconds metric)
+RECOVERY_HISTORY_DAYS = 30 # Deal history read when the grid state is rebuilt from the terminal (state file lost, orders/positions still open)
+SYMBOL_SPEC_TTL_SECONDS = 300 # Cached symbol spec (volume limits, stops level, margin per lot) is refetched after this long, or after a trade error that points at a stale spec
+ORDER_INTENT_TTL_SECONDS = 15 # Queued order retries older than this are dropped instead of resent at a stale price
+ORDER_RATE_LIMIT_PER_SECOND = 10 # Trade requests per second sent to the broker, over all symbols (0 = no limit)...
+ORDER_RATE_BURST = 20 # ...with bursts of up to this many requests
+ORDER_SYMBOL_RATE_LIMIT_PER_SECOND = 5 # Same budget per symbol (0 = no per-symbol limit)...
+ORDER_SYMBOL_RATE_BURST = 10
+ORDER_RATE_RESERVE = 2 # Tokens each priority class leaves for the classes above it (liquidation > cancels > grid orders > diagnostics)
+STATE_FILE = "state.json" # Snapshot of the robot's state (changes in between are appended to STATE_FILE + ".journal")
+STATE_SNAPSHOT_EVERY = 200 # Journal entries after which the state is compacted into a new snapshot
+STATE_FSYNC_INTERVAL_SECONDS = 1.0 # Journal appends are fsynced at most this often (bursts of saves share one fsync)
 LOG_FILE = "mt5_bot.log" # File for logging (if file logging is enabled in logger.py)
-LOOP_DELAY_SECONDS = 5  # Delay in seconds for the main loop cycle
\ No newline at end of file
+LOG_MAX_BYTES = 10 * 1024 * 1024 # Rotate the log file when it grows past this size...
+LOG_ROTATE_INTERVAL_SECONDS = 86400 # ...or after this many seconds, whichever comes first (0 = size only)
+LOG_BACKUP_COUNT = 10 # Rotated log files kept (mt5_bot.log.1 ... .N)
+LOG_QUEUE_SIZE = 10000 # Records buffered for the background log writer; beyond this, records are dropped instead of blocking
+LOG_RATE_LIMIT_PER_SITE = 20 # Max DEBUG..WARNING records per logging call site per window (0 = no limit; errors always pass)...
+LOG_RATE_LIMIT_WINDOW_SECONDS = 10 # ...so retry storms cannot flood the disk
+EXECUTION_LOG_ENABLED = True # Record every order_send attempt (latency, requested vs executed price) in a binary ring file
+EXECUTION_LOG_FILE = "executions.ring" # Memory-mapped ring file (python -m mt5_functions.execution_recorder for percentiles)
+EXECUTION_LOG_CAPACITY = 100000 # Records kept; older ones are overwritten (58 bytes each)
+TICK_CAPTURE_ENABLED = os.environ.get("MT5_TICK_CAPTURE", "0") == "1" # Record every tick of the traded symbols in a ring file per symbol (post-mortems, sim replay); off by default
+TICK_CAPTURE_FILE = os.environ.get("MT5_TICK_CAPTURE_FILE", "ticks_{symbol}.ring") # Memory-mapped ring file per symbol, e.g. /var/lib/mt5bot/ticks_{symbol}.ring (python -m mt5_functions.tick_recorder for a summary)
+TICK_CAPTURE_CAPACITY = 2_000_000 # Ticks kept per symbol; older ones are overwritten (36 bytes each, 72 MB per file)
+TICK_CAPTURE_INTERVAL_SECONDS = 1.0 # How often the recorder pulls new ticks from the terminal
+TICK_CAPTURE_BATCH = 10000 # Ticks per copy_ticks_from request (more requests follow while catching up)
+TICK_CAPTURE_BACKFILL_SECONDS = 3600 # History captured at startup (also the longest gap a restart fills from the terminal)
+WATCHDOG_ENABLED = True # Run the equity watchdog thread (drawdown checks independent of the main loop)
+WATCHDOG_INTERVAL_SECONDS = 0.25 # Equity poll interval of the watchdog = worst-case drawdown reaction latency
+LIQUIDATION_WORKERS = 8 # Concurrent trade requests during a drawdown stop-out (simulator only: the MetaTrader5 package is called one request at a time)
+LIQUIDATION_MAX_ROUNDS = 5 # Re-snapshot / retry rounds for positions or orders left after a stop-out round
+LIQUIDATION_TIMEOUT_SECONDS = 10 # Time budget for getting flat during a stop-out
+LIQUIDATION_CANCEL_WAIT_SECONDS = 1.0 # Longest wait for a round's cancels to be answered before its closes are sent
+METRICS_ENABLED = True # Serve latency histograms / retry counters in Prometheus text format
+METRICS_HOST = "127.0.0.1" # Bind address of the metrics endpoint (local only by default)
+METRICS_PORT = int(os.environ.get("MT5_METRICS_PORT", "9108")) # http://METRICS_HOST:METRICS_PORT/metrics
+LOOP_DELAY_SECONDS = 5  # Delay in seconds before retrying after a connection loss or loop error
+MAX_IDLE_CYCLE_SECONDS = 30 # Longest time between main loop cycles when price stays away from the grid levels
+TICK_WAKE_BAND_PIPS = 3 # A cycle starts as soon as price comes within this many pips of a grid level (or crosses it)
+TICK_WAKE_SCAN_TICKS = 10000 # Most ticks read per poll to find price extremes between two polls
+TICK_POLL_MIN_SECONDS = 0.05 # Tick poll interval between cycles when price is inside the wake band
+TICK_POLL_MAX_SECONDS = 2.0 # Tick poll interval when price is ORDER_DISTANCE_PIPS or more away from the wake band
+
+# Terminal Backend
+TERMINAL_BACKEND = os.environ.get("MT5_BACKEND", "live") # "live" = MetaTrader5 package, "sim" = offline simulated terminal (mt5_functions/sim_terminal.py)
+
+TERMINAL_WORKER_ENABLED = os.environ.get("MT5_TERMINAL_WORKER", "1") == "1" # Run every terminal call in a supervised worker process (timeouts, automatic reconnect)
+TERMINAL_WORKER_THREADS = 8 # Calls the worker accepts at once; calls into the MetaTrader5 package still run one at a time (only the simulator runs them concurrently)
+TERMINAL_CALL_TIMEOUT_SECONDS = 5.0 # A terminal call that takes longer returns None (RES_E_INTERNAL_FAIL_TIMEOUT); the worker is restarted only if it also fails a health check
+TERMINAL_BULK_CALL_TIMEOUT_SECONDS = 120.0 # Timeout of bulk history requests (warm start deal history, market data sync)
+TERMINAL_INIT_TIMEOUT_SECONDS = 60.0 # Timeout of initialize(), which may have to start the terminal
+TERMINAL_HEALTH_INTERVAL_SECONDS = 1.0 # The supervisor checks terminal_info() this often
+TERMINAL_RECONNECT_BASE_SECONDS = 0.5 # First reconnect backoff; doubles per failed attempt, with full jitter...
+TERMINAL_RECONNECT_MAX_SECONDS = 30.0 # ...up to this bound
+TERMINAL_RECONNECT_WAIT_SECONDS = 30.0 # How long the main loop waits for a reconnect before trying again (positions and state are kept)
+
+# Simulated Terminal Settings (only used when TERMINAL_BACKEND == "sim")
+SIM_TICK_FILE = os.environ.get("MT5_SIM_TICKS") # CSV of recorded ticks (time_msc,bid,ask) or a tick capture .ring file. If None, a synthetic random walk is generated.
+SIM_TICKS_PER_SECOND = float(os.environ.get("MT5_SIM_TICK_RATE", "1000")) # Replay speed in ticks per wall-clock second. 0 = advance only via sim_terminal.step()
+SIM_SEED = 42 # Seed for the synthetic tick generator and fault injection
+SIM_START_PRICE = 1.10000 # Starting mid price of the synthetic tick stream
+SIM_VOLATILITY_POINTS = 3.0 # Standard deviation of the synthetic mid price change per tick (in points)
+SIM_SPREAD_POINTS = 10 # Spread of the synthetic tick stream (in points)
+SIM_TICK_INTERVAL_MS = 100 # Simulated time between synthetic ticks
+SIM_TICK_HISTORY = 1_000_000 # Ticks kept per symbol for copy_ticks_* / copy_rates_range
+SIM_INITIAL_BALANCE = 100000.0 # Starting balance of the simulated account
+SIM_LEVERAGE = 100 # Account leverage used for margin calculation
+SIM_STOP_OUT_LEVEL = 50.0 # Broker stop-out margin level (%). The largest losing position is closed below it
+SIM_REQUOTE_PROBABILITY = 0.0 # Probability that a trade request is answered with a requote (retry testing)
+SIM_ORDER_LATENCY_MS = 0 # Simulated broker round-trip time for order_send
@@ -0,0 +1,43 @@
+import math
+
+# Pure grid sizing/distance rules shared by the live bot (trading_service) and the offline tools
+# (backtester, optimizer). No terminal access here, so the same numbers come out everywhere.
+
+def pip_multiplier(digits):
+    # 1 pip = 10 points for 5-digit / 3-digit quotes, 1 point otherwise
+    return 10 if digits == 5 or digits == 3 else 1
+
+def distance_points(distance_pips, digits, stops_level):
+    """Returns (adjusted_points, requested_points): the pip distance in points, raised to stops_level if needed."""
+    requested = distance_pips * pip_multiplier(digits)
+    return max(requested, stops_level), requested
+
+def normalize_lot(lot, volume_min, volume_max, volume_step):
+    """Clamps a lot to the symbol's volume limits and floors it to the volume step."""
+    lot = max(lot, volume_min)
+    lot = min(lot, volume_max)
+    if volume_step > 0:
+        lot = math.floor(lot / volume_step) * volume_step
+    return round(lot, 2)
+
+def balance_percent_lot(balance, balance_percent, margin_per_lot):
+    """Lot whose margin equals balance_percent of the balance (falls back to balance/1000 without a margin figure)."""
+    target_amount = balance * balance_percent / 100.0
+    if not margin_per_lot or margin_per_lot <= 0:
+        return round(target_amount / 1000, 2)
+    return round(target_amount / margin_per_lot, 2)
+
+def next_lot(lot, multiplier):
+    """Next lot in the martingale ladder (before volume normalization)."""
+    return round(lot * multiplier, 2)
+
+def lot_ladder(initial_lot, multiplier, volume_min, volume_max, volume_step):
+    """Normalized lots of the martingale series from initial_lot, each leg derived from the previous
+    one exactly as next_lot() + normalize_lot() would, until volume_max is reached or the lot stops growing."""
+    lots = [normalize_lot(initial_lot, volume_min, volume_max, volume_step)]
+    while lots[-1] < volume_max:
+        lot = normalize_lot(next_lot(lots[-1], multiplier), volume_min, volume_max, volume_step)
+        if lot <= lots[-1]:
+            break
+        lots.append(lot)
+    return lots
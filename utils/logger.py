@@ -1,33 +1,163 @@
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
 import sys
+import threading
+import time
 import utils.constants as const # Import constants to get LOG_FILE
 
+# Logging pipeline: the trading threads only put records on a queue (QueueHandler); a background
+# QueueListener thread formats them and does all console/file I/O. Messages use lazy %-style
+# arguments, so formatting happens on the listener thread and only for records that are written.
+
+# --- Handlers used on the calling thread ---
+
+class SiteRateLimitFilter(logging.Filter):
+    """Lets at most LOG_RATE_LIMIT_PER_SITE records per LOG_RATE_LIMIT_WINDOW_SECONDS through per call site.
+
+    A call site is (file, line), so a retry storm hitting the same warning is throttled without
+    muting other messages. The next record let through from a throttled site carries the number
+    of records dropped in between. ERROR and CRITICAL are never dropped: a failure must reach the
+    log even in the middle of a storm.
+    """
+
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._sites = {} # (pathname, lineno) -> [window_start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+            elif site[1] < self.limit:
+                site[1] += 1
+                suppressed = 0
+            else:
+                site[2] += 1
+                return False
+        record.suppressed = suppressed
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records without formatting them (the stdlib prepare() formats on the caller's thread)."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Mutable arguments (state dicts, request dicts) are copied so the listener formats the
+        # values as they were when logged; everything else is passed by reference.
+        if record.args:
+            if isinstance(record.args, dict):
+                record.args = dict(record.args)
+            else:
+                record.args = tuple(dict(a) if isinstance(a, dict) else list(a) if isinstance(a, list) else a
+                                    for a in record.args)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 # Never block trading on a full log queue
+
+# --- Handlers used on the listener thread ---
+
+class SuppressedCountFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message += f" [{suppressed} similar messages suppressed]"
+        return message
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates when the file exceeds maxBytes or when `interval` seconds have passed since the last rotation."""
+
+    def __init__(self, filename, max_bytes, backup_count, interval):
+        super().__init__(filename, mode='a', maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if self.interval > 0 and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
 # Create logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG) # Set the lowest level to capture all messages
+logger.propagate = False
 
 # Create formatter
-log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s")
+log_formatter = SuppressedCountFormatter("%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s")
 
 # --- Console Handler ---
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.INFO) # Show INFO level and above in console
 console_handler.setFormatter(log_formatter)
-logger.addHandler(console_handler)
+output_handlers = [console_handler]
 
 # --- File Handler ---
-try:
-    file_handler = logging.FileHandler(const.LOG_FILE, mode='a') # Append mode
-    file_handler.setLevel(logging.DEBUG) # Log DEBUG level and above to file
-    file_handler.setFormatter(log_formatter)
-    logger.addHandler(file_handler)
-    logger.info(f"Logging initialized. Console level: INFO, File level ({const.LOG_FILE}): DEBUG")
-except Exception as e:
-    logger.error(f"Failed to initialize file logging to {const.LOG_FILE}: {e}")
+# Only the bot process writes the log file: child processes (the terminal worker re-imports the
+# main module) log to the console, since size/age rotation needs a single writer.
+is_main_process = multiprocessing.parent_process() is None
+file_error = None
+if is_main_process:
+    try:
+        file_handler = SizeAndTimeRotatingFileHandler(
+            const.LOG_FILE, const.LOG_MAX_BYTES, const.LOG_BACKUP_COUNT, const.LOG_ROTATE_INTERVAL_SECONDS)
+        file_handler.setLevel(logging.DEBUG) # Log DEBUG level and above to file
+        file_handler.setFormatter(log_formatter)
+        output_handlers.append(file_handler)
+    except Exception as e:
+        file_error = e
+
+# --- Queue ---
+log_queue = queue.Queue(maxsize=const.LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(SiteRateLimitFilter(const.LOG_RATE_LIMIT_PER_SITE, const.LOG_RATE_LIMIT_WINDOW_SECONDS))
+logger.addHandler(queue_handler)
+
+listener = logging.handlers.QueueListener(log_queue, *output_handlers, respect_handler_level=True)
+listener.start()
+
+def shutdown_logging():
+    """Flushes queued records and stops the writer thread (idempotent; also registered with atexit)."""
+    global listener
+    if listener is not None:
+        listener.stop() # Drains the queue before returning
+        listener = None
+        if queue_handler.dropped:
+            sys.stderr.write(f"Logging queue was full: {queue_handler.dropped} records dropped.{os.linesep}")
+
+atexit.register(shutdown_logging)
+
+if file_error is not None:
+    logger.error("Failed to initialize file logging to %s: %s", const.LOG_FILE, file_error)
+elif is_main_process:
+    logger.info("Logging initialized. Console level: INFO, File level (%s): DEBUG", const.LOG_FILE)
 
 # Example usage (will log to console and file if file handler is set up)
 # logger.debug("This is a debug message.")
 # logger.info("This is an info message.")
 # logger.warning("This is a warning message.")
 # logger.error("This is an error message.")
-# logger.critical("This is a critical message.") 
\ No newline at end of file
+# logger.critical("This is a critical message.")
@@ -0,0 +1,132 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from utils.logger import logger
+import utils.constants as const
+
+# In-process latency histograms, counters and gauges, served in Prometheus text format.
+# Recording is a bisect into fixed bucket bounds plus a few adds under a lock (no allocation
+# once a series exists), so it is cheap enough for every terminal call on the hot path.
+
+# Upper bounds in seconds: sub-millisecond IPC calls up to multi-second stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'bot_phase_duration_seconds': "Duration of each main loop phase",
+    'bot_startup_seconds': "Time from process start to the end of the first grid cycle",
+    'grid_exposure_gated_total': "Grid legs resized or dropped because their fill would lead to a stop-out, by grid and outcome",
+    'grid_projected_drawdown_percent': "Projected drawdown just before each of the next ladder fills, by grid and fill",
+    'mt5_call_duration_seconds': "Duration of MetaTrader 5 API calls",
+    'order_send_retries_total': "order_send attempts that were rescheduled, by retcode",
+    'order_send_results_total': "Final order_send outcomes, by retcode",
+    'order_send_tokens_total': "Trade requests let through by the rate limiter, by priority",
+    'order_send_throttled_total': "Trade requests held back by the rate limiter, by priority",
+    'tick_capture_ticks_total': "Ticks appended to the tick capture files, by symbol",
+    'order_send_queue_depth': "Trade requests waiting in the order scheduler (retries and throttled), by priority",
+}
+
+_lock = threading.Lock()
+_histograms = {} # (name, labels) -> [bucket counts..., sum, count]
+_counters = {} # (name, labels) -> value
+_gauges = {} # (name, labels) -> value
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+        series[index] += 1 # Last slot = above the largest bound (+Inf only)
+        series[-2] += seconds
+        series[-1] += 1
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+def render():
+    """Current metrics in Prometheus text exposition format."""
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    lines = []
+    for metric_type, series in (('histogram', histograms), ('counter', counters), ('gauge', gauges)):
+        for name in sorted({name for name, _ in series}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name != name:
+                    continue
+                if metric_type != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+def _handler_class():
+    # http.server (and the ssl/socket modules behind it) is only imported when the endpoint is started
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Scrapes every few seconds would flood the bot log
+
+    return MetricsHandler
+
+def start_server(host=None, port=None):
+    """Serves /metrics from a daemon thread. Returns the server, or None if the port is unavailable."""
+    host = host or const.METRICS_HOST
+    port = port if port is not None else const.METRICS_PORT
+    from http.server import ThreadingHTTPServer
+    try:
+        server = ThreadingHTTPServer((host, port), _handler_class())
+    except OSError as e:
+        logger.error("Failed to start metrics endpoint on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, server.server_address[1])
+    return server
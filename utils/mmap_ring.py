@@ -0,0 +1,132 @@
+import mmap
+import os
+import struct
+import threading
+
+# Fixed-width binary records in a memory-mapped ring file.
+#
+# Layout: a 32-byte header (magic, record size, capacity, total records written) followed by
+# `capacity` slots. Record i goes to slot i % capacity, so the file never grows and the newest
+# `capacity` records are always on disk. Fields are described once as (name, struct code) pairs,
+# the first one being the record's sequence number (filled in by append()/extend(), any integer code);
+# the same description gives the struct format for writing and the NumPy dtype for reading, so a
+# reader can map the slots as a structured array without copying.
+
+MAGIC = b'MT5RING1'
+HEADER = struct.Struct('<8sIIQQ') # magic, record_size, capacity, count, reserved
+
+# struct code -> NumPy type string (little endian, no padding)
+_NUMPY_TYPES = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+                'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+
+def record_struct(fields):
+    return struct.Struct('<' + ''.join(code for _, code in fields))
+
+def record_dtype(fields):
+    import numpy as np # Only readers need NumPy
+    return np.dtype([(name, _NUMPY_TYPES[code]) for name, code in fields])
+
+class MmapRing:
+    """Appends fixed-width records to a memory-mapped ring file. Thread-safe; no allocation per record."""
+
+    def __init__(self, path, fields, capacity):
+        self.path = path
+        self.record = record_struct(fields)
+        self.capacity = capacity
+        size = HEADER.size + self.record.size * capacity
+        self._lock = threading.Lock()
+
+        reuse = False
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            with open(path, 'rb') as f:
+                magic, record_size, file_capacity, _, _ = HEADER.unpack(f.read(HEADER.size))
+            reuse = magic == MAGIC and record_size == self.record.size and file_capacity == capacity
+        if not reuse:
+            # New file, or a different layout/capacity: start over (the old records are not comparable)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+                f.write(HEADER.pack(MAGIC, self.record.size, capacity, 0, 0))
+
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self.count = HEADER.unpack_from(self._map, 0)[3]
+        self._slots = None # NumPy view of the slots, created by the first extend()
+
+    def append(self, *values):
+        """Writes one record (values for every field after the sequence number). Returns its sequence number."""
+        with self._lock:
+            seq = self.count
+            self.record.pack_into(self._map, HEADER.size + (seq % self.capacity) * self.record.size, seq, *values)
+            self.count = seq + 1
+            # Count last: a reader never sees a slot counted before it is written
+            struct.pack_into('<Q', self._map, 16, self.count)
+            return seq
+
+    def extend(self, records):
+        """Writes a batch of records, a NumPy structured array with the ring's dtype (the sequence
+        numbers are filled in here), with one copy per contiguous run of slots. Returns the
+        sequence number of the first record."""
+        with self._lock:
+            if self._slots is None:
+                import numpy as np
+                self._slots = np.frombuffer(self._map, dtype=records.dtype, count=self.capacity, offset=HEADER.size)
+            first = self.count
+            total = len(records)
+            records = records[-self.capacity:] # The older ones would be overwritten within the batch
+            seq = first + total - len(records)
+            start = seq % self.capacity
+            head = min(len(records), self.capacity - start)
+            self._slots[start:start + head] = records[:head]
+            self._slots[:len(records) - head] = records[head:]
+            self._slots['seq'][start:start + head] = range(seq, seq + head)
+            self._slots['seq'][:len(records) - head] = range(seq + head, seq + len(records))
+            self.count = first + total
+            struct.pack_into('<Q', self._map, 16, self.count)
+            return first
+
+    def flush(self):
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._slots = None # Releases the buffer export, or the map cannot be closed
+                self._map.flush()
+                self._map.close()
+                self._file.close()
+                self._map = None
+
+def _map_ring(path, fields):
+    import numpy as np
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, record_size, capacity, count, _ = HEADER.unpack_from(mapped, 0)
+    dtype = record_dtype(fields)
+    if magic != MAGIC or record_size != dtype.itemsize:
+        raise ValueError(f"{path} is not a ring file with this record layout")
+    # The array keeps the mapping alive through its base buffer
+    return mapped, np.frombuffer(mapped, dtype=dtype, count=capacity, offset=HEADER.size), count
+
+def read_ring(path, fields):
+    """Maps a ring file read-only. Returns (records, count): a structured NumPy array over the filled
+    slots (zero copy, slot order; after wrap-around the oldest record is at slot count % capacity)
+    and the total number of records ever written."""
+    _, slots, count = _map_ring(path, fields)
+    return slots[:count], count
+
+def read_ordered(path, fields, since=0):
+    """Copies the records with sequence number >= `since` in write order. Returns (records, count).
+
+    Safe against a concurrent writer without locking: records the writer may have overwritten
+    while they were being copied are dropped from the front."""
+    import numpy as np
+    mapped, slots, count = _map_ring(path, fields)
+    capacity = len(slots)
+    first = max(since, count - capacity, 0)
+    if first >= count:
+        return slots[:0].copy(), count
+    start, end = first % capacity, (count - 1) % capacity + 1
+    ordered = slots[start:end].copy() if start < end else np.concatenate([slots[start:], slots[:end]])
+    count_after = HEADER.unpack_from(mapped, 0)[3]
+    return ordered[max(0, count_after - capacity - first):], count
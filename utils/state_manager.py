@@ -1,25 +1,175 @@
 import json
 import os
+import threading
+import time
+from collections.abc import MutableMapping
 from utils.logger import logger
+import utils.constants as const
 
-STATE_FILE = "state.json"
+# State persistence: a compact snapshot (STATE_FILE) plus an append-only journal of changes.
+# save_state() only appends the keys that changed since the last save, as one JSON line. Every
+# STATE_SNAPSHOT_EVERY entries the full state is written to a temp file and renamed over the
+# snapshot (atomic), after which the journal starts over. load_state() reads the snapshot and
+# replays the journal on top of it; a torn last line from a crash mid-append is skipped.
+# Journal entries hold absolute values, so replaying entries that are already contained in the
+# snapshot (crash between snapshot rename and journal truncation) gives the same result.
+
+STATE_FILE = const.STATE_FILE
+JOURNAL_FILE = const.STATE_FILE + ".journal"
+
+_lock = threading.Lock()
+_persisted = {} # State as of the last journal entry (what a restart would load)
+_journal = None # Open append handle
+_entries = 0 # Journal entries since the last snapshot
+_last_fsync = 0.0
+
+def _fsync_dir(path):
+    # Makes the rename itself durable (no-op where directories cannot be opened, e.g. Windows)
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _write_snapshot(state):
+    tmp_file = STATE_FILE + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, STATE_FILE)
+    _fsync_dir(STATE_FILE)
+
+def _open_journal(truncate):
+    global _journal
+    if _journal:
+        _journal.close()
+    _journal = open(JOURNAL_FILE, 'w' if truncate else 'a')
+
+def _compact(state):
+    global _entries, _last_fsync
+    _write_snapshot(state)
+    _open_journal(truncate=True)
+    _entries = 0
+    _last_fsync = time.monotonic()
+
+def _replay(state):
+    if not os.path.exists(JOURNAL_FILE):
+        return 0
+    applied = 0
+    with open(JOURNAL_FILE, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping unreadable entry %s of %s (interrupted write?)", line_number, JOURNAL_FILE)
+                continue
+            state.update(entry.get('set', {}))
+            for key in entry.get('del', []):
+                state.pop(key, None)
+            applied += 1
+    return applied
 
 def load_state():
-    if os.path.exists(STATE_FILE):
+    global _persisted, _entries
+    state = {}
+    with _lock:
+        if os.path.exists(STATE_FILE):
+            try:
+                with open(STATE_FILE, 'r') as f:
+                    state = json.load(f)
+            except Exception as e:
+                logger.error("Error loading state snapshot from %s: %s. Recovering from the journal only.", STATE_FILE, e)
+                state = {}
+        try:
+            replayed = _replay(state)
+        except Exception as e:
+            logger.error("Error replaying state journal %s: %s", JOURNAL_FILE, e)
+            replayed = 0
+        if state or replayed:
+            logger.info("Loaded state from %s (+%s journal entries)", STATE_FILE, replayed)
+        _persisted = dict(state)
+        # Start from a fresh snapshot so the journal only ever holds changes made by this run
         try:
-            with open(STATE_FILE, 'r') as f:
-                state = json.load(f)
-                logger.info(f"Loaded state from {STATE_FILE}")
-                return state
+            _compact(state)
         except Exception as e:
-            logger.error(f"Error loading state from {STATE_FILE}: {e}")
-            return {}
-    return {}
+            logger.error("Error writing state snapshot to %s: %s", STATE_FILE, e)
+            _entries = 0
+    return state
 
 def save_state(state_data):
-    try:
-        with open(STATE_FILE, 'w') as f:
-            json.dump(state_data, f, indent=4)
-        # logger.info(f"Saved state to {STATE_FILE}") # Optional: logging every save might be too verbose
-    except Exception as e:
-        logger.error(f"Error saving state to {STATE_FILE}: {e}") 
\ No newline at end of file
+    """Journals the keys that changed since the last save. O(changed keys), not O(state)."""
+    global _persisted, _entries, _last_fsync
+    with _lock:
+        try:
+            changed = {k: v for k, v in state_data.items() if k not in _persisted or _persisted[k] != v}
+            removed = [k for k in _persisted if k not in state_data]
+            if not changed and not removed:
+                return
+            if _journal is None:
+                _open_journal(truncate=False)
+            entry = {}
+            if changed:
+                entry['set'] = changed
+            if removed:
+                entry['del'] = removed
+            _journal.write(json.dumps(entry, separators=(',', ':')) + "\n")
+            _journal.flush() # In the OS page cache: survives a crash of this process
+            _persisted = dict(state_data) # State values are scalars, a shallow copy is enough
+            _entries += 1
+            # fsync (survives power loss) at most once per interval, so bursts of saves share it
+            if time.monotonic() - _last_fsync >= const.STATE_FSYNC_INTERVAL_SECONDS:
+                os.fsync(_journal.fileno())
+                _last_fsync = time.monotonic()
+            if _entries >= const.STATE_SNAPSHOT_EVERY:
+                _compact(_persisted)
+        except Exception as e:
+            logger.error("Error saving state to %s: %s", JOURNAL_FILE, e)
+
+def close_state():
+    """Writes a final snapshot and closes the journal (call on shutdown)."""
+    global _journal
+    with _lock:
+        try:
+            if _journal is not None:
+                _compact(_persisted)
+                _journal.close()
+                _journal = None
+        except Exception as e:
+            logger.error("Error writing final state snapshot to %s: %s", STATE_FILE, e)
+
+class NamespacedState(MutableMapping):
+    """A dict-like view of one grid's keys inside the shared state (stored as '<prefix><key>').
+
+    Keys stay flat in the root state, so the journal still records one entry per changed key.
+    """
+
+    def __init__(self, root, prefix):
+        self.root = root
+        self.prefix = prefix
+
+    def __getitem__(self, key):
+        return self.root[self.prefix + key]
+
+    def __setitem__(self, key, value):
+        self.root[self.prefix + key] = value
+
+    def __delitem__(self, key):
+        del self.root[self.prefix + key]
+
+    def __contains__(self, key):
+        return self.prefix + key in self.root
+
+    def __iter__(self):
+        return (k[len(self.prefix):] for k in list(self.root) if k.startswith(self.prefix))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))